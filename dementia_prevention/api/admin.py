@@ -1,3 +1,51 @@
 from django.contrib import admin
+from django.utils import timezone
 
-# Register your models here.
+from .models import CognitiveTestQuestion, ScoringRule, Task
+
+
+@admin.register(CognitiveTestQuestion)
+class CognitiveTestQuestionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'question', 'correct_answer', 'question_type', 'difficulty')
+    list_filter = ('question_type', 'difficulty')
+
+
+@admin.register(ScoringRule)
+class ScoringRuleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'factor', 'comparator', 'threshold', 'weight', 'title', 'order', 'active')
+    list_filter = ('factor', 'active')
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'coalesced', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    actions = ['retry']
+
+    @admin.action(description='Run again')
+    def retry(self, request, queryset):
+        # A key has room for one queued task: tasks whose key is already
+        # queued are covered by it, and of several with the same key only
+        # the latest is queued again
+        keys = set(
+            Task.objects.filter(status=Task.QUEUED, dedupe_key__isnull=False)
+            .values_list('dedupe_key', flat=True)
+        )
+        retried, skipped = [], 0
+        for pk, status, key in queryset.exclude(status=Task.RUNNING).order_by('-pk').values_list(
+            'pk', 'status', 'dedupe_key'
+        ):
+            if key and status != Task.QUEUED:
+                if key in keys:
+                    skipped += 1
+                    continue
+                keys.add(key)
+            retried.append(pk)
+
+        Task.objects.filter(pk__in=retried).update(
+            status=Task.QUEUED, attempts=0, run_at=timezone.now(), finished_at=None
+        )
+        message = f'Queued {len(retried)} tasks to run again'
+        if skipped:
+            message += f', skipped {skipped} whose key is already queued'
+        self.message_user(request, message)
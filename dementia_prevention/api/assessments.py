@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.utils import timezone
+
+from .models import LIFESTYLE_FACTORS, BrainHealthAssessment, CognitiveTestResult, LifestyleData, Patient
+from .reconcile import reconcile_recommendations
+from .rules import get_scoring_rules
+from .snapshots import refresh_patient_snapshot
+from .taskqueue import schedule
+
+
+def lifestyle_values(entry):
+    return {factor: getattr(entry, factor) for factor in LIFESTYLE_FACTORS}
+
+
+def recompute_assessment(patient):
+    """
+    Score the patient's latest test and lifestyle entry into today's
+    assessment and bring the open recommendations in line with it
+    """
+    latest_test = CognitiveTestResult.objects.filter(patient=patient).order_by('-date_taken').first()
+    latest_lifestyle = LifestyleData.objects.filter(user_id=patient.user_id).order_by('-date').first()
+    assessment = None
+
+    if latest_test and latest_lifestyle:
+        evaluation = get_scoring_rules().evaluate(latest_test.score, lifestyle_values(latest_lifestyle))
+
+        assessment, created = BrainHealthAssessment.objects.update_or_create(
+            patient=patient,
+            date=timezone.localdate(),
+            defaults={
+                'score': evaluation.score,
+                'cognitive_score': latest_test.score,
+                'lifestyle_data': latest_lifestyle,
+                'rule_version': evaluation.version
+            }
+        )
+        reconcile_recommendations(patient, evaluation.recommendations)
+
+    refresh_patient_snapshot(patient)
+    return assessment
+
+
+def lock_patient(patient_id):
+    """
+    Lock the patient's row until the transaction ends. Everything that
+    writes assessments takes it first, so recomputes of one patient run one
+    at a time instead of racing on update_or_create.
+    """
+    return Patient.objects.select_for_update().filter(pk=patient_id).first()
+
+
+def schedule_recompute(patient):
+    """
+    Queue a recompute of the patient's assessment. Triggers within
+    RECOMPUTE_DEBOUNCE seconds of each other are coalesced into one run with
+    the latest inputs, delayed by at most RECOMPUTE_MAX_DELAY.
+    """
+    return schedule(
+        'recompute_assessment',
+        key=f'recompute_assessment:{patient.pk}',
+        delay=getattr(settings, 'RECOMPUTE_DEBOUNCE', 5),
+        max_delay=getattr(settings, 'RECOMPUTE_MAX_DELAY', 60),
+        patient_id=patient.pk
+    )
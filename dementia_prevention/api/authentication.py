@@ -0,0 +1,177 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+
+from .claims import claims_cookie, claims_user, read_claims
+from .roles import PROFILES
+
+
+class LocalTokenCache:
+    """
+    Process-local LRU of authenticated tokens. Entries expire `ttl` seconds
+    after they were stored, which bounds how long another worker can keep
+    accepting a token whose revocation it didn't see.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # cache key -> (expires, user id, payload)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, user_id, payload, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, user_id, payload)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[1] == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_tokens = LocalTokenCache(getattr(settings, 'AUTH_TOKEN_LOCAL_CACHE_SIZE', 10000))
+
+
+def _cache_key(token_key):
+    # Keep the credential itself out of the cache server's key space
+    return 'auth-token:' + hashlib.sha256(token_key.encode()).hexdigest()
+
+
+def _user_cache_key(user_id):
+    return f'auth-token-user:{user_id}'
+
+
+def get_cached_token(token_key):
+    key = _cache_key(token_key)
+    payload = local_tokens.get(key)
+    if payload is None:
+        payload = cache.get(key)
+        if payload is None:
+            return None
+        token = pickle.loads(payload)
+        local_tokens.set(key, token.user_id, payload, getattr(settings, 'AUTH_TOKEN_LOCAL_TTL', 10))
+        return token
+    # Every request gets its own copy, views are free to modify request.user
+    return pickle.loads(payload)
+
+
+def _cache_ttl():
+    local_ttl = getattr(settings, 'AUTH_TOKEN_LOCAL_TTL', 10)
+    if not getattr(settings, 'SHARED_CACHE', False):
+        # Invalidations can't reach the per-process caches of other workers
+        return local_ttl
+    return max(getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 300), local_ttl)
+
+
+def cache_token(token):
+    key = _cache_key(token.key)
+    payload = pickle.dumps(token, pickle.HIGHEST_PROTOCOL)
+    cache.set_many({key: payload, _user_cache_key(token.user_id): key}, _cache_ttl())
+    local_tokens.set(key, token.user_id, payload, getattr(settings, 'AUTH_TOKEN_LOCAL_TTL', 10))
+
+
+def _drop_token(token_key):
+    key = _cache_key(token_key)
+    cache.delete(key)
+    local_tokens.delete(key)
+
+
+def _drop_user(user_id):
+    key = cache.get(_user_cache_key(user_id))
+    if key is not None:
+        cache.delete_many([key, _user_cache_key(user_id)])
+    local_tokens.delete_user(user_id)
+
+
+def invalidate_token(token_key):
+    """Forget a token, now and again once the transaction removing it commits"""
+    _drop_token(token_key)
+    transaction.on_commit(lambda: _drop_token(token_key))
+
+
+def invalidate_user_tokens(user_id):
+    """Forget the cached tokens of a user whose account or role changed"""
+    _drop_user(user_id)
+    transaction.on_commit(lambda: _drop_user(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that remembers tokens in a process-local LRU in
+    front of the cache. The user comes with both profiles loaded, so a
+    cached request authenticates and resolves its role without a query.
+    Signals invalidate the entries when the token is deleted or the user or
+    their profiles change (see api/signals.py); queryset updates bypass
+    them and must call invalidate_user_tokens(). Other workers see an
+    invalidation within AUTH_TOKEN_LOCAL_TTL, as long as the cache is shared
+    (SHARED_CACHE); otherwise nothing is cached for longer than that.
+    """
+
+    def authenticate_credentials(self, key):
+        token = get_cached_token(key)
+        if token is not None:
+            return token.user, token
+
+        model = self.get_model()
+        try:
+            token = model.objects.select_related(
+                'user', *(f'user__{accessor}' for accessor in PROFILES)
+            ).get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        cache_token(token)
+        return token.user, token
+
+
+class ClaimsAuthentication(SessionAuthentication):
+    """
+    Authenticates session users from the signed claims cookie set by
+    ClaimsMiddleware, without reading the session or the user. Falls through
+    to SessionAuthentication when the claims are missing, expired or revoked.
+    """
+
+    def authenticate(self, request):
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return None
+        claims = read_claims(request.COOKIES.get(claims_cookie()))
+        if claims is None:
+            return None
+
+        self.enforce_csrf(request)
+        # Tells ClaimsMiddleware the claims are still good
+        request._request.claims = claims
+        return claims_user(claims), None
@@ -0,0 +1,410 @@
+import json
+import math
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener, urlopen
+
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .middleware import QueryTimer
+from .models import Caregiver, Patient, PendingVerification, Recommendation
+from .question_bank import get_question_bank
+from .urls import urlpatterns
+
+# Password of every account made by generate_population, used to log in
+POPULATION_PASSWORD = 'benchmark'
+
+BenchmarkUser = namedtuple('BenchmarkUser', ['username', 'token', 'patient_id', 'recommendation_ids'])
+
+# One request of an endpoint:
+# - role: whose account it runs as ('patient' or 'caregiver')
+# - kwargs/data: callable(user, population) -> URL kwargs / body (query string for GET)
+# - write: changes data, only run with --include-writes
+# - authenticate: send the user's API token
+# - session: log the user in with a session cookie instead (session-only views)
+Scenario = namedtuple(
+    'Scenario', ['method', 'role', 'kwargs', 'data', 'write', 'authenticate', 'session'],
+    defaults=[None, None, False, True, False]
+)
+
+Sample = namedtuple('Sample', ['status', 'seconds', 'queries'])
+
+
+def _credentials(user, population):
+    return {'username': user.username, 'password': POPULATION_PASSWORD}
+
+
+def _answers(user, population):
+    return {'answers': population.answers}
+
+
+def _lifestyle_batch(user, population):
+    today = timezone.localdate()
+    return {'entries': [
+        {'date': str(today - timedelta(days=offset)), 'physical_activity': 5, 'good_sleep': 6}
+        for offset in range(30)
+    ]}
+
+
+def _signup(user, population):
+    name = f'bench-{uuid.uuid4().hex[:12]}'
+    return {'username': name, 'password': POPULATION_PASSWORD, 'email': f'{name}@example.com'}
+
+
+def _random_patient(user, population):
+    return {'patient_id': population.rng_choice(population.patients).patient_id}
+
+
+def _verification(user, population):
+    """Code of a pending verification of a random patient, as send_verification leaves it"""
+    patient = Patient.objects.select_related('user').get(pk=population.rng_choice(population.patients).patient_id)
+    code = uuid.uuid4().hex[:6]
+    PendingVerification.objects.update_or_create(
+        caregiver=Caregiver.objects.get(user__username=user.username), patient=patient,
+        defaults={'verification_code': code}
+    )
+    return {'patient_email': patient.user.email, 'verification_code': code}
+
+
+def _unconnected_patient(user, population):
+    """E-mail of a random patient the caregiver isn't connected to yet"""
+    emails = list(
+        Patient.objects.filter(pk__in=[patient.patient_id for patient in population.patients])
+        .exclude(caregivers__user__username=user.username)
+        .values_list('user__email', flat=True)
+    )
+    return {'patient_email': population.rng_choice(emails or [''])}
+
+
+# URL name -> Scenario, for every route in api/urls.py
+SCENARIOS = {
+    'signup_view': Scenario('POST', None, data=_signup, write=True, authenticate=False),
+    'login_view': Scenario('POST', 'patient', data=_credentials, authenticate=False),
+    'user_dashboard': Scenario('GET', 'patient'),
+    'caregiver_dashboard': Scenario('POST', 'caregiver'),
+    'cognitive_test_questions': Scenario('GET', 'patient'),
+    'submit_cognitive_test': Scenario('POST', 'patient', data=_answers, write=True),
+    'cognitive_test_history': Scenario('GET', 'patient'),
+    'lifestyle_data': Scenario('GET', 'patient', authenticate=False, session=True),
+    'lifestyle_data_bulk': Scenario('POST', 'patient', data=_lifestyle_batch, write=True),
+    'lifestyle_stats': Scenario('GET', 'patient', data=lambda user, population: {'period': '30d'}),
+    'lifestyle-trends': Scenario('GET', 'patient', data=lambda user, population: {'group_by': 'week'}),
+    'export_history': Scenario('GET', 'patient', kwargs=lambda user, population: {'dataset': 'lifestyle'}),
+    'brain_health_history': Scenario('GET', 'patient'),
+    'recommendations_list': Scenario('GET', 'patient'),
+    'recommendation_detail': Scenario(
+        'GET', 'patient',
+        kwargs=lambda user, population: {'pk': population.rng_choice(user.recommendation_ids or [0])}
+    ),
+    'sync_changes': Scenario('GET', 'patient', data=lambda user, population: {'since': 0}),
+    'send_verification': Scenario('POST', 'caregiver', data=_unconnected_patient, write=True),
+    'verify_patient': Scenario('POST', 'caregiver', data=_verification, write=True),
+    'caregiver_patients': Scenario('GET', 'caregiver'),
+    'add_patient': Scenario('POST', 'caregiver', data=_random_patient, write=True),
+    'remove_patient': Scenario('DELETE', 'caregiver', kwargs=_random_patient, write=True),
+    'api_token_auth': Scenario('POST', 'patient', data=_credentials, authenticate=False),
+    'check-auth': Scenario('GET', 'patient'),
+    'metrics': Scenario('GET', None, authenticate=False),
+}
+
+# URL name -> why it is not benchmarked
+SKIPPED = {
+    'login': 'HTML form of the session login views',
+    'logout': 'HTML form of the session login views',
+    'download_profile': 'needs a stored profile and a staff account',
+}
+
+
+def uncovered_endpoints():
+    """URL names of api/urls.py with neither a scenario nor a reason to skip them"""
+    return sorted(
+        pattern.name for pattern in urlpatterns
+        if pattern.name not in SCENARIOS and pattern.name not in SKIPPED
+    )
+
+
+class Population:
+    """Accounts of a generated population the benchmark sends requests as"""
+
+    def __init__(self, prefix, limit, rng):
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.patients = self._load(f'{prefix}-patient-', limit, 'user__patient_profile__id')
+        self.caregivers = self._load(f'{prefix}-caregiver-', limit, None)
+        self.answers = [
+            {'question_id': question_id, 'answer': answer}
+            for question_id, answer in get_question_bank().answer_key.items()
+        ]
+
+    def _load(self, username_prefix, limit, patient_field):
+        fields = ['key', 'user__username'] + ([patient_field] if patient_field else [])
+        rows = list(
+            Token.objects.filter(user__username__startswith=username_prefix)
+            .order_by('user_id')
+            .values_list(*fields)[:limit]
+        )
+        recommendation_ids = {}
+        if patient_field:
+            owners = Recommendation.objects.filter(patient_id__in=[row[2] for row in rows])
+            for patient_id, recommendation_id in owners.values_list('patient_id', 'id'):
+                recommendation_ids.setdefault(patient_id, []).append(recommendation_id)
+        return [
+            BenchmarkUser(
+                username=row[1], token=row[0],
+                patient_id=row[2] if patient_field else None,
+                recommendation_ids=recommendation_ids.get(row[2], []) if patient_field else []
+            )
+            for row in rows
+        ]
+
+    def rng_choice(self, items):
+        with self.lock:
+            return self.rng.choice(items)
+
+    def user(self, role):
+        if role is None:
+            return None
+        users = self.patients if role == 'patient' else self.caregivers
+        return self.rng_choice(users) if users else None
+
+
+class InProcessTarget:
+    """Sends requests through Django's test client, counting queries per request"""
+
+    name = 'in-process'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def send(self, method, path, data, token, session_user=None):
+        client = self.client(session_user)
+        client.credentials(**({'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}))
+
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            if method == 'GET':
+                response = client.get(path, data)
+            else:
+                response = client.generic(method, path, json.dumps(data or {}), content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return Sample(response.status_code, time.perf_counter() - start, timer.count)
+
+    def client(self, session_user):
+        """This thread's client, logged in as `session_user` if given"""
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {}
+        client = clients.get(session_user)
+        if client is None:
+            # Server errors come back as 500 responses instead of exceptions
+            client = clients[session_user] = APIClient(raise_request_exception=False)
+            if session_user:
+                client.login(username=session_user, password=POPULATION_PASSWORD)
+        return client
+
+    def query_counts(self):
+        return None
+
+    def close(self):
+        connection.close()
+
+
+class HttpTarget:
+    """
+    Sends requests to a running server. Queries per request come from the
+    server's metrics/ endpoint when the benchmark is allowed to read it.
+    """
+
+    name = 'http'
+    METRIC_LINE = re.compile(r'^(db_queries_total|http_requests_total)\{(.*)\} (\S+)$')
+    VIEW_LABEL = re.compile(r'view="([^"]*)"')
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session_cookie(self, username):
+        """Cookie header of a session of `username`, logged in through login_view"""
+        with self.lock:
+            if username not in self.sessions:
+                cookies = CookieJar()
+                opener = build_opener(HTTPCookieProcessor(cookies))
+                body = json.dumps({'username': username, 'password': POPULATION_PASSWORD}).encode()
+                request = Request(
+                    self.base_url + reverse('login_view'), data=body, method='POST',
+                    headers={'Accept': 'application/json', 'Content-Type': 'application/json'}
+                )
+                with opener.open(request) as response:
+                    response.read()
+                self.sessions[username] = '; '.join(f'{cookie.name}={cookie.value}' for cookie in cookies)
+            return self.sessions[username]
+
+    def send(self, method, path, data, token, session_user=None):
+        url = self.base_url + path
+        body = None
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        if session_user:
+            headers['Cookie'] = self.session_cookie(session_user)
+        if method == 'GET':
+            if data:
+                url = f'{url}?{urlencode(data)}'
+        else:
+            body = json.dumps(data or {}).encode()
+            headers['Content-Type'] = 'application/json'
+
+        start = time.perf_counter()
+        try:
+            with urlopen(Request(url, data=body, headers=headers, method=method)) as response:
+                response.read()
+                status = response.status
+        except HTTPError as e:
+            e.read()
+            status = e.code
+        return Sample(status, time.perf_counter() - start, None)
+
+    def query_counts(self):
+        """{view: (requests, queries)} read from the server's metrics"""
+        try:
+            with urlopen(self.base_url + reverse('metrics')) as response:
+                text = response.read().decode()
+        except (HTTPError, OSError):
+            return None
+        counts = {}
+        for line in text.splitlines():
+            match = self.METRIC_LINE.match(line)
+            if not match:
+                continue
+            view = self.VIEW_LABEL.search(match.group(2))
+            if not view:
+                continue
+            requests, queries = counts.get(view.group(1), (0, 0))
+            if match.group(1) == 'http_requests_total':
+                requests += float(match.group(3))
+            else:
+                queries += float(match.group(3))
+            counts[view.group(1)] = (requests, queries)
+        return counts
+
+    def close(self):
+        pass
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+
+def run_endpoint(target, population, name, scenario, requests, concurrency):
+    """Send `requests` requests of one scenario from `concurrency` threads"""
+    work = queue.Queue()
+    for _ in range(requests):
+        user = population.user(scenario.role)
+        kwargs = scenario.kwargs(user, population) if scenario.kwargs else {}
+        data = scenario.data(user, population) if scenario.data else None
+        token = user.token if user and scenario.authenticate else None
+        session_user = user.username if user and scenario.session else None
+        work.put((reverse(name, kwargs=kwargs), data, token, session_user))
+
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                try:
+                    path, data, token, session_user = work.get_nowait()
+                except queue.Empty:
+                    return
+                sample = target.send(scenario.method, path, data, token, session_user)
+                with lock:
+                    samples.append(sample)
+        finally:
+            target.close()
+
+    before = target.query_counts()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = target.query_counts()
+
+    if not samples:
+        raise RuntimeError(f'No request of {name} completed')
+    latencies = sorted(sample.seconds * 1000 for sample in samples)
+    queries = [sample.queries for sample in samples if sample.queries is not None]
+    queries_per_request = sum(queries) / len(queries) if queries else None
+    if queries_per_request is None and before is not None and after is not None:
+        requests_before, queries_before = before.get(name, (0, 0))
+        requests_after, queries_after = after.get(name, (0, 0))
+        if requests_after > requests_before:
+            queries_per_request = (queries_after - queries_before) / (requests_after - requests_before)
+
+    return {
+        'method': scenario.method,
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample.status >= 500),
+        'statuses': sorted({sample.status for sample in samples}),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'queries_per_request': round(queries_per_request, 2) if queries_per_request is not None else None,
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+    }
+
+
+def find_regressions(results, baseline, tolerance, query_tolerance=0.5, min_delta_ms=2.0):
+    """
+    Endpoints slower or chattier than in `baseline`: p95 latency or
+    throughput worse by more than `tolerance` (a fraction), or more than
+    `query_tolerance` extra queries per request. Latency changes under
+    `min_delta_ms` are noise and never flagged.
+    """
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        if (
+            current['p95_ms'] > previous['p95_ms'] * (1 + tolerance)
+            and current['p95_ms'] - previous['p95_ms'] >= min_delta_ms
+        ):
+            regressions.append(f'{name}: p95 {previous["p95_ms"]} ms -> {current["p95_ms"]} ms')
+        if previous['throughput_rps'] and current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: throughput {previous["throughput_rps"]} -> {current["throughput_rps"]} req/s'
+            )
+        if (
+            current['queries_per_request'] is not None and previous['queries_per_request'] is not None
+            and current['queries_per_request'] > previous['queries_per_request'] + query_tolerance
+        ):
+            regressions.append(
+                f'{name}: queries per request {previous["queries_per_request"]} -> '
+                f'{current["queries_per_request"]}'
+            )
+        if current['errors'] > previous['errors']:
+            regressions.append(f'{name}: server errors {previous["errors"]} -> {current["errors"]}')
+    return regressions
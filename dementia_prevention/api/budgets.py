@@ -0,0 +1,10 @@
+def query_budget(queries):
+    """
+    Declare the most SQL queries one request of the decorated view may run
+    once the client's token is cached. Goes above @api_view; QueryBudgetTests
+    checks every budget with 1, 10 and 100 related rows.
+    """
+    def declare(view):
+        view.query_budget = queries
+        return view
+    return declare
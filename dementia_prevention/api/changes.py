@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import (
+    BrainHealthAssessment,
+    ChangeLogEntry,
+    CognitiveTestResult,
+    LifestyleData,
+    Recommendation,
+    SyncCounter
+)
+from .serializers import (
+    BrainHealthAssessmentSerializer,
+    CognitiveTestResultSerializer,
+    LifestyleDataSerializer,
+    RecommendationSerializer
+)
+
+# feed name -> (model, serializer)
+SYNCED_MODELS = {
+    'lifestyle_data': (LifestyleData, LifestyleDataSerializer),
+    'cognitive_test': (CognitiveTestResult, CognitiveTestResultSerializer),
+    'assessment': (BrainHealthAssessment, BrainHealthAssessmentSerializer),
+    'recommendation': (Recommendation, RecommendationSerializer),
+}
+
+FEED_NAMES = {model: name for name, (model, serializer) in SYNCED_MODELS.items()}
+
+
+def owner_id(instance):
+    """Id of the user a synced row belongs to"""
+    if isinstance(instance, LifestyleData):
+        return instance.user_id
+    return instance.patient.user_id
+
+
+def record_changes(model, user_id, object_ids, operation='upsert'):
+    """
+    Append change-log entries for rows of `model` written without model
+    signals (bulk_create, bulk_update, QuerySet.update).
+    """
+    record_owned_changes(model, [(user_id, object_id) for object_id in object_ids], operation)
+
+
+def record_owned_changes(model, rows, operation='upsert'):
+    """record_changes for rows of several users, given as (user id, object id) pairs"""
+    rows = list(rows)
+    if not rows:
+        return
+    counts = {}
+    for user_id, object_id in rows:
+        counts[user_id] = counts.get(user_id, 0) + 1
+
+    # Joins the caller's transaction, if any: the tokens stay reserved, and
+    # the counters locked, until the entries commit
+    with transaction.atomic(savepoint=False):
+        next_tokens = allocate_tokens(counts)
+        entries = []
+        for user_id, object_id in rows:
+            entries.append(ChangeLogEntry(
+                user_id=user_id, token=next_tokens[user_id], model=FEED_NAMES[model],
+                object_id=object_id, operation=operation
+            ))
+            next_tokens[user_id] += 1
+        ChangeLogEntry.objects.bulk_create(entries)
+
+
+def allocate_tokens(counts):
+    """
+    Reserve counts[user_id] sync tokens for each user; returns the first
+    token of each user's range.
+
+    Tokens are not ids: an id is assigned at insert, so a transaction that
+    inserts first and commits last would publish an entry below a token a
+    client has already synced past. The counter row stays locked by the
+    UPDATE until the transaction ends, so a user's writers take tokens one
+    at a time, in commit order. Must run in a transaction.
+    """
+    # One lock order for every writer, so two of them never deadlock
+    for user_id in sorted(counts):
+        counter = SyncCounter.objects.filter(user_id=user_id)
+        if counter.update(last_token=F('last_token') + counts[user_id]):
+            continue
+        try:
+            with transaction.atomic():
+                SyncCounter.objects.create(user_id=user_id, last_token=counts[user_id])
+        except IntegrityError:
+            # A concurrent writer created it first
+            counter.update(last_token=F('last_token') + counts[user_id])
+    last_tokens = dict(SyncCounter.objects.filter(user_id__in=counts).values_list('user_id', 'last_token'))
+    return {user_id: last_tokens[user_id] - count + 1 for user_id, count in counts.items()}
+
+
+def latest_token(user):
+    return SyncCounter.objects.filter(user=user).values_list('last_token', flat=True).first() or 0
+
+
+def read_changes(user, since, limit=None):
+    """
+    Changes to `user`'s synced rows after the sync token `since`.
+
+    Returns `(changes, next_token, has_more)`. Several writes to the same row
+    collapse into one change carrying the row's current state; rows deleted
+    since come back as tombstones.
+    """
+    limit = limit or getattr(settings, 'CHANGE_FEED_PAGE_SIZE', 500)
+    entries = list(
+        ChangeLogEntry.objects.filter(user=user, token__gt=since)
+        .order_by('token')
+        .values_list('token', 'model', 'object_id')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], since, False
+
+    # Last entry per row wins
+    latest = {}
+    for token, model, object_id in entries:
+        latest.pop((model, object_id), None)
+        latest[(model, object_id)] = token
+
+    rows = {}
+    for name, (model, serializer) in SYNCED_MODELS.items():
+        ids = [object_id for (model_name, object_id) in latest if model_name == name]
+        if ids:
+            rows[name] = model.objects.in_bulk(ids)
+
+    changes = []
+    for (name, object_id), token in latest.items():
+        row = rows.get(name, {}).get(object_id)
+        change = {'token': token, 'model': name, 'id': object_id}
+        if row is None:
+            change['op'] = 'delete'
+        else:
+            change['op'] = 'upsert'
+            change['data'] = SYNCED_MODELS[name][1](row).data
+        changes.append(change)
+
+    return changes, entries[-1][0], has_more
@@ -0,0 +1,93 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Caregiver, Patient
+
+CLAIMS_SALT = 'api.claims'
+
+
+def _ttl():
+    return getattr(settings, 'AUTH_CLAIMS_TTL', 300)
+
+
+def _revoked_key(user_id):
+    return f'auth-claims-revoked:{user_id}'
+
+
+def claims_cookie():
+    return getattr(settings, 'AUTH_CLAIMS_COOKIE', 'prodim_claims')
+
+
+def claims_enabled():
+    """
+    Claims are only trusted with a shared cache: revocations must reach
+    every worker, and a per-process cache would let the others keep
+    honouring a revoked cookie until it expires
+    """
+    return getattr(settings, 'SHARED_CACHE', False)
+
+
+def issue_claims(user, role):
+    """Signed claims of a session user, for the claims cookie"""
+    return signing.dumps({
+        'uid': user.pk,
+        'usr': user.username,
+        'stf': user.is_staff,
+        'act': user.is_active,
+        'p': role.patient.pk if role.is_patient else None,
+        'c': role.caregiver.pk if role.is_caregiver else None,
+        'iat': time.time(),
+    }, salt=CLAIMS_SALT, compress=True)
+
+
+def read_claims(value):
+    """
+    Claims of a cookie value, or None when it is missing, forged, expired,
+    revoked or of an inactive user, or when claims are disabled
+    """
+    if not value or not claims_enabled():
+        return None
+    try:
+        claims = signing.loads(value, salt=CLAIMS_SALT, max_age=_ttl())
+    except signing.BadSignature:
+        return None
+    if not claims.get('act'):
+        return None
+    revoked = cache.get(_revoked_key(claims['uid']))
+    if revoked is not None and claims['iat'] <= revoked:
+        return None
+    return claims
+
+
+def revoke_claims(user_id):
+    """Reject every claims payload of the user issued until now"""
+    # Older claims expire on their own after the TTL, the marker can go with them
+    cache.set(_revoked_key(user_id), time.time(), _ttl())
+
+
+def _set_profile(user, accessor, model, pk):
+    profile = model.from_db(DEFAULT_DB_ALIAS, ['id', 'user_id'], [pk, user.pk]) if pk else None
+    if profile is not None:
+        model.user.field.set_cached_value(profile, user)
+    getattr(User, accessor).related.set_cached_value(user, profile)
+
+
+def claims_user(claims):
+    """
+    The user the claims describe, with both profiles cached so the role
+    resolves without a query. Fields the claims don't carry are deferred and
+    load from the database on first access, like those of an .only() query.
+    """
+    user = User.from_db(
+        DEFAULT_DB_ALIAS,
+        ['id', 'username', 'is_staff', 'is_active'],
+        [claims['uid'], claims['usr'], claims['stf'], claims['act']]
+    )
+    _set_profile(user, 'patient_profile', Patient, claims['p'])
+    _set_profile(user, 'caregiver_profile', Caregiver, claims['c'])
+    return user
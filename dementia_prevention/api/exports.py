@@ -0,0 +1,76 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import CognitiveTestResult, LifestyleData
+
+# dataset name -> (model, owner lookup, exported columns, ordering)
+DATASETS = {
+    'lifestyle': (
+        LifestyleData,
+        'user',
+        ('id', 'date', 'created_at', 'physical_activity', 'healthy_diet',
+         'social_engagement', 'good_sleep', 'smoking', 'alcohol', 'stress', 'notes'),
+        ('date', 'id'),
+    ),
+    'cognitive': (
+        CognitiveTestResult,
+        'patient',
+        ('id', 'date_taken', 'score', 'total_questions', 'correct_answers', 'details'),
+        ('date_taken', 'id'),
+    ),
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class _Echo:
+    """File-like object that hands back what csv.writer writes to it"""
+    def write(self, value):
+        return value
+
+
+def export_rows(dataset, owner):
+    """
+    Iterate the rows of `dataset` belonging to `owner` (a User for lifestyle
+    data, a Patient for cognitive tests) as tuples, oldest first.
+
+    Rows are read with a chunked iterator (a server-side cursor on Postgres),
+    so memory use does not depend on the length of the history.
+    """
+    model, owner_field, fields, ordering = DATASETS[dataset]
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    return (
+        model.objects.filter(**{owner_field: owner})
+        .order_by(*ordering)
+        .values_list(*fields)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def iter_ndjson(dataset, rows):
+    fields = DATASETS[dataset][2]
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_csv(dataset, rows):
+    fields = DATASETS[dataset][2]
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([
+            json.dumps(value) if isinstance(value, (list, dict)) else value
+            for value in row
+        ])
+
+
+RENDERERS = {
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
@@ -0,0 +1,56 @@
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotentRequest
+
+# Clients send the key as an Idempotency-Key header or an idempotency_key field
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+
+
+def idempotency_key(request):
+    """The request's idempotency key, or None. Raises ValueError for unusable keys."""
+    key = request.META.get(IDEMPOTENCY_HEADER) or request.data.get(IDEMPOTENCY_FIELD)
+    if key is None:
+        return None
+    key = str(key).strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'Idempotency key must be 1 to {MAX_KEY_LENGTH} characters')
+    return key
+
+
+def request_hash(data):
+    payload = {name: value for name, value in data.items() if name != IDEMPOTENCY_FIELD}
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, cls=DjangoJSONEncoder).encode()
+    ).hexdigest()
+
+
+def stored_response(user, endpoint, key, digest):
+    """The response of an earlier request with this key, or None"""
+    record = IdempotentRequest.objects.filter(user=user, endpoint=endpoint, key=key).first()
+    if record is None:
+        return None
+    if record.request_hash != digest:
+        return Response(
+            {'error': 'Idempotency key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def store_response(user, endpoint, key, digest, body, status_code=status.HTTP_200_OK):
+    """
+    Remember the response for retries. Call it inside the transaction of the
+    write: a concurrent request with the same key then fails on the unique
+    constraint and rolls back instead of writing twice.
+    """
+    IdempotentRequest.objects.create(
+        user=user, endpoint=endpoint, key=key, request_hash=digest,
+        status_code=status_code, response=body
+    )
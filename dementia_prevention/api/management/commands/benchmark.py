@@ -0,0 +1,116 @@
+import json
+import platform
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.benchmarks import (
+    SCENARIOS,
+    SKIPPED,
+    HttpTarget,
+    InProcessTarget,
+    Population,
+    find_regressions,
+    run_endpoint,
+    uncovered_endpoints
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test every endpoint of api/urls.py as users of a generated population and '
+        'report latency percentiles, queries per request and throughput'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint (default: 100)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients (default: 4)')
+        parser.add_argument('--prefix', default='synthetic', help='Username prefix of the generated population')
+        parser.add_argument('--users', type=int, default=500, help='Accounts per role to spread requests over')
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server; without it requests go through the Django test client'
+        )
+        parser.add_argument(
+            '--endpoint', action='append', dest='endpoints',
+            help='URL name to benchmark (repeatable, default: all)'
+        )
+        parser.add_argument('--include-writes', action='store_true', help='Also run endpoints that change data')
+        parser.add_argument('--output', help='Save the results as a JSON baseline at this path')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed p95/throughput change against the baseline, as a fraction (default: 0.25)'
+        )
+        parser.add_argument(
+            '--query-tolerance', type=float, default=0.5,
+            help='Allowed increase of queries per request against the baseline (default: 0.5)'
+        )
+        parser.add_argument(
+            '--min-delta-ms', type=float, default=2.0,
+            help='p95 changes smaller than this are never flagged (default: 2.0)'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the user and data choices')
+
+    def handle(self, *args, **options):
+        for name in uncovered_endpoints():
+            self.stderr.write(self.style.WARNING(f'{name}: no benchmark scenario'))
+
+        names = options['endpoints'] or list(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'No scenario for {", ".join(unknown)}')
+        if not options['include_writes']:
+            names = [name for name in names if not SCENARIOS[name].write]
+
+        population = Population(options['prefix'], options['users'], random.Random(options['seed']))
+        if not population.patients or not population.caregivers:
+            raise CommandError(
+                f'No "{options["prefix"]}" population found, create one with generate_population'
+            )
+
+        target = HttpTarget(options['url']) if options['url'] else InProcessTarget()
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'target': target.name,
+            'python': platform.python_version(),
+            'requests_per_endpoint': options['requests'],
+            'concurrency': options['concurrency'],
+            'endpoints': {},
+        }
+
+        self.stdout.write(
+            f'{"endpoint":<28}{"req":>6}{"err":>5}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+            f'{"queries":>9}{"req/s":>9}'
+        )
+        for name in names:
+            result = run_endpoint(
+                target, population, name, SCENARIOS[name], options['requests'], options['concurrency']
+            )
+            results['endpoints'][name] = result
+            queries = result['queries_per_request']
+            self.stdout.write(
+                f'{name:<28}{result["requests"]:>6}{result["errors"]:>5}{result["p50_ms"]:>9}'
+                f'{result["p95_ms"]:>9}{result["p99_ms"]:>9}{"-" if queries is None else queries:>9}'
+                f'{result["throughput_rps"]:>9}'
+            )
+        for name, reason in SKIPPED.items():
+            self.stdout.write(f'{name:<28}skipped: {reason}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Saved results to {options["output"]}')
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = find_regressions(
+                results, baseline, options['tolerance'], options['query_tolerance'], options['min_delta_ms']
+            )
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(self.style.ERROR(f'REGRESSION {regression}'))
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
@@ -0,0 +1,259 @@
+import random
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.benchmarks import POPULATION_PASSWORD
+from api.models import (
+    LIFESTYLE_FACTORS,
+    BrainHealthAssessment,
+    Caregiver,
+    CognitiveTestResult,
+    LifestyleData,
+    Patient,
+    Recommendation
+)
+from api.question_bank import get_question_bank
+from api.rollups import rebuild_lifestyle_rollups, refresh_lifestyle_stats
+from api.snapshots import refresh_patient_snapshots
+
+CATEGORIES = [choice for choice, label in Recommendation.CATEGORY_CHOICES]
+PRIORITIES = [choice for choice, label in Recommendation.PRIORITY_CHOICES]
+
+
+def population_users(prefix, role):
+    return User.objects.filter(username__startswith=f'{prefix}-{role}-')
+
+
+# Held while auto_now_add is switched off, see explicit_dates
+_explicit_dates_lock = threading.RLock()
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """
+    Let bulk_create keep back-dated values of auto_now_add fields.
+
+    bulk_create always stamps those fields, so they are switched off for
+    the duration of the block. Field objects are shared by the whole
+    process: every save in any thread of it keeps explicit dates until the
+    block exits, so only use this in commands and tests, never in code that
+    serves requests. Blocks run one at a time and always put the original
+    flags back, even when the block raises.
+    """
+    with _explicit_dates_lock:
+        original = [field.auto_now_add for field in fields]
+        for field in fields:
+            field.auto_now_add = False
+        try:
+            yield
+        finally:
+            for field, auto_now_add in zip(fields, original):
+                field.auto_now_add = auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate a synthetic population of patients, caregivers and their history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000, help='Patients to create (default: 1000)')
+        parser.add_argument('--caregivers', type=int, default=50, help='Caregivers to create (default: 50)')
+        parser.add_argument('--days', type=int, default=365, help='Days of lifestyle history per patient (default: 365)')
+        parser.add_argument(
+            '--adherence', type=float, default=0.8,
+            help='Share of days each patient logs lifestyle data (default: 0.8)'
+        )
+        parser.add_argument(
+            '--test-interval', type=int, default=30,
+            help='Average days between cognitive tests of a patient (default: 30)'
+        )
+        parser.add_argument(
+            '--recommendations', type=int, default=8,
+            help='Recommendations per patient (default: 8)'
+        )
+        parser.add_argument(
+            '--patients-per-caregiver', type=int, default=20,
+            help='Patients connected to each caregiver (default: 20)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Patients written per transaction (default: 500)')
+        parser.add_argument('--prefix', default='synthetic', help='Username prefix of the generated accounts')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible populations')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete a previously generated population with the same prefix first'
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        self.rng = random.Random(options['seed'])
+        self.options = options
+
+        existing = population_users(prefix, 'patient') | population_users(prefix, 'caregiver')
+        if existing.exists():
+            if not options['clear']:
+                raise CommandError(f'A "{prefix}" population already exists, use --clear to replace it')
+            deleted, _ = existing.delete()
+            self.stdout.write(f'Deleted {deleted} rows of the previous "{prefix}" population')
+
+        self.password = make_password(POPULATION_PASSWORD)
+        self.today = timezone.localdate()
+        self.answers = self.sample_answers()
+
+        patient_ids = []
+        created = 0
+        while created < options['patients']:
+            size = min(options['chunk_size'], options['patients'] - created)
+            with transaction.atomic():
+                patient_ids.extend(self.create_patients(created, size))
+            created += size
+            self.stdout.write(f'{created}/{options["patients"]} patients')
+
+        with transaction.atomic():
+            self.create_caregivers(patient_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(patient_ids)} patients and {options["caregivers"]} caregivers '
+            f'(password "{POPULATION_PASSWORD}")'
+        ))
+
+    def sample_answers(self):
+        """A realistic spread of answer sheets built from the current answer key"""
+        key = get_question_bank().answer_key
+        sheets = []
+        for accuracy in (0.4, 0.6, 0.75, 0.9):
+            sheets.append([
+                {'question_id': question_id, 'answer': answer if self.rng.random() < accuracy else ''}
+                for question_id, answer in key.items()
+            ])
+        return sheets
+
+    def create_users(self, role, start, size):
+        prefix = self.options['prefix']
+        users = User.objects.bulk_create([
+            User(
+                username=f'{prefix}-{role}-{n}',
+                email=f'{prefix}-{role}-{n}@example.com',
+                password=self.password
+            )
+            for n in range(start, start + size)
+        ])
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+        return users
+
+    def create_patients(self, start, size):
+        users = self.create_users('patient', start, size)
+        patients = Patient.objects.bulk_create([Patient(user=user) for user in users])
+
+        LifestyleData.objects.bulk_create(self.lifestyle_entries(users), batch_size=5000)
+        with explicit_dates(
+            CognitiveTestResult._meta.get_field('date_taken'),
+            BrainHealthAssessment._meta.get_field('date'),
+            Recommendation._meta.get_field('date_created'),
+        ):
+            results = CognitiveTestResult.objects.bulk_create(self.test_results(patients), batch_size=5000)
+            BrainHealthAssessment.objects.bulk_create(self.assessments(results), batch_size=5000)
+            Recommendation.objects.bulk_create(self.recommendations(patients), batch_size=5000)
+
+        # Bulk writes send no signals, so build the derived tables here
+        user_ids = [user.pk for user in users]
+        for user_id in user_ids:
+            refresh_lifestyle_stats(user_id, self.today)
+        rebuild_lifestyle_rollups(user_ids)
+        refresh_patient_snapshots(Patient.objects.filter(pk__in=[patient.pk for patient in patients]))
+        return [patient.pk for patient in patients]
+
+    def lifestyle_entries(self, users):
+        days = self.options['days']
+        adherence = self.options['adherence']
+        for user in users:
+            # Each patient has habits of their own that the daily values vary around
+            habits = {factor: self.rng.uniform(1, 9) for factor in LIFESTYLE_FACTORS}
+            for offset in range(days, 0, -1):
+                if self.rng.random() >= adherence:
+                    continue
+                day = self.today - timedelta(days=offset)
+                values = {
+                    factor: min(10, max(0, round(self.rng.gauss(habit, 1.5))))
+                    for factor, habit in habits.items()
+                }
+                yield LifestyleData(
+                    user=user, date=day,
+                    created_at=timezone.make_aware(datetime.combine(day, time(20))),
+                    **values
+                )
+
+    def test_results(self, patients):
+        bank = get_question_bank()
+        days = self.options['days']
+        interval = max(1, self.options['test_interval'])
+        for patient in patients:
+            offset = days - self.rng.randint(0, interval)
+            while offset > 0:
+                answers = self.rng.choice(self.answers)
+                score, correct_answers, total_questions = bank.compiled_key.score(answers)
+                yield CognitiveTestResult(
+                    patient=patient,
+                    score=score,
+                    correct_answers=correct_answers,
+                    total_questions=total_questions,
+                    details=answers,
+                    bank_version=bank.version,
+                    date_taken=timezone.now() - timedelta(days=offset, minutes=self.rng.randint(0, 600))
+                )
+                offset -= max(1, round(self.rng.gauss(interval, interval / 4)))
+
+    def assessments(self, results):
+        # One assessment follows each test, and a patient has at most one a
+        # day, so a day with several tests keeps the last of them
+        latest = {}
+        for result in results:
+            key = (result.patient_id, result.date_taken.date())
+            if key not in latest or result.date_taken > latest[key].date_taken:
+                latest[key] = result
+        for result in latest.values():
+            yield BrainHealthAssessment(
+                patient_id=result.patient_id,
+                score=round(min(100, max(0, self.rng.gauss(result.score * 2, 10))), 1),
+                cognitive_score=result.score,
+                date=result.date_taken.date()
+            )
+
+    def recommendations(self, patients):
+        days = self.options['days']
+        for patient in patients:
+            for n in range(self.options['recommendations']):
+                created = timezone.now() - timedelta(days=self.rng.randint(0, days))
+                completed = self.rng.random() < 0.5
+                yield Recommendation(
+                    patient=patient,
+                    category=self.rng.choice(CATEGORIES),
+                    title=f'Recommendation {n + 1}',
+                    description='Generated recommendation',
+                    priority=self.rng.choice(PRIORITIES),
+                    date_created=created,
+                    completed=completed,
+                    date_completed=created + timedelta(days=self.rng.randint(1, 30)) if completed else None
+                )
+
+    def create_caregivers(self, patient_ids):
+        count = self.options['caregivers']
+        users = self.create_users('caregiver', 0, count)
+        caregivers = Caregiver.objects.bulk_create([Caregiver(user=user) for user in users])
+
+        per_caregiver = min(self.options['patients_per_caregiver'], len(patient_ids))
+        Link = Caregiver.patients.through
+        Link.objects.bulk_create(
+            (
+                Link(caregiver_id=caregiver.pk, patient_id=patient_id)
+                for caregiver in caregivers
+                for patient_id in self.rng.sample(patient_ids, per_caregiver)
+            ),
+            batch_size=5000
+        )
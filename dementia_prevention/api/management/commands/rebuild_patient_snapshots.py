@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Patient
+from api.snapshots import refresh_patient_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Rebuild every PatientSnapshot from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of patients rebuilt per transaction (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        # Each chunk replaces its snapshots in place, so dashboards keep
+        # reading the old ones until their chunk is rebuilt
+        rebuilt = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Patient.objects.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                rebuilt += len(refresh_patient_snapshots(Patient.objects.filter(pk__in=ids)))
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} patient snapshots'))
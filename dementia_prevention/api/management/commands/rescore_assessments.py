@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api import rescoring
+from api.rules import get_scoring_rules
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every patient's brain health assessment and open recommendations "
+        'against the current scoring rules'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Patients read and written per chunk (default: 1000)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes scoring chunks in parallel (default: one per CPU)'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rescore every patient, not only those last assessed with older rules'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report the score distribution shift without writing anything'
+        )
+        parser.add_argument(
+            '--checkpoint', default='rescore_assessments.checkpoint.json',
+            help=(
+                'File recording finished chunks, for --resume; not written on --dry-run '
+                'and removed once the run completes (default: %(default)s)'
+            )
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Skip the chunks an interrupted run with the same rules already finished'
+        )
+
+    def handle(self, *args, **options):
+        version = get_scoring_rules().version
+        dry_run = options['dry_run']
+        if rescoring.np is None:
+            self.stderr.write('NumPy is not installed, scoring row by row')
+
+        # A dry run writes nothing, not even its progress
+        checkpoint = rescoring.Checkpoint(None if dry_run else options['checkpoint'], version)
+        if options['resume'] and checkpoint.resume():
+            self.stdout.write(f'Resuming: {len(checkpoint.done)} chunks already done')
+
+        ranges = rescoring.pending_ranges(checkpoint.done, options['chunk_size'])
+        self.stdout.write(f'Rescoring {len(ranges)} chunks against scoring rules v{version}')
+        arguments = {'version': version, 'dry_run': dry_run, 'rescore_all': options['all']}
+
+        try:
+            if options['workers'] <= 1 or len(ranges) <= 1:
+                for bounds in ranges:
+                    self.finished(checkpoint, bounds, rescoring.rescore_chunk(*bounds, **arguments))
+            else:
+                self.run_pool(checkpoint, ranges, options['workers'], arguments)
+        except rescoring.RulesChanged as e:
+            raise CommandError(f'{e}; rerun to start over with the new rules')
+
+        checkpoint.clear()
+        self.report(checkpoint.stats, version, dry_run)
+
+    def run_pool(self, checkpoint, ranges, workers, arguments):
+        # Forked workers must open connections of their own
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {
+                pool.submit(rescoring.rescore_chunk, *bounds, **arguments): bounds
+                for bounds in ranges
+            }
+            for future in as_completed(futures):
+                self.finished(checkpoint, futures[future], future.result())
+
+    def finished(self, checkpoint, bounds, stats):
+        checkpoint.record(bounds, stats)
+        self.stdout.write(f'  patients {bounds[0] + 1}-{bounds[1]}: {stats["scored"]} scored')
+
+    def report(self, stats, version, dry_run):
+        scored = stats['scored']
+        verb = 'Would rescore' if dry_run else 'Rescored'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {scored} of {stats["patients"]} patients against scoring rules v{version} '
+            f'({stats["skipped"]} up to date or without a test and lifestyle entry)'
+        ))
+        if not scored:
+            return
+
+        compared = stats['compared']
+        if compared:
+            self.stdout.write(
+                f'Mean score {stats["old_sum"] / compared:.1f} -> {stats["compared_sum"] / compared:.1f}; '
+                f'{stats["up"]} up, {stats["down"]} down, {compared - stats["up"] - stats["down"]} unchanged, '
+                f'{scored - compared} without an earlier assessment'
+            )
+        else:
+            self.stdout.write(f'Mean score {stats["new_sum"] / scored:.1f}, no earlier assessments')
+
+        self.stdout.write(f'{"Score":>8} {"Before":>8} {"After":>8}')
+        bins = rescoring.HISTOGRAM_BINS
+        for index, (old, new) in enumerate(zip(stats['old_histogram'], stats['new_histogram'])):
+            self.stdout.write(f'{f"{bins[index]}-{bins[index + 1]}":>8} {old:>8} {new:>8}')
+
+        if not dry_run:
+            created, updated, deleted = stats['recommendations']
+            self.stdout.write(f'Recommendations: {created} created, {updated} updated, {deleted} deleted')
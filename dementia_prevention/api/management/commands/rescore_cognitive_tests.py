@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from api.changes import record_changes
+from api.models import CognitiveTestResult, Patient
+from api.question_bank import get_question_bank
+from api.snapshots import refresh_patient_snapshots
+
+SCORED_FIELDS = ['score', 'correct_answers', 'total_questions', 'bank_version']
+
+
+class Command(BaseCommand):
+    help = 'Rescore stored cognitive test results against the current answer key'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of results read and written per pass (default: 2000)'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rescore every result, not only those scored against an older bank version'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report how many scores would change without writing them'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        bank = get_question_bank()
+        key = bank.compiled_key
+
+        results = CognitiveTestResult.objects.only('id', 'patient_id', 'details', *SCORED_FIELDS)
+        if not options['all']:
+            results = results.filter(Q(bank_version__isnull=True) | ~Q(bank_version=bank.version))
+
+        scanned = changed = 0
+        last_id = 0
+        while True:
+            chunk = list(results.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            scanned += len(chunk)
+
+            changed_patients = {}
+            for result in chunk:
+                score, correct_answers, total_questions = key.score(result.details)
+                if (score, correct_answers, total_questions) != (
+                    result.score, result.correct_answers, result.total_questions
+                ):
+                    changed += 1
+                    changed_patients.setdefault(result.patient_id, []).append(result.id)
+                result.score = score
+                result.correct_answers = correct_answers
+                result.total_questions = total_questions
+                result.bank_version = bank.version
+
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                CognitiveTestResult.objects.bulk_update(chunk, SCORED_FIELDS)
+                # Snapshots carry the latest score, keep them in step
+                if changed_patients:
+                    refresh_patient_snapshots(Patient.objects.filter(pk__in=changed_patients))
+
+                # bulk_update sends no signals, so log the sync changes here
+                owners = Patient.objects.filter(pk__in=changed_patients).values_list('pk', 'user_id')
+                for patient_id, user_id in owners:
+                    record_changes(CognitiveTestResult, user_id, changed_patients[patient_id])
+
+        verb = 'would change' if dry_run else 'changed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Rescored {scanned} results against question bank v{bank.version}: '
+            f'{changed} scores {verb}'
+        ))
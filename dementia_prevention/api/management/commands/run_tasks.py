@@ -0,0 +1,67 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api import metrics, taskqueue
+
+
+class Command(BaseCommand):
+    help = 'Run queued tasks (e-mail, assessment recomputes) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run the tasks due now and exit, e.g. from cron'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10,
+            help='Tasks claimed at a time (default: 10)'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait when the queue is empty (default: 1)'
+        )
+        parser.add_argument(
+            '--worker-id', default=f'{socket.gethostname()}:{os.getpid()}',
+            help='Name recorded on claimed tasks (default: host:pid)'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Finish the task at hand on shutdown instead of leaving it to the lock timeout
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        worker = options['worker_id']
+        ran = 0
+        while not self.stopping:
+            close_old_connections()
+            requeued, dead = taskqueue.release_stale()
+            if requeued or dead:
+                self.stderr.write(f'Released {requeued} stale tasks, {dead} of them out of attempts')
+
+            tasks = taskqueue.claim(worker, options['batch_size'])
+            for task in tasks:
+                outcome = taskqueue.run_task(task)
+                ran += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{task.name} #{task.pk}: {outcome}')
+                if self.stopping:
+                    # Hand the rest of the batch back untouched
+                    taskqueue.release(tasks[tasks.index(task) + 1:])
+                    break
+            metrics.registry.flush()
+
+            if options['once'] and not tasks:
+                break
+            if not tasks:
+                time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Ran {ran} tasks'))
+
+    def stop(self, signum, frame):
+        self.stopping = True
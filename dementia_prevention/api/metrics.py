@@ -0,0 +1,186 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# metric name -> (Prometheus type, help text)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by URL name, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Request latency, by URL name'),
+    'http_response_bytes_total': ('counter', 'Response body bytes sent, by URL name'),
+    'db_queries_total': ('counter', 'SQL queries run while handling requests, by URL name'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in SQL queries, by URL name'),
+    'tasks_total': ('counter', 'Queued tasks run, by task name and outcome (done, retry, dead, superseded)'),
+    'tasks_coalesced_total': ('counter', 'Triggers folded into an already queued task, by task name'),
+}
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+class MetricsRegistry:
+    """
+    Counters of one worker process, kept in memory and written to a file of
+    its own in METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds.
+    The exporter sums the files of every worker, so the metrics cover all
+    gunicorn workers without any locking between them.
+
+    Histograms are stored as their `_bucket`, `_sum` and `_count` counters,
+    which lets every series be merged by plain addition.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        # Unique per process, so a reused pid never overwrites a dead worker's totals
+        self.filename = f'metrics-{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.values = defaultdict(float)
+        self.last_flush = 0.0
+
+    def _check_fork(self):
+        # Workers forked from a preloaded master start from empty counters
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            self.values[key] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        label_items = tuple(sorted(labels.items()))
+        with self.lock:
+            self._check_fork()
+            for bound in buckets:
+                if value <= bound:
+                    self.values[(f'{name}_bucket', label_items + (('le', str(bound)),))] += 1
+            self.values[(f'{name}_bucket', label_items + (('le', '+Inf'),))] += 1
+            self.values[(f'{name}_sum', label_items)] += value
+            self.values[(f'{name}_count', label_items)] += 1
+
+    def flush(self, force=False):
+        """Write this worker's totals to its file if the flush interval has passed"""
+        directory = _metrics_dir()
+        if not directory:
+            return
+        # One writer per process; other threads skip a flush already under way
+        if not self.flush_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+            with self.lock:
+                self._check_fork()
+                if not force and now - self.last_flush < interval:
+                    return
+                self.last_flush = now
+                rows = [[name, list(labels), value] for (name, labels), value in self.values.items()]
+
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, self.filename)
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(rows, f)
+            os.replace(temp_path, path)
+        finally:
+            self.flush_lock.release()
+
+    def snapshot(self):
+        """Totals of this worker as {(name, labels): value}"""
+        with self.lock:
+            self._check_fork()
+            return dict(self.values)
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush, force=True)
+
+
+def increment(name, value=1, **labels):
+    registry.increment(name, value, **labels)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    registry.observe(name, value, buckets, **labels)
+
+
+def collect():
+    """Totals summed over every worker's file (and this worker's live counters)"""
+    registry.flush(force=True)
+    directory = _metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return registry.snapshot()
+
+    totals = defaultdict(float)
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            # Being replaced right now or unreadable, skip it this scrape
+            continue
+        for name, labels, value in rows:
+            totals[(name, tuple(tuple(label) for label in labels))] += value
+    return totals
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        base = name[:-len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ('',))[0] == 'histogram':
+            return base
+    return name
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _bucket_order(item):
+    (name, labels), value = item
+    le = dict(labels).get('le')
+    bound = float('inf') if le in (None, '+Inf') else float(le)
+    return name, tuple(label for label in labels if label[0] != 'le'), bound
+
+
+def render(totals):
+    """Totals in the Prometheus text exposition format"""
+    families = defaultdict(list)
+    for item in totals.items():
+        families[_family(item[0][0])].append(item)
+
+    lines = []
+    for family in sorted(families):
+        kind, help_text = METRICS.get(family, ('untyped', ''))
+        if help_text:
+            lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for (name, labels), value in sorted(families[family], key=_bucket_order):
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
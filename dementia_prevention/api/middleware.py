@@ -1,3 +1,17 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import metrics, profiling
+from .authentication import CachedTokenAuthentication
+from .claims import claims_cookie, claims_enabled, issue_claims, read_claims
+from .roles import resolve_role
+
+
 class LogBlockedRequestsMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -10,4 +24,155 @@ class LogBlockedRequestsMiddleware:
                 f"IP: {request.META.get('REMOTE_ADDR')}"
             )
         return self.get_response(request)
-    
\ No newline at end of file
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Records request count, latency, SQL query count and time, and response
+    bytes per resolved URL name. Streaming responses are recorded once their
+    body has been sent, including the queries run while producing it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response, response.streaming_content, start, timer
+            )
+        else:
+            self.record(request, response, start, timer, len(response.content))
+        return response
+
+    def stream(self, request, response, content, start, timer):
+        sent = 0
+        try:
+            with connection.execute_wrapper(timer):
+                for chunk in content:
+                    sent += len(chunk)
+                    yield chunk
+        finally:
+            self.record(request, response, start, timer, sent)
+
+    def record(self, request, response, start, timer, sent):
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'unresolved'
+        metrics.increment(
+            'http_requests_total', view=view, method=request.method, status=response.status_code
+        )
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start, view=view)
+        metrics.increment('http_response_bytes_total', sent, view=view)
+        metrics.increment('db_queries_total', timer.count, view=view)
+        metrics.increment('db_query_duration_seconds_total', timer.duration, view=view)
+        metrics.registry.flush()
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a single request when a staff user asks for it with `?profile=1`
+    or an `X-Profile: 1` header, and returns the stored profile's id in the
+    X-Profile-Id response header. Other requests only pay for the flag check.
+    Only workers with PROFILE_REQUESTS set profile, one request at a time;
+    see profiling.profile_call for what it changes process-wide.
+
+    The body of streaming responses is produced after this returns and is
+    not part of the profile.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.profile_requested(request) or not self.is_staff(request):
+            return self.get_response(request)
+
+        response, profile_id = profiling.profile_call(
+            lambda: self.get_response(request),
+            f'{request.method} {request.get_full_path()}'
+        )
+        if profile_id:  # None when another request of this worker is being profiled
+            response['X-Profile-Id'] = profile_id
+        return response
+
+    def is_staff(self, request):
+        if request.user.is_authenticated:
+            return request.user.is_staff
+        # API clients authenticate with a token, which DRF only checks inside the view
+        try:
+            credentials = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return credentials is not None and credentials[0].is_staff
+
+
+class RoleMiddleware:
+    """
+    Sets `request.role`, the user's patient/caregiver profiles. It is
+    resolved on first use, after DRF has authenticated the user (DRF copies
+    it onto the underlying request), and at most once per request, so
+    permissions and the view share one lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.role = SimpleLazyObject(lambda: resolve_role(request.user))
+        return self.get_response(request)
+
+
+class ClaimsMiddleware:
+    """
+    Keeps the signed claims cookie of session users current: issues it after
+    a request authenticated from the session, so the following ones can use
+    ClaimsAuthentication, and drops it once the user is logged out.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'claims', None) is not None:
+            return response
+
+        cookie = claims_cookie()
+        user = request.user
+        if (
+            claims_enabled() and user.is_authenticated and user.is_active
+            and request.session.get(SESSION_KEY) == str(user.pk)
+        ):
+            current = read_claims(request.COOKIES.get(cookie))
+            if current is None or current['uid'] != user.pk:
+                response.set_cookie(
+                    cookie, issue_claims(user, request.role),
+                    max_age=getattr(settings, 'AUTH_CLAIMS_TTL', 300),
+                    secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True,
+                    samesite=settings.SESSION_COOKIE_SAMESITE
+                )
+        elif cookie in request.COOKIES:
+            response.delete_cookie(cookie, samesite=settings.SESSION_COOKIE_SAMESITE)
+        return response
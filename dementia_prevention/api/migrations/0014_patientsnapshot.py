@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_lifestyledata_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latest_cognitive_score', models.FloatField(blank=True, null=True)),
+                ('open_recommendation_count', models.IntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('latest_assessment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.brainhealthassessment')),
+                ('latest_lifestyle', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.lifestyledata')),
+                ('latest_test', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.cognitivetestresult')),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='api.patient')),
+            ],
+        ),
+    ]
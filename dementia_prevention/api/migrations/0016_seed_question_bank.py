@@ -0,0 +1,89 @@
+from django.core.management.color import no_style
+from django.db import migrations
+
+# (id, question, options, correct answer) of the bank that used to be
+# hard-coded in api/views.py. Ids are kept so stored test details still
+# refer to the same questions.
+QUESTIONS = [
+    (1, 'What is 5 + 7?', ['10', '11', '12', '13'], '12'),
+    (2, 'Which month comes after June?', ['May', 'July', 'August', 'September'], 'July'),
+    (3, 'What is the capital of France?', ['Berlin', 'Madrid', 'Paris', 'Rome'], 'Paris'),
+    (4, 'What is 15 ÷ 3?', ['3', '4', '5', '6'], '5'),
+    (5, 'Which planet is known as the Red Planet?', ['Earth', 'Mars', 'Jupiter', 'Venus'], 'Mars'),
+    (6, 'What is the largest mammal?', ['Elephant', 'Blue Whale', 'Giraffe', 'Hippopotamus'], 'Blue Whale'),
+    (7, 'How many continents are there on Earth?', ['5', '6', '7', '8'], '7'),
+    (8, 'What is the square root of 64?', ['6', '7', '8', '9'], '8'),
+    (9, 'Which gas do plants use for photosynthesis?', ['Oxygen', 'Carbon Dioxide', 'Nitrogen', 'Hydrogen'], 'Carbon Dioxide'),
+    (10, 'Who wrote "Romeo and Juliet"?', ['Charles Dickens', 'William Shakespeare', 'Mark Twain', 'Jane Austen'], 'William Shakespeare'),
+    (11, 'What is the name of the current U.S. president?', ['Joe Biden', 'Donald Trump', 'Barack Obama', 'George Bush'], 'Joe Biden'),
+    (12, 'What was the last holiday you celebrated?', ['Christmas', 'Thanksgiving', 'Easter', "New Year's"], '(Open-ended)'),
+    (13, 'Name three fruits that start with "A".', ['Apple, Apricot, Avocado', 'Banana, Blueberry, Blackberry', 'Cherry, Coconut, Cantaloupe', 'Grape, Guava, Gooseberry'], 'Apple, Apricot, Avocado'),
+    (14, 'If you buy an item for $20 and pay with $50, how much change do you get?', ['$20', '$25', '$30', '$35'], '$30'),
+    (15, 'What is 12 × 3?', ['24', '36', '48', '60'], '36'),
+    (16, 'If today is Monday, what day is it in three days?', ['Tuesday', 'Wednesday', 'Thursday', 'Friday'], 'Thursday'),
+    (17, 'What is the opposite of "hot"?', ['Warm', 'Cold', 'Wet', 'Dry'], 'Cold'),
+    (18, 'Complete this sentence: "The sky is ___."', ['Green', 'Blue', 'Red', 'Black'], 'Blue'),
+    (19, 'Spell "WORLD" backward.', ['DLROW', 'DROWL', 'DLORW', 'DRLOW'], 'DLROW'),
+    (20, 'Which does not belong: Apple, Banana, Carrot, Orange?', ['Apple', 'Banana', 'Carrot', 'Orange'], 'Carrot'),
+    (21, 'What comes next: 2, 4, 6, 8, ___?', ['9', '10', '12', '14'], '10'),
+    (22, 'How many quarters make $1.50?', ['3', '4', '5', '6'], '6'),
+    (23, 'Who was the first U.S. president?', ['Thomas Jefferson', 'George Washington', 'Abraham Lincoln', 'John Adams'], 'George Washington'),
+    (24, 'Which ocean is between the U.S. and Europe?', ['Pacific', 'Indian', 'Atlantic', 'Arctic'], 'Atlantic'),
+    (25, 'What is the main color of the U.S. flag?', ['Red', 'Blue', 'Green', 'White'], 'Blue'),
+    (26, 'Which shape has four equal sides?', ['Triangle', 'Circle', 'Square', 'Rectangle'], 'Square'),
+    (27, 'Which of these is a triangle? (○, △, □, ☆)', ['○', '△', '□', '☆'], 'Triangle'),
+    (28, 'Tap the table when I say "A": B, C, A, D, A, F.', ['(Assess response)'], '(Assess response)'),
+    (29, 'Name the months of the year in order.', ['(Assess sequencing)'], '(Assess sequencing)'),
+    (30, 'What is your birth date?', ['(Open-ended)'], '(Open-ended)'),
+    (31, 'Where were you born?', ['(Open-ended)'], '(Open-ended)'),
+    (32, 'What is 100 minus 7?', ['93', '83', '73', '63'], '93'),
+    (33, 'Which is heavier: a pound of feathers or a pound of bricks?', ['Feathers', 'Bricks', 'They weigh the same', 'Depends'], 'They weigh the same'),
+    (34, 'What is the capital of your country?', ['(Open-ended)'], '(Open-ended)'),
+    (35, 'What do you use to write on paper?', ['Spoon', 'Pen', 'Hammer', 'Leaf'], 'Pen'),
+    (36, 'What is the color of a ripe banana?', ['Red', 'Blue', 'Yellow', 'Green'], 'Yellow'),
+    (37, 'How many days are in a week?', ['5', '6', '7', '8'], '7'),
+    (38, 'What is the largest number: 5, 3, 9, 2?', ['5', '3', '9', '2'], '9'),
+    (39, 'What is the name of this object? (Show a pencil)', ['🖊️', '✏️', '📏', '🩹'], 'Pencil'),
+    (40, 'Repeat these words: "Cat, Ball, Shoe."', ['(Assess recall)'], '(Assess recall)'),
+    (41, 'What time is it when the big hand is on 12 and the small hand is on 3?', ['12:00', '3:00', '6:00', '9:00'], '3:00'),
+    (42, 'Which is not a season: Winter, Summer, December, Spring?', ['Winter', 'Summer', 'December', 'Spring'], 'December'),
+    (43, 'What is the name of the current year?', ['(Open-ended)'], '(Open-ended)'),
+    (44, 'Point to the ceiling.', ['(Assess response)'], '(Assess response)'),
+    (45, 'What do you call the thing you use to cut paper?', ['Spoon', 'Scissors', 'Plate', 'Sock'], 'Scissors'),
+    (46, 'How many legs does a chair usually have?', ['1', '2', '3', '4'], '4'),
+    (47, 'What is the name of your spouse/partner?', ['(Open-ended)'], '(Open-ended)'),
+    (48, 'What is the opposite of "day"?', ['Night', 'Morning', 'Evening', 'Noon'], 'Night'),
+    (49, 'What is the shape of a stop sign?', ['Circle', 'Square', 'Octagon', 'Triangle'], 'Octagon'),
+    (50, 'What do you wear on your feet?', ['Hat', 'Shoes', 'Gloves', 'Scarf'], 'Shoes'),
+]
+
+
+def seed_question_bank(apps, schema_editor):
+    CognitiveTestQuestion = apps.get_model('api', 'CognitiveTestQuestion')
+    ContentVersion = apps.get_model('api', 'ContentVersion')
+
+    existing = set(CognitiveTestQuestion.objects.values_list('id', flat=True))
+    CognitiveTestQuestion.objects.bulk_create([
+        CognitiveTestQuestion(id=pk, question=question, options=options, correct_answer=answer)
+        for pk, question, options, answer in QUESTIONS
+        if pk not in existing
+    ])
+
+    # Explicit ids leave the sequence behind on backends that have one
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [CognitiveTestQuestion]):
+            cursor.execute(sql)
+
+    ContentVersion.objects.update_or_create(name='question_bank', defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_question_bank_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_question_bank, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:01
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def drop_duplicate_entries(apps, schema_editor):
+    """Keep only the most recent entry for each (user, date) pair"""
+    LifestyleData = apps.get_model('api', 'LifestyleData')
+    duplicates = (
+        LifestyleData.objects.values('user', 'date')
+        .annotate(entries=Count('id'), keep=Max('id'))
+        .filter(entries__gt=1)
+    )
+    for row in duplicates:
+        LifestyleData.objects.filter(user=row['user'], date=row['date']).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_seed_question_bank'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_entries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lifestyledata',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_lifestyle_entry_per_day'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+FACTORS = [
+    'physical_activity', 'healthy_diet', 'social_engagement',
+    'good_sleep', 'smoking', 'alcohol', 'stress',
+]
+
+
+def backfill_rollups(apps, schema_editor):
+    """Build the week and month rollups of the entries that already exist"""
+    LifestyleData = apps.get_model('api', 'LifestyleData')
+    LifestyleRollup = apps.get_model('api', 'LifestyleRollup')
+
+    for period, trunc in (('week', TruncWeek), ('month', TruncMonth)):
+        buckets = (
+            LifestyleData.objects
+            .annotate(period_start=trunc('date'))
+            .values('user_id', 'period_start')
+            .annotate(entry_count=Count('id'), **{factor: Sum(factor) for factor in FACTORS})
+            .order_by()
+        )
+        LifestyleRollup.objects.bulk_create(
+            (LifestyleRollup(period=period, **bucket) for bucket in buckets.iterator()),
+            batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0019_lifestylestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LifestyleRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Week'), ('month', 'Month')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('entry_count', models.IntegerField(default=0)),
+                ('physical_activity', models.IntegerField(default=0)),
+                ('healthy_diet', models.IntegerField(default=0)),
+                ('social_engagement', models.IntegerField(default=0)),
+                ('good_sleep', models.IntegerField(default=0)),
+                ('smoking', models.IntegerField(default=0)),
+                ('alcohol', models.IntegerField(default=0)),
+                ('stress', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lifestyle_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='lifestylerollup',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'period_start'), name='unique_lifestyle_rollup_bucket'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
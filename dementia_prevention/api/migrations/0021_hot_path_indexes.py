@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_lifestylerollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='brainhealthassessment',
+            index=models.Index(fields=['patient', '-date', '-id'], name='assessment_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cognitivetestresult',
+            index=models.Index(fields=['patient', '-date_taken', '-id'], name='cogtest_patient_taken_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lifestyledata',
+            index=models.Index(fields=['user', '-date', '-id'], name='lifestyle_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendation',
+            index=models.Index(fields=['patient', 'completed'], name='rec_patient_completed_idx'),
+        ),
+    ]
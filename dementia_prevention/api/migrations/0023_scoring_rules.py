@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_idempotent_requests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoringRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factor', models.CharField(choices=[('physical_activity', 'Physical activity'), ('healthy_diet', 'Healthy diet'), ('social_engagement', 'Social engagement'), ('good_sleep', 'Good sleep'), ('smoking', 'Smoking'), ('alcohol', 'Alcohol'), ('stress', 'Stress'), ('brain_health_score', 'Brain health score')], max_length=30)),
+                ('comparator', models.CharField(choices=[('lt', '<'), ('lte', '<='), ('gt', '>'), ('gte', '>='), ('eq', '=')], max_length=3)),
+                ('threshold', models.FloatField()),
+                ('weight', models.FloatField(default=0)),
+                ('category', models.CharField(blank=True, choices=[('cognitive', 'Cognitive'), ('physical', 'Physical Activity'), ('nutrition', 'Nutrition'), ('sleep', 'Sleep'), ('stress', 'Stress Management'), ('social', 'Social Engagement')], max_length=20)),
+                ('title', models.CharField(blank=True, max_length=100)),
+                ('description', models.TextField(blank=True)),
+                ('priority', models.CharField(blank=True, choices=[('high', 'High'), ('medium', 'Medium'), ('low', 'Low')], max_length=10)),
+                ('order', models.IntegerField(default=0)),
+                ('active', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='brainhealthassessment',
+            name='rule_version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# (factor, comparator, threshold, weight) adjustments of the thresholds that
+# used to be hard-coded in calculate_brain_health_score in api/views.py
+SCORE_RULES = [
+    ('physical_activity', 'gte', 3, 15),
+    ('healthy_diet', 'gte', 4, 15),
+    ('social_engagement', 'gte', 2, 10),
+    ('good_sleep', 'gte', 5, 10),
+    ('smoking', 'gt', 0, -20),
+    ('alcohol', 'gt', 7, -15),
+    ('stress', 'gte', 4, -10),
+]
+
+# (factor, comparator, threshold, category, title, description, priority) of
+# the former generate_recommendations, in the order it listed them
+RECOMMENDATION_RULES = [
+    ('brain_health_score', 'lt', 70, 'cognitive', 'Brain Training Exercises',
+     'Engage in daily brain training activities to improve cognitive function.', 'high'),
+    ('physical_activity', 'lt', 3, 'physical', 'Increase Physical Activity',
+     'Aim for at least 30 minutes of moderate exercise 3-5 times per week.', 'medium'),
+    ('healthy_diet', 'lt', 4, 'nutrition', 'Improve Your Diet',
+     'Incorporate more fruits, vegetables, and omega-3 rich foods into your meals.', 'medium'),
+    ('good_sleep', 'lt', 5, 'sleep', 'Improve Sleep Quality',
+     'Aim for 7-9 hours of quality sleep each night. Establish a regular sleep schedule.', 'high'),
+    ('stress', 'gte', 3, 'stress', 'Reduce Stress',
+     'Practice mindfulness or meditation for 10-15 minutes daily to reduce stress.', 'high'),
+    ('social_engagement', 'lt', 2, 'social', 'Increase Social Engagement',
+     'Participate in social activities at least twice a week to maintain cognitive health.', 'medium'),
+]
+
+
+def seed_scoring_rules(apps, schema_editor):
+    ScoringRule = apps.get_model('api', 'ScoringRule')
+    ContentVersion = apps.get_model('api', 'ContentVersion')
+
+    if ScoringRule.objects.exists():
+        return
+    ScoringRule.objects.bulk_create(
+        [
+            ScoringRule(factor=factor, comparator=comparator, threshold=threshold, weight=weight)
+            for factor, comparator, threshold, weight in SCORE_RULES
+        ] + [
+            ScoringRule(
+                factor=factor, comparator=comparator, threshold=threshold, category=category,
+                title=title, description=description, priority=priority, order=order
+            )
+            for order, (factor, comparator, threshold, category, title, description, priority)
+            in enumerate(RECOMMENDATION_RULES)
+        ]
+    )
+    ContentVersion.objects.update_or_create(name='scoring_rules', defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_scoring_rules'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_scoring_rules, migrations.RunPython.noop),
+    ]
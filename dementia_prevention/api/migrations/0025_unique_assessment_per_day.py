@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def drop_duplicate_assessments(apps, schema_editor):
+    """Keep only the most recent assessment for each (patient, date) pair"""
+    BrainHealthAssessment = apps.get_model('api', 'BrainHealthAssessment')
+    duplicates = (
+        BrainHealthAssessment.objects.values('patient', 'date')
+        .annotate(assessments=Count('id'), keep=Max('id'))
+        .filter(assessments__gt=1)
+    )
+    for row in duplicates:
+        BrainHealthAssessment.objects.filter(
+            patient=row['patient'], date=row['date']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_seed_scoring_rules'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_assessments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='brainhealthassessment',
+            constraint=models.UniqueConstraint(fields=('patient', 'date'), name='unique_assessment_per_day'),
+        ),
+    ]
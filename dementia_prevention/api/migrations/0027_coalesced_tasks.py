@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='coalesced',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='dedupe_key',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'queued')), fields=('dedupe_key',), name='unique_queued_task_key'),
+        ),
+    ]
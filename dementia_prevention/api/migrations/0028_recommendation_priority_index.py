@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_coalesced_tasks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recommendation',
+            index=models.Index(fields=['patient', '-priority', '-date_created', '-id'], name='rec_patient_priority_idx'),
+        ),
+    ]
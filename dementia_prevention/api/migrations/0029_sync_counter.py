@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Max
+import django.db.models.deletion
+
+
+def tokens_from_ids(apps, schema_editor):
+    """Keep the tokens clients already hold: existing entries keep their id as token"""
+    ChangeLogEntry = apps.get_model('api', 'ChangeLogEntry')
+    SyncCounter = apps.get_model('api', 'SyncCounter')
+    ChangeLogEntry.objects.update(token=F('id'))
+    SyncCounter.objects.bulk_create(
+        SyncCounter(user_id=row['user'], last_token=row['last'])
+        for row in ChangeLogEntry.objects.values('user').annotate(last=Max('id'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0028_recommendation_priority_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_token', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='changelogentry',
+            name='token',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(tokens_from_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='changelogentry',
+            name='token',
+            field=models.BigIntegerField(),
+        ),
+        migrations.RemoveIndex(
+            model_name='changelogentry',
+            name='changelog_user_token_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='changelogentry',
+            constraint=models.UniqueConstraint(fields=('user', 'token'), name='changelog_user_token_uniq'),
+        ),
+    ]
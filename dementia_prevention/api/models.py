@@ -1,3 +1,5 @@
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils.timezone import now
 from django.utils import timezone
@@ -26,6 +28,17 @@ class Caregiver(models.Model):
     def __str__(self):
         return f"{self.user.username} (Caregiver)"
 
+# Scored lifestyle columns of LifestyleData
+LIFESTYLE_FACTORS = [
+    'physical_activity',
+    'healthy_diet',
+    'social_engagement',
+    'good_sleep',
+    'smoking',
+    'alcohol',
+    'stress',
+]
+
 class LifestyleDataManager(models.Manager):
     def for_date(self, date_filter):
         return self.get_queryset().filter(date__gte=date_filter)
@@ -49,9 +62,30 @@ class LifestyleData(models.Model):
 
     objects = LifestyleDataManager()  # Use the custom manager
 
+    class Meta:
+        constraints = [
+            # One entry per user per day; bulk sync upserts on this pair
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_lifestyle_entry_per_day'),
+        ]
+        indexes = [
+            # Latest-entry lookups and history pages
+            models.Index(fields=['user', '-date', '-id'], name='lifestyle_user_date_idx'),
+        ]
+
     def __str__(self):
         return f"Lifestyle data for {self.user.username} on {self.date}"
 
+class ContentVersion(models.Model):
+    """
+    Version counter for content that workers cache in-process (e.g. the
+    question bank). Bumping it makes every worker rebuild its copy.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
 class PendingVerification(models.Model):
     caregiver = models.ForeignKey(Caregiver, on_delete=models.CASCADE)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
@@ -88,6 +122,13 @@ class CognitiveTestResult(models.Model):
     correct_answers = models.IntegerField()
     details = models.JSONField()  # Stores the questions and answers
     date_taken = models.DateTimeField(auto_now_add=True)
+    bank_version = models.IntegerField(null=True, blank=True)  # Question bank version it was scored against
+
+    class Meta:
+        indexes = [
+            # Latest-test lookups and history pages
+            models.Index(fields=['patient', '-date_taken', '-id'], name='cogtest_patient_taken_idx'),
+        ]
     
     def __str__(self):
         return f"{self.patient}: {self.score}/10 on {self.date_taken.strftime('%Y-%m-%d')}"
@@ -95,10 +136,21 @@ class CognitiveTestResult(models.Model):
 class BrainHealthAssessment(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='assessments')
     score = models.FloatField()  # Overall brain health score (0-100)
-    cognitive_score = models.FloatField()  # Cognitive test score (0-10)
+    cognitive_score = models.FloatField()  # Cognitive test score (0-50)
     lifestyle_data = models.ForeignKey(LifestyleData, on_delete=models.SET_NULL, null=True)
     date = models.DateField(auto_now_add=True)
     notes = models.TextField(null=True, blank=True)
+    rule_version = models.IntegerField(null=True, blank=True)  # Scoring rules version it was computed with
+
+    class Meta:
+        constraints = [
+            # One assessment per patient per day, the target of bulk upserts
+            models.UniqueConstraint(fields=['patient', 'date'], name='unique_assessment_per_day'),
+        ]
+        indexes = [
+            # Latest-assessment lookups and history pages
+            models.Index(fields=['patient', '-date', '-id'], name='assessment_patient_date_idx'),
+        ]
     
     def __str__(self):
         return f"Brain health assessment for {self.patient}: {self.score}/100"
@@ -127,6 +179,243 @@ class Recommendation(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     completed = models.BooleanField(default=False)
     date_completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Open recommendations of a patient
+            models.Index(fields=['patient', 'completed'], name='rec_patient_completed_idx'),
+            # The recommendations list, paginated by priority (as a string) then newest first
+            models.Index(
+                fields=['patient', '-priority', '-date_created', '-id'], name='rec_patient_priority_idx'
+            ),
+        ]
     
     def __str__(self):
-        return f"{self.title} for {self.patient}"
\ No newline at end of file
+        return f"{self.title} for {self.patient}"
+
+
+class ScoringRule(models.Model):
+    """
+    One brain health scoring rule: when `factor` compares true against
+    `threshold`, `weight` is added to the score and the recommendation
+    template, if any, is recommended. Rules are compiled per version of the
+    'scoring_rules' content, so edits reach every worker without a restart.
+    """
+    COMPARATOR_CHOICES = [
+        ('lt', '<'),
+        ('lte', '<='),
+        ('gt', '>'),
+        ('gte', '>='),
+        ('eq', '='),
+    ]
+
+    # The computed score itself, usable by recommendation-only rules
+    BRAIN_HEALTH_SCORE = 'brain_health_score'
+    FACTOR_CHOICES = [(factor, factor.replace('_', ' ').capitalize()) for factor in LIFESTYLE_FACTORS] + [
+        (BRAIN_HEALTH_SCORE, 'Brain health score'),
+    ]
+
+    factor = models.CharField(max_length=30, choices=FACTOR_CHOICES)
+    comparator = models.CharField(max_length=3, choices=COMPARATOR_CHOICES)
+    threshold = models.FloatField()
+    weight = models.FloatField(default=0)  # Points added to the 0-100 score when the rule matches
+    category = models.CharField(max_length=20, choices=Recommendation.CATEGORY_CHOICES, blank=True)
+    title = models.CharField(max_length=100, blank=True)  # Blank for score-only rules
+    description = models.TextField(blank=True)
+    priority = models.CharField(max_length=10, choices=Recommendation.PRIORITY_CHOICES, blank=True)
+    order = models.IntegerField(default=0)  # Order of the recommendations
+    active = models.BooleanField(default=True)
+
+    def clean(self):
+        if self.factor == self.BRAIN_HEALTH_SCORE and self.weight:
+            raise ValidationError({'weight': 'Rules on the brain health score can only recommend'})
+        if self.title and not (self.category and self.description and self.priority):
+            raise ValidationError('Recommendations need a category, description and priority')
+
+    def __str__(self):
+        return f"{self.factor} {self.get_comparator_display()} {self.threshold}"
+
+class PatientSnapshot(models.Model):
+    """
+    Denormalized "latest state" of a patient, kept up to date by the write
+    paths so dashboards can read it with a single row lookup.
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, related_name='snapshot')
+    latest_test = models.ForeignKey(
+        CognitiveTestResult, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    latest_cognitive_score = models.FloatField(null=True, blank=True)
+    latest_lifestyle = models.ForeignKey(
+        LifestyleData, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    latest_assessment = models.ForeignKey(
+        BrainHealthAssessment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    open_recommendation_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Snapshot for {self.patient}"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only record of writes to the models mobile clients sync. `token`
+    is the user's monotonic sync token, handed out by their SyncCounter.
+    """
+    OPERATION_CHOICES = [
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    token = models.BigIntegerField()
+    model = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'token'], name='changelog_user_token_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.operation} {self.model} #{self.object_id} for {self.user_id}"
+
+
+class SyncCounter(models.Model):
+    """
+    Last sync token handed out to a user. Writers keep the row locked until
+    they commit, so the user's tokens become visible in increasing order
+    and a client never skips an entry that commits after it synced.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    last_token = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Sync token {self.last_token} of {self.user_id}"
+
+
+class LifestyleStats(models.Model):
+    """
+    Per-user lifestyle aggregates for the lifestyle_stats windows (7d, 30d,
+    90d, all), updated on every lifestyle write. Windows are anchored at
+    `as_of`; rows from an earlier day are stale and recomputed on read.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='lifestyle_stats')
+    as_of = models.DateField()
+    windows = models.JSONField(default=dict)  # window -> {'count': n, 'sums': {factor: total}}
+    latest_entry = models.ForeignKey(
+        LifestyleData, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Lifestyle stats for {self.user.username} as of {self.as_of}"
+
+
+class LifestyleRollup(models.Model):
+    """
+    Calendar rollup of a user's lifestyle entries: entry count and the sum of
+    each factor per week or month. LifestyleData itself is the daily level.
+    """
+    PERIOD_CHOICES = [
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lifestyle_rollups')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    entry_count = models.IntegerField(default=0)
+    physical_activity = models.IntegerField(default=0)
+    healthy_diet = models.IntegerField(default=0)
+    social_engagement = models.IntegerField(default=0)
+    good_sleep = models.IntegerField(default=0)
+    smoking = models.IntegerField(default=0)
+    alcohol = models.IntegerField(default=0)
+    stress = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_start'], name='unique_lifestyle_rollup_bucket'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.period} of {self.period_start} for {self.user.username}"
+
+
+class IdempotentRequest(models.Model):
+    """
+    Stored response of a write sent with a client idempotency key. A retry
+    with the same key gets this response back instead of redoing the write.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=64)
+    request_hash = models.CharField(max_length=64)  # Rejects reuse of a key for a different request
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} for {self.user_id}"
+
+
+class Task(models.Model):
+    """
+    Follow-up work queued by the views and run by `manage.py run_tasks`.
+    Failures are retried with exponential backoff; a task that fails
+    `max_attempts` times is kept in the dead state for inspection.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead'),
+    ]
+
+    name = models.CharField(max_length=100)  # Registered in api/tasks.py
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)  # Not before; pushed back on retries
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Tasks scheduled under a key are coalesced: while one is queued, later
+    # triggers push it back and update its arguments instead of adding more
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    coalesced = models.PositiveIntegerField(default=0)  # Triggers folded into this run
+
+    class Meta:
+        indexes = [
+            # Due tasks, and running ones whose worker may have died
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(status='queued'),
+                name='unique_queued_task_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
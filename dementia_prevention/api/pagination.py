@@ -0,0 +1,92 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode the ordering values of the last row of a page as an opaque string"""
+    # DjangoJSONEncoder rounds datetimes to milliseconds, which would make
+    # the next page skip the rows sharing the last row's millisecond
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(values, cls=DjangoJSONEncoder).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, count):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != count:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def get_page_size(request):
+    """Page size from `?page_size=`, bounded by the HISTORY_* settings"""
+    default = getattr(settings, 'HISTORY_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'HISTORY_MAX_PAGE_SIZE', 500)
+    try:
+        size = int(request.query_params.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return min(max(size, 1), maximum)
+
+
+def _after(queryset, ordering, values):
+    """Q matching the rows that sort strictly after `values` in `ordering`"""
+    model = queryset.model
+    fields = [name.lstrip('-') for name in ordering]
+    try:
+        values = [
+            model._meta.get_field(name).to_python(value)
+            for name, value in zip(fields, values)
+        ]
+    except ValidationError:
+        raise InvalidCursor(values)
+
+    condition = Q()
+    for i, name in enumerate(ordering):
+        lookup = 'lt' if name.startswith('-') else 'gt'
+        step = Q(**{f'{fields[i]}__{lookup}': values[i]})
+        for prev in range(i):
+            step &= Q(**{fields[prev]: values[prev]})
+        condition |= step
+    return condition
+
+
+def paginate_keyset(queryset, request, ordering):
+    """
+    Return one page of `queryset` and the cursor of the next page (or None).
+
+    `ordering` must end with a unique column (e.g. `('-date', '-id')`) so the
+    order is total. The page is found with a range condition on the ordering
+    columns instead of OFFSET, and nothing is counted, so every page costs
+    the same whatever the length of the history.
+
+    Raises InvalidCursor when `?cursor=` cannot be decoded.
+    """
+    page_size = get_page_size(request)
+    queryset = queryset.order_by(*ordering)
+
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        queryset = queryset.filter(_after(queryset, ordering, decode_cursor(cursor, len(ordering))))
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, name.lstrip('-')) for name in ordering])
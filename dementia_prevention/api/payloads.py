@@ -0,0 +1,65 @@
+import gzip
+import hashlib
+import json
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+class PrecomputedPayload:
+    """
+    A JSON response body encoded and compressed once, served with strong
+    ETags derived from its content hash. Each content-coding gets its own
+    tag (`"<hash>"`, `"<hash>-gzip"`, `"<hash>-br"`), as strong validators
+    must differ between representations.
+    """
+
+    def __init__(self, data):
+        self.body = json.dumps(data, separators=(',', ':')).encode()
+        self.digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.encoded = {None: self.body, 'gzip': gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body)
+        self.etags = {
+            encoding: '"%s-%s"' % (self.digest, encoding) if encoding else '"%s"' % self.digest
+            for encoding in self.encoded
+        }
+
+    def _pick_encoding(self, accept_encoding):
+        accepted = {
+            token.split(';')[0].strip().lower()
+            for token in accept_encoding.split(',')
+            if not re.search(r';\s*q=0(\.0*)?\s*$', token)
+        }
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.encoded:
+                return encoding
+        return None
+
+    def matches(self, if_none_match):
+        """True when an If-None-Match header names any variant of this payload"""
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        return '*' in tags or not tags.isdisjoint(self.etags.values())
+
+    def response(self, request):
+        """
+        Build the response for `request`: 304 when If-None-Match already
+        names this payload, otherwise the best pre-compressed variant.
+        """
+        encoding = self._pick_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if self.matches(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(self.encoded[encoding], content_type='application/json')
+            if encoding:
+                response['Content-Encoding'] = encoding
+
+        response['ETag'] = self.etags[encoding]
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -3,9 +3,10 @@ from rest_framework.permissions import BasePermission
 
 class IsCaregiver(BasePermission):
     def has_permission(self, request, view):
-        return hasattr(request.user, 'caregiver')
+        return request.role.is_caregiver
 
 class IsPatientCaregiver(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.caregivers.filter(id=request.user.caregiver.id).exists()
+        caregiver = request.role.caregiver
+        return caregiver is not None and obj.caregivers.filter(id=caregiver.id).exists()
     
\ No newline at end of file
@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+# Query flag and header turning the profiler on for one request
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+# Profile kind -> (file suffix, content type)
+PROFILE_FILES = {
+    'cpu': ('collapsed', 'text/plain; charset=utf-8'),
+    'memory': ('alloc.txt', 'text/plain; charset=utf-8'),
+}
+
+PROFILE_ID = re.compile(r'[0-9a-f]{32}')
+
+
+# One profiled call at a time per process: the state it changes is shared
+_profile_lock = threading.Lock()
+
+
+def _profile_dir():
+    return getattr(settings, 'PROFILE_DIR', '/tmp/prodim-profiles')
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path + os.sep):
+            filename = filename[len(path) + 1:]
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of one thread every `interval` seconds and counts the
+    stacks in the collapsed format read by flamegraph.pl, speedscope and
+    most other flame graph viewers.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def profile_requested(request):
+    if not getattr(settings, 'PROFILE_REQUESTS', False):
+        return False
+    return request.GET.get(PROFILE_PARAM) == '1' or request.META.get(PROFILE_HEADER) == '1'
+
+
+def profile_call(func, label):
+    """
+    Run `func()` under the stack sampler and tracemalloc and store both
+    profiles. Returns `(result, profile_id)`.
+
+    While it runs, tracemalloc traces and the shorter thread switch interval
+    apply to every thread of the process, slowing down the requests other
+    threads serve; both are put back as they were when it returns, even if
+    `func` raises. Calls are serialized: while one is under way, others run
+    `func()` unprofiled and return None as the profile id.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return func(), None
+
+    try:
+        interval = getattr(settings, 'PROFILE_SAMPLE_INTERVAL', 0.001)
+        sampler = StackSampler(threading.get_ident(), interval)
+        was_tracing = tracemalloc.is_tracing()
+        switch_interval = sys.getswitchinterval()
+        try:
+            if not was_tracing:
+                tracemalloc.start(getattr(settings, 'PROFILE_TRACEBACK_DEPTH', 10))
+            # Let the sampler get the GIL as often as it wants to sample
+            sys.setswitchinterval(min(switch_interval, interval))
+            sampler.start()
+            start = time.perf_counter()
+            try:
+                result = func()
+            finally:
+                duration = time.perf_counter() - start
+                sampler.stop()
+                allocations = tracemalloc.take_snapshot()
+        finally:
+            sys.setswitchinterval(switch_interval)
+            if not was_tracing:
+                tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+
+    profile_id = store_profile(label, duration, sampler, allocations)
+    return result, profile_id
+
+
+def _allocation_report(label, duration, allocations, limit=50):
+    allocations = allocations.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    stats = allocations.statistics('traceback')
+    total = sum(stat.size for stat in stats)
+    lines = [
+        f'# {label} took {duration * 1000:.1f} ms',
+        f'# {total / 1024:.1f} KiB allocated and still live at the end of the request',
+        '',
+    ]
+    for stat in stats[:limit]:
+        lines.append(f'{stat.size / 1024:.1f} KiB in {stat.count} blocks')
+        lines.extend(f'    {line}' for line in stat.traceback.format())
+    return '\n'.join(lines) + '\n'
+
+
+def store_profile(label, duration, sampler, allocations):
+    """Write the profiles of one request to PROFILE_DIR and return its id"""
+    directory = _profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+
+    with open(profile_path(profile_id, 'cpu'), 'w') as f:
+        f.write(sampler.collapsed())
+    with open(profile_path(profile_id, 'memory'), 'w') as f:
+        f.write(_allocation_report(label, duration, allocations))
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump({
+            'id': profile_id,
+            'request': label,
+            'duration_ms': round(duration * 1000, 1),
+            'samples': sum(sampler.stacks.values()),
+            'created_at': timezone.now().isoformat(),
+        }, f)
+    return profile_id
+
+
+def profile_path(profile_id, kind):
+    """Path of a stored profile, or None for ids that can't be ours"""
+    if not PROFILE_ID.fullmatch(profile_id) or kind not in PROFILE_FILES:
+        return None
+    return os.path.join(_profile_dir(), f'{profile_id}.{PROFILE_FILES[kind][0]}')
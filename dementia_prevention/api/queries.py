@@ -0,0 +1,75 @@
+from django.db.models import OuterRef, Prefetch, Subquery
+
+from .models import (
+    BrainHealthAssessment,
+    CognitiveTestResult,
+    LifestyleData,
+    Recommendation
+)
+
+
+def _latest_id(queryset, *ordering):
+    """Correlated subquery returning the id of the first row in `ordering`"""
+    return Subquery(queryset.order_by(*ordering).values('id')[:1])
+
+
+def with_latest_ids(patients):
+    """
+    Annotate a Patient queryset with the ids of each patient's latest
+    cognitive test, lifestyle entry and brain health assessment.
+    """
+    return patients.annotate(
+        latest_test_id=_latest_id(
+            CognitiveTestResult.objects.filter(patient=OuterRef('pk')),
+            '-date_taken', '-id'
+        ),
+        latest_lifestyle_id=_latest_id(
+            LifestyleData.objects.filter(user=OuterRef('user_id')),
+            '-date', '-id'
+        ),
+        latest_assessment_id=_latest_id(
+            BrainHealthAssessment.objects.filter(patient=OuterRef('pk')),
+            '-date', '-id'
+        ),
+    )
+
+
+def load_patient_dashboards(patients):
+    """
+    Load every patient in `patients` together with their latest rows and open
+    recommendations using a fixed number of queries, whatever the number of
+    patients:
+
+    - one query for the patients (with their users and latest row ids)
+    - one prefetch for the open recommendations
+    - one `in_bulk` per latest-row model
+
+    Each returned patient gets `latest_test`, `latest_lifestyle`,
+    `latest_assessment` (or None) and `open_recommendations` attributes.
+    """
+    patients = list(
+        with_latest_ids(patients)
+        .select_related('user')
+        .prefetch_related(Prefetch(
+            'recommendations',
+            queryset=Recommendation.objects.filter(completed=False),
+            to_attr='open_recommendations'
+        ))
+    )
+
+    tests = CognitiveTestResult.objects.in_bulk(
+        [p.latest_test_id for p in patients if p.latest_test_id]
+    )
+    lifestyles = LifestyleData.objects.in_bulk(
+        [p.latest_lifestyle_id for p in patients if p.latest_lifestyle_id]
+    )
+    assessments = BrainHealthAssessment.objects.in_bulk(
+        [p.latest_assessment_id for p in patients if p.latest_assessment_id]
+    )
+
+    for patient in patients:
+        patient.latest_test = tests.get(patient.latest_test_id)
+        patient.latest_lifestyle = lifestyles.get(patient.latest_lifestyle_id)
+        patient.latest_assessment = assessments.get(patient.latest_assessment_id)
+
+    return patients
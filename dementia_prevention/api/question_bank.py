@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+from .models import CognitiveTestQuestion
+from .payloads import PrecomputedPayload
+from .scoring import CompiledAnswerKey
+from .versioning import VersionedCache
+
+QuestionBank = namedtuple(
+    'QuestionBank', ['version', 'questions', 'answer_key', 'compiled_key', 'payload']
+)
+
+QUESTION_BANK = 'question_bank'
+
+
+def _build_question_bank(version):
+    rows = CognitiveTestQuestion.objects.order_by('id').values_list(
+        'id', 'question', 'options', 'correct_answer'
+    )
+    questions = []
+    answer_key = {}
+    for pk, question, options, correct_answer in rows:
+        # Public-facing questions (answers stripped out)
+        questions.append({'id': pk, 'question': question, 'options': options})
+        answer_key[pk] = correct_answer
+
+    return QuestionBank(
+        version=version,
+        questions=questions,
+        answer_key=answer_key,
+        compiled_key=CompiledAnswerKey(answer_key, version=version),
+        payload=PrecomputedPayload({'questions': questions, 'version': version})
+    )
+
+
+_question_bank = VersionedCache(QUESTION_BANK, _build_question_bank)
+
+
+def get_question_bank():
+    """The current question bank, cached per worker until its version changes"""
+    return _question_bank.get()
@@ -0,0 +1,68 @@
+from .changes import record_owned_changes
+from .models import Recommendation
+
+# Fields of a generated recommendation that can change for the same (category, title)
+RECOMMENDATION_FIELDS = ['description', 'priority']
+
+
+def reconcile_recommendations(patient, generated):
+    """
+    Make the patient's open recommendations match `generated`, a list of
+    recommendation dicts, matching rows on (category, title). Unchanged rows
+    keep their id and state; only new, changed and dropped rows are written,
+    with one bulk insert, one bulk update and one delete. Completed
+    recommendations are history and never touched.
+
+    Returns `(created, updated, deleted)` counts.
+    """
+    return reconcile_many({patient: generated})
+
+
+def reconcile_many(generated):
+    """
+    reconcile_recommendations for several patients at once, with the same
+    number of queries apart from the tombstone of each dropped row.
+    `generated` maps patients (pk and user_id are enough) to their
+    recommendation dicts.
+    """
+    owners = {patient.pk: patient.user_id for patient in generated}
+    existing = {}
+    stale = []
+    rows = Recommendation.objects.filter(patient_id__in=owners, completed=False).order_by('id')
+    for rec in rows:
+        key = (rec.patient_id, rec.category, rec.title)
+        if key in existing:
+            stale.append(rec)  # Duplicates left by earlier versions
+        else:
+            existing[key] = rec
+
+    new, changed = [], []
+    for patient, recommendations in generated.items():
+        for values in recommendations:
+            rec = existing.pop((patient.pk, values['category'], values['title']), None)
+            if rec is None:
+                new.append(Recommendation(
+                    patient_id=patient.pk,
+                    category=values['category'],
+                    title=values['title'],
+                    description=values['description'],
+                    priority=values['priority']
+                ))
+            elif any(getattr(rec, field) != values[field] for field in RECOMMENDATION_FIELDS):
+                for field in RECOMMENDATION_FIELDS:
+                    setattr(rec, field, values[field])
+                changed.append(rec)
+    stale.extend(existing.values())
+
+    # Bulk writes send no model signals, so the change log is written here
+    if new:
+        Recommendation.objects.bulk_create(new)
+    if changed:
+        Recommendation.objects.bulk_update(changed, RECOMMENDATION_FIELDS)
+    if new or changed:
+        record_owned_changes(Recommendation, [(owners[rec.patient_id], rec.pk) for rec in new + changed])
+    if stale:
+        # A regular delete: its post_delete signals write the tombstones
+        Recommendation.objects.filter(pk__in=[rec.pk for rec in stale]).delete()
+
+    return len(new), len(changed), len(stale)
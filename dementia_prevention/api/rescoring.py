@@ -0,0 +1,285 @@
+import json
+import os
+from bisect import bisect_left
+from contextlib import nullcontext
+
+try:
+    import numpy as np
+except ImportError:  # Scored row by row instead
+    np = None
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .changes import record_owned_changes
+from .models import (
+    LIFESTYLE_FACTORS,
+    BrainHealthAssessment,
+    CognitiveTestResult,
+    LifestyleData,
+    Patient,
+    ScoringRule
+)
+from .reconcile import reconcile_many
+from .rules import COMPARATORS, get_scoring_rules
+from .scoring import SCORE_SCALE
+from .snapshots import refresh_patient_snapshots
+
+# Buckets of the score distribution report: 0-10, 10-20, ..., 90-100
+HISTOGRAM_BINS = list(range(0, 101, 10))
+
+ASSESSMENT_FIELDS = ['score', 'cognitive_score', 'lifestyle_data', 'rule_version']
+
+
+class RulesChanged(Exception):
+    """The scoring rules changed while a rescoring run was in progress"""
+
+
+def empty_stats():
+    return {
+        'patients': 0,
+        'scored': 0,
+        'skipped': 0,  # Up to date, or without a test or lifestyle entry
+        'old_sum': 0.0,
+        'new_sum': 0.0,
+        'compared': 0,  # Scored patients that had an assessment before
+        'compared_sum': 0.0,  # Their new scores
+        'up': 0,
+        'down': 0,
+        'old_histogram': [0] * (len(HISTOGRAM_BINS) - 1),
+        'new_histogram': [0] * (len(HISTOGRAM_BINS) - 1),
+        'recommendations': [0, 0, 0],  # created, updated, deleted
+    }
+
+
+def merge_stats(total, stats):
+    for name, value in stats.items():
+        if isinstance(value, list):
+            total[name] = [a + b for a, b in zip(total[name], value)]
+        else:
+            total[name] += value
+    return total
+
+
+def histogram(scores):
+    if np is not None:
+        return np.histogram(np.asarray(scores, dtype=float), bins=HISTOGRAM_BINS)[0].tolist()
+    counts = [0] * (len(HISTOGRAM_BINS) - 1)
+    for score in scores:
+        counts[min(int(score // 10), len(counts) - 1)] += 1
+    return counts
+
+
+def pending_ranges(done, chunk_size):
+    """
+    `(lo, hi]` patient id ranges of at most `chunk_size` patients, covering
+    every patient outside the `done` ranges of an earlier run
+    """
+    done = sorted(tuple(bounds) for bounds in done)
+    ranges = []
+    start = last = None
+    count = 0
+    ids = Patient.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=10000)
+    for pk in ids:
+        index = bisect_left(done, (pk,))
+        covered = index > 0 and done[index - 1][0] < pk <= done[index - 1][1]
+        if covered or count == chunk_size:
+            if start is not None:
+                ranges.append((start, last))
+            start, count = None, 0
+        if covered:
+            continue
+        if start is None:
+            start = pk - 1
+        last = pk
+        count += 1
+    if start is not None:
+        ranges.append((start, last))
+    return ranges
+
+
+def load_chunk(lo, hi):
+    """
+    `(patient id, user id, latest test score, latest lifestyle values,
+    latest assessment score, its rule version)` of the patients with
+    lo < id <= hi, in two queries
+    """
+    latest_test = CognitiveTestResult.objects.filter(patient=OuterRef('pk')).order_by('-date_taken', '-id')
+    latest_lifestyle = LifestyleData.objects.filter(user_id=OuterRef('user_id')).order_by('-date', '-id')
+    latest_assessment = BrainHealthAssessment.objects.filter(patient=OuterRef('pk')).order_by('-date', '-id')
+    rows = list(
+        Patient.objects.filter(pk__gt=lo, pk__lte=hi)
+        .annotate(
+            test_score=Subquery(latest_test.values('score')[:1]),
+            lifestyle_id=Subquery(latest_lifestyle.values('id')[:1]),
+            old_score=Subquery(latest_assessment.values('score')[:1]),
+            old_version=Subquery(latest_assessment.values('rule_version')[:1]),
+        )
+        .order_by('pk')
+        .values_list('pk', 'user_id', 'test_score', 'lifestyle_id', 'old_score', 'old_version')
+    )
+    lifestyle = {
+        values[0]: dict(zip(LIFESTYLE_FACTORS, values[1:]))
+        for values in LifestyleData.objects.filter(
+            id__in=[row[3] for row in rows if row[3] is not None]
+        ).values_list('id', *LIFESTYLE_FACTORS)
+    }
+    return [
+        (pk, user_id, test_score, lifestyle.get(lifestyle_id), lifestyle_id, old_score, old_version)
+        for pk, user_id, test_score, lifestyle_id, old_score, old_version in rows
+    ]
+
+
+def evaluate(rules, test_scores, lifestyles):
+    """
+    Scores and recommendations of many patients. With NumPy the rules run
+    once per chunk over arrays, one comparison per rule; CompiledRules
+    evaluates them in the same order, so both give identical floats.
+    """
+    if np is None:
+        scores = [rules.score(score, lifestyle) for score, lifestyle in zip(test_scores, lifestyles)]
+        return scores, [rules.recommend(score, lifestyle) for score, lifestyle in zip(scores, lifestyles)]
+
+    columns = {
+        factor: np.array([lifestyle.get(factor) or 0 for lifestyle in lifestyles], dtype=float)
+        for factor in LIFESTYLE_FACTORS
+    }
+    scores = np.asarray(test_scores, dtype=float) * 100 / SCORE_SCALE
+    for factor, comparator, threshold, weight in rules.adjustments:
+        scores = scores + np.where(COMPARATORS[comparator](columns[factor], threshold), weight, 0.0)
+    scores = np.clip(scores, 0, 100)
+
+    if not rules.recommendations:
+        return scores.tolist(), [[] for _ in lifestyles]
+    matches = np.vstack([
+        compare(scores if factor == ScoringRule.BRAIN_HEALTH_SCORE else columns[factor], threshold)
+        for factor, compare, threshold, template in rules.recommendations
+    ])
+    templates = [template for factor, compare, threshold, template in rules.recommendations]
+    recommendations = [
+        [dict(templates[index]) for index in np.flatnonzero(matches[:, column])]
+        for column in range(len(lifestyles))
+    ]
+    return scores.tolist(), recommendations
+
+
+def rescore_chunk(lo, hi, version, dry_run=False, rescore_all=False):
+    """
+    Recompute today's assessment and the open recommendations of the
+    patients with lo < id <= hi against scoring rules `version`. Runs in the
+    worker processes of rescore_assessments; returns the chunk's stats.
+    """
+    rules = get_scoring_rules()
+    if rules.version != version:
+        raise RulesChanged(f'Scoring rules are now v{rules.version}, the run started with v{version}')
+
+    with nullcontext() if dry_run else transaction.atomic():
+        if not dry_run:
+            # Like every assessment writer (see assessments.lock_patient), lock
+            # the patients before reading their inputs; queued recomputes of
+            # them wait for the chunk instead of racing it
+            list(
+                Patient.objects.select_for_update().filter(pk__gt=lo, pk__lte=hi)
+                .order_by('pk').values_list('pk', flat=True)
+            )
+
+        stats = empty_stats()
+        rows = load_chunk(lo, hi)
+        stats['patients'] = len(rows)
+        rows = [
+            row for row in rows
+            if row[2] is not None and row[3] is not None and (rescore_all or row[6] != version)
+        ]
+        stats['skipped'] = stats['patients'] - len(rows)
+        if not rows:
+            return stats
+
+        scores, recommendations = evaluate(rules, [row[2] for row in rows], [row[3] for row in rows])
+        compared = [(row[5], score) for row, score in zip(rows, scores) if row[5] is not None]
+        stats.update(
+            scored=len(rows),
+            new_sum=sum(scores),
+            new_histogram=histogram(scores),
+            old_sum=sum(old for old, new in compared),
+            compared_sum=sum(new for old, new in compared),
+            old_histogram=histogram([old for old, new in compared]),
+            compared=len(compared),
+            up=sum(1 for old, new in compared if new > old),
+            down=sum(1 for old, new in compared if new < old),
+        )
+        if dry_run:
+            return stats
+
+        today = timezone.localdate()
+        owners = {row[0]: row[1] for row in rows}
+        BrainHealthAssessment.objects.bulk_create(
+            [
+                BrainHealthAssessment(
+                    patient_id=row[0], date=today, score=score,
+                    cognitive_score=row[2], lifestyle_data_id=row[4], rule_version=version
+                )
+                for row, score in zip(rows, scores)
+            ],
+            update_conflicts=True,
+            unique_fields=['patient', 'date'],
+            update_fields=ASSESSMENT_FIELDS
+        )
+        # Upserts send no signals, log the sync changes and refresh what derives from them
+        assessments = BrainHealthAssessment.objects.filter(patient_id__in=owners, date=today)
+        record_owned_changes(
+            BrainHealthAssessment,
+            [(owners[patient_id], pk) for patient_id, pk in assessments.values_list('patient_id', 'pk')]
+        )
+        stats['recommendations'] = list(reconcile_many({
+            Patient(pk=row[0], user_id=row[1]): generated
+            for row, generated in zip(rows, recommendations)
+        }))
+        refresh_patient_snapshots(Patient.objects.filter(pk__in=owners))
+    return stats
+
+
+class Checkpoint:
+    """
+    Progress of a rescoring run in a JSON file: the finished id ranges and
+    the stats so far, for the rule version it was started with. Without a
+    path the progress is only kept in memory.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.state = {'version': version, 'done': [], 'stats': empty_stats()}
+
+    def resume(self):
+        """Pick up a matching earlier run; returns whether there was one"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get('version') != self.state['version']:
+            return False
+        self.state = state
+        return True
+
+    @property
+    def done(self):
+        return self.state['done']
+
+    @property
+    def stats(self):
+        return self.state['stats']
+
+    def record(self, bounds, stats):
+        self.state['done'].append(list(bounds))
+        merge_stats(self.state['stats'], stats)
+        if not self.path:
+            return
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        """Remove the file of a finished run"""
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
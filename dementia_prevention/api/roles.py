@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+
+# Reverse one-to-one accessors of the profile models on User
+PROFILES = ('patient_profile', 'caregiver_profile')
+
+
+class Role:
+    """The patient and caregiver profiles of a user (None when they have none)"""
+
+    __slots__ = ('patient', 'caregiver')
+
+    def __init__(self, patient=None, caregiver=None):
+        self.patient = patient
+        self.caregiver = caregiver
+
+    @property
+    def is_patient(self):
+        return self.patient is not None
+
+    @property
+    def is_caregiver(self):
+        return self.caregiver is not None
+
+    def __repr__(self):
+        return f'<Role patient={self.patient!r} caregiver={self.caregiver!r}>'
+
+
+def _profile(user, accessor):
+    try:
+        return getattr(user, accessor)
+    except ObjectDoesNotExist:
+        return None
+
+
+def profiles_loaded(user):
+    """Whether both profiles are already cached on the user instance"""
+    return all(getattr(User, accessor).related.is_cached(user) for accessor in PROFILES)
+
+
+def resolve_role(user):
+    """
+    Role of `user`. Loads the user with both profiles in one query, or none
+    when whoever loaded the user already select_related them.
+    """
+    if user is None or not user.is_authenticated:
+        return Role()
+    if not profiles_loaded(user):
+        user = User.objects.select_related(*PROFILES).get(pk=user.pk)
+    return Role(patient=_profile(user, 'patient_profile'), caregiver=_profile(user, 'caregiver_profile'))
+
@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import LIFESTYLE_FACTORS, LifestyleData, LifestyleRollup, LifestyleStats
+
+# lifestyle_stats window -> length in days (None: all time)
+STATS_WINDOWS = {
+    '7d': 7,
+    '30d': 30,
+    '90d': 90,
+    'all': None,
+}
+
+
+def aggregate_windows(user_id, today):
+    """
+    Entry count and per-factor sums of every stats window, computed in one
+    conditional-aggregation query over the user's entries.
+    """
+    aggregates = {}
+    for window, days in STATS_WINDOWS.items():
+        condition = Q(date__gte=today - timedelta(days=days)) if days else Q()
+        aggregates[f'{window}__count'] = Count('id', filter=condition)
+        for factor in LIFESTYLE_FACTORS:
+            aggregates[f'{window}__{factor}'] = Sum(factor, filter=condition)
+
+    row = LifestyleData.objects.filter(user_id=user_id).aggregate(**aggregates)
+    return {
+        window: {
+            'count': row[f'{window}__count'],
+            'sums': {factor: row[f'{window}__{factor}'] or 0 for factor in LIFESTYLE_FACTORS},
+        }
+        for window in STATS_WINDOWS
+    }
+
+
+def refresh_lifestyle_stats(user_id, today=None):
+    """
+    Recompute and store a user's stats windows from all their entries, once
+    a day per user or for rows written in bulk without signals
+    """
+    today = today or timezone.localdate()
+    latest_entry = LifestyleData.objects.filter(user_id=user_id).order_by('-date', '-id').first()
+    stats, created = LifestyleStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'as_of': today,
+            'windows': aggregate_windows(user_id, today),
+            'latest_entry': latest_entry,
+        }
+    )
+    return stats
+
+
+def entry_state(entry):
+    """The fields of a lifestyle entry the stats windows are built from"""
+    day = entry.date.date() if isinstance(entry.date, datetime) else entry.date
+    return {'date': day, **{factor: getattr(entry, factor) for factor in LIFESTYLE_FACTORS}}
+
+
+def update_lifestyle_stats(user_id, changes, today=None):
+    """
+    Apply written entries to a user's stats windows without reading their
+    history: `changes` are (old, new) pairs of entry_state() dicts, old None
+    for a created entry and new None for a deleted one. Stats that are
+    missing or anchored on an earlier day are recomputed instead.
+    """
+    today = today or timezone.localdate()
+    # Joins the caller's transaction, if any; the lock keeps concurrent
+    # writers of the same user from losing each other's deltas
+    with transaction.atomic(savepoint=False):
+        stats = LifestyleStats.objects.select_for_update().filter(user_id=user_id, as_of=today).first()
+        if stats is None:
+            return refresh_lifestyle_stats(user_id, today)
+
+        for old, new in changes:
+            for sign, entry in ((-1, old), (1, new)):
+                if entry is None:
+                    continue
+                for window, days in STATS_WINDOWS.items():
+                    if days and entry['date'] < today - timedelta(days=days):
+                        continue
+                    totals = stats.windows[window]
+                    totals['count'] += sign
+                    for factor in LIFESTYLE_FACTORS:
+                        totals['sums'][factor] += sign * entry[factor]
+
+        stats.latest_entry = LifestyleData.objects.filter(user_id=user_id).order_by('-date', '-id').first()
+        stats.save(update_fields=['windows', 'latest_entry', 'updated_at'])
+    return stats
+
+
+def get_lifestyle_stats(user_id):
+    """
+    A user's stats for today: one row lookup when they are warm, otherwise
+    recomputed (the windows have moved since the row was written).
+    """
+    today = timezone.localdate()
+    try:
+        return LifestyleStats.objects.select_related('latest_entry').get(user_id=user_id, as_of=today)
+    except LifestyleStats.DoesNotExist:
+        return refresh_lifestyle_stats(user_id, today)
+
+
+def _week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+# rollup period -> (database truncation, bucket start of a date, start of the next bucket)
+ROLLUP_PERIODS = {
+    'week': (TruncWeek, _week_start, lambda start: start + timedelta(days=7)),
+    'month': (TruncMonth, _month_start, _next_month),
+}
+
+
+def bucket_totals(user_id, period, condition=Q()):
+    """
+    Entry count and factor sums of a user's entries grouped by calendar
+    bucket, using Trunc functions that every supported backend implements.
+    """
+    trunc = ROLLUP_PERIODS[period][0]
+    return (
+        LifestyleData.objects.filter(condition, user_id=user_id)
+        .annotate(period_start=trunc('date'))
+        .values('period_start')
+        .annotate(entry_count=Count('id'), **{factor: Sum(factor) for factor in LIFESTYLE_FACTORS})
+        .order_by('period_start')
+    )
+
+
+def refresh_lifestyle_rollups(user_id, dates):
+    """
+    Recompute the week and month rollups containing `dates` after entries on
+    those dates were written or deleted. Only the touched buckets are read
+    and rewritten.
+    """
+    for period, (_, bucket_start, next_start) in ROLLUP_PERIODS.items():
+        starts = {bucket_start(day) for day in dates}
+        if not starts:
+            continue
+
+        condition = Q()
+        for start in starts:
+            condition |= Q(date__gte=start, date__lt=next_start(start))
+
+        buckets = list(bucket_totals(user_id, period, condition))
+        LifestyleRollup.objects.bulk_create(
+            [LifestyleRollup(user_id=user_id, period=period, **bucket) for bucket in buckets],
+            update_conflicts=True,
+            unique_fields=['user', 'period', 'period_start'],
+            update_fields=['entry_count'] + LIFESTYLE_FACTORS
+        )
+
+        emptied = starts - {bucket['period_start'] for bucket in buckets}
+        if emptied:
+            LifestyleRollup.objects.filter(
+                user_id=user_id, period=period, period_start__in=emptied
+            ).delete()
+
+
+def get_lifestyle_rollups(user_id, period):
+    """
+    A user's rollups for `period`, oldest first, as dicts with the same keys
+    as bucket_totals(). Falls back to grouping the entries directly when no
+    rollups are stored for the user.
+    """
+    fields = ['period_start', 'entry_count'] + LIFESTYLE_FACTORS
+    rollups = list(
+        LifestyleRollup.objects.filter(user_id=user_id, period=period)
+        .order_by('period_start')
+        .values(*fields)
+    )
+    return rollups or list(bucket_totals(user_id, period))
+
+
+def rebuild_lifestyle_rollups(user_ids):
+    """
+    Rebuild every rollup of `user_ids` from their entries, for rows written
+    in bulk without signals (imports, generated populations).
+    """
+    LifestyleRollup.objects.filter(user_id__in=user_ids).delete()
+    for period, (trunc, _, _) in ROLLUP_PERIODS.items():
+        buckets = (
+            LifestyleData.objects.filter(user_id__in=user_ids)
+            .annotate(period_start=trunc('date'))
+            .values('user_id', 'period_start')
+            .annotate(entry_count=Count('id'), **{factor: Sum(factor) for factor in LIFESTYLE_FACTORS})
+            .order_by()
+        )
+        LifestyleRollup.objects.bulk_create(
+            (LifestyleRollup(period=period, **bucket) for bucket in buckets.iterator()),
+            batch_size=1000
+        )
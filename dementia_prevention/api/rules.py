@@ -0,0 +1,98 @@
+import operator
+from collections import namedtuple
+
+from .models import ScoringRule
+from .scoring import SCORE_SCALE
+from .versioning import VersionedCache
+
+SCORING_RULES = 'scoring_rules'
+
+COMPARATORS = {
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'eq': operator.eq,
+}
+
+RULE_FIELDS = [
+    'factor', 'comparator', 'threshold', 'weight',
+    'category', 'title', 'description', 'priority',
+]
+
+# Score adjustment: `weight` points when `compare(value of factor, threshold)`
+Adjustment = namedtuple('Adjustment', ['factor', 'comparator', 'threshold', 'weight'])
+Evaluation = namedtuple('Evaluation', ['score', 'recommendations', 'version'])
+
+
+class CompiledRules:
+    """
+    Scoring rules compiled once into flat tuples, so evaluating them is a
+    handful of comparisons. `rules` are dicts with the RULE_FIELDS keys, in
+    recommendation order.
+
+    The score is the cognitive score scaled to 0-100 plus the weights of the
+    matching lifestyle rules, clamped to 0-100. Recommendation rules may also
+    test the resulting score (ScoringRule.BRAIN_HEALTH_SCORE).
+    """
+
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.adjustments = []
+        self.recommendations = []  # (factor, compare, threshold, template)
+        for rule in rules:
+            compare = COMPARATORS[rule['comparator']]
+            if rule['weight']:
+                if rule['factor'] == ScoringRule.BRAIN_HEALTH_SCORE:
+                    raise ValueError('Rules on the brain health score can only recommend')
+                self.adjustments.append(Adjustment(
+                    rule['factor'], rule['comparator'], rule['threshold'], rule['weight']
+                ))
+            if rule['title']:
+                self.recommendations.append((rule['factor'], compare, rule['threshold'], {
+                    'category': rule['category'],
+                    'title': rule['title'],
+                    'description': rule['description'],
+                    'priority': rule['priority'],
+                }))
+        self._adjustments = [
+            (factor, COMPARATORS[comparator], threshold, weight)
+            for factor, comparator, threshold, weight in self.adjustments
+        ]
+
+    def score(self, cognitive_score, lifestyle_data):
+        """Brain health score (0-100) of a cognitive score and a dict of lifestyle factors"""
+        total = cognitive_score * 100 / SCORE_SCALE
+        for factor, compare, threshold, weight in self._adjustments:
+            if compare(lifestyle_data.get(factor, 0), threshold):
+                total += weight
+        return min(max(total, 0), 100)
+
+    def recommend(self, brain_health_score, lifestyle_data):
+        """Recommendation dicts for a score and its lifestyle factors"""
+        recommendations = []
+        for factor, compare, threshold, template in self.recommendations:
+            if factor == ScoringRule.BRAIN_HEALTH_SCORE:
+                value = brain_health_score
+            else:
+                value = lifestyle_data.get(factor, 0)
+            if compare(value, threshold):
+                recommendations.append(dict(template))
+        return recommendations
+
+    def evaluate(self, cognitive_score, lifestyle_data):
+        score = self.score(cognitive_score, lifestyle_data)
+        return Evaluation(score, self.recommend(score, lifestyle_data), self.version)
+
+
+def _build_scoring_rules(version):
+    rules = ScoringRule.objects.filter(active=True).order_by('order', 'id').values(*RULE_FIELDS)
+    return CompiledRules(rules, version=version)
+
+
+_scoring_rules = VersionedCache(SCORING_RULES, _build_scoring_rules)
+
+
+def get_scoring_rules():
+    """The active scoring rules, compiled per worker until their version changes"""
+    return _scoring_rules.get()
@@ -0,0 +1,103 @@
+import re
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+# Scores are reported on a 0-50 scale
+SCORE_SCALE = 50
+
+ScoreResult = namedtuple('ScoreResult', ['score', 'correct_answers', 'total_questions'])
+
+# answer-key marker (e.g. '(Open-ended)') -> callable(answer) -> bool
+RUBRICS = {}
+
+_WHITESPACE = re.compile(r'\s+')
+# Commas only as thousands separators: '1,000' is 1000, '1,0' no number
+_NUMBER = re.compile(r'[$€£]?\s*([-+]?(?:(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d*)?|\.\d+))')
+
+
+def rubric(*markers):
+    """
+    Register a rubric used for answer-key entries equal to one of `markers`
+    instead of comparing against the entry itself. Rubrics must be
+    registered before the key is compiled.
+    """
+    def register(func):
+        for marker in markers:
+            RUBRICS[marker] = func
+        return func
+    return register
+
+
+def normalize_text(value):
+    """Case- and whitespace-insensitive form of an answer"""
+    return _WHITESPACE.sub(' ', str(value)).strip().casefold()
+
+
+def as_number(value):
+    """Numeric value of answers such as '12', ' 12.0 ', '$30' or '1,000', else None"""
+    match = _NUMBER.fullmatch(normalize_text(value))
+    if not match:
+        return None
+    try:
+        return Decimal(match.group(1).replace(',', ''))
+    except InvalidOperation:
+        return None
+
+
+@rubric('(Open-ended)', '(Assess response)', '(Assess sequencing)', '(Assess recall)')
+def answered(answer):
+    """Default rubric for items assessed in person: any non-blank answer counts"""
+    return answer is not None and normalize_text(answer) != ''
+
+
+def compile_matcher(correct_answer):
+    """Turn one answer-key entry into a callable(answer) -> bool"""
+    if correct_answer in RUBRICS:
+        return RUBRICS[correct_answer]
+
+    expected_text = normalize_text(correct_answer)
+    expected_number = as_number(correct_answer)
+
+    def matches(answer):
+        if answer is None:
+            return False
+        if expected_number is not None and as_number(answer) == expected_number:
+            return True
+        return normalize_text(answer) == expected_text
+
+    return matches
+
+
+def _question_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class CompiledAnswerKey:
+    """An answer key compiled once into one matcher per question"""
+
+    def __init__(self, answer_key, version=None):
+        self.version = version
+        self.matchers = {
+            _question_id(question_id): compile_matcher(correct_answer)
+            for question_id, correct_answer in answer_key.items()
+            if correct_answer
+        }
+
+    def is_correct(self, question_id, answer):
+        matcher = self.matchers.get(_question_id(question_id))
+        return matcher is not None and matcher(answer)
+
+    def score(self, answers):
+        """Score a list of {'question_id': ..., 'answer': ...} items"""
+        if not isinstance(answers, list):
+            answers = []
+        total_questions = len(answers)
+        correct_answers = sum(
+            1 for item in answers
+            if isinstance(item, dict) and self.is_correct(item.get('question_id'), item.get('answer'))
+        )
+        score = round((correct_answers / total_questions) * SCORE_SCALE, 1) if total_questions else 0.0
+        return ScoreResult(score, correct_answers, total_questions)
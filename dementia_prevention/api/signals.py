@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user_tokens
+from .changes import owner_id, record_changes
+from .claims import revoke_claims
+from .models import (
+    BrainHealthAssessment,
+    Caregiver,
+    CognitiveTestQuestion,
+    CognitiveTestResult,
+    LifestyleData,
+    Patient,
+    Recommendation,
+    ScoringRule
+)
+from .question_bank import QUESTION_BANK
+from .rollups import entry_state, refresh_lifestyle_rollups, update_lifestyle_stats
+from .rules import SCORING_RULES
+from .versioning import bump_version
+
+SYNCED_SENDERS = [LifestyleData, CognitiveTestResult, BrainHealthAssessment, Recommendation]
+
+
+@receiver([post_save, post_delete], sender=CognitiveTestQuestion)
+def question_bank_changed(sender, **kwargs):
+    bump_version(QUESTION_BANK)
+
+
+@receiver([post_save, post_delete], sender=ScoringRule)
+def scoring_rules_changed(sender, **kwargs):
+    bump_version(SCORING_RULES)
+
+
+def owner_deleted(origin):
+    """
+    Whether a delete cascaded from the owning user or patient, whose
+    change log and derived rows are going away with it
+    """
+    model = getattr(origin, 'model', type(origin))
+    return model in (User, Patient)
+
+
+def synced_row_saved(sender, instance, **kwargs):
+    record_changes(sender, owner_id(instance), [instance.pk], 'upsert')
+
+
+def synced_row_deleted(sender, instance, origin=None, **kwargs):
+    if owner_deleted(origin):
+        return
+    record_changes(sender, owner_id(instance), [instance.pk], 'delete')
+
+
+for synced in SYNCED_SENDERS:
+    post_save.connect(synced_row_saved, sender=synced, dispatch_uid=f'changelog-save-{synced.__name__}')
+    post_delete.connect(synced_row_deleted, sender=synced, dispatch_uid=f'changelog-delete-{synced.__name__}')
+
+
+@receiver(pre_save, sender=LifestyleData)
+def lifestyle_data_saving(sender, instance, **kwargs):
+    # The stored values the stats windows have to take back out
+    stored = None
+    if instance.pk is not None:
+        stored = LifestyleData.objects.filter(pk=instance.pk).first()
+    instance._stored_state = entry_state(stored) if stored else None
+
+
+@receiver([post_save, post_delete], sender=LifestyleData)
+def lifestyle_data_changed(sender, instance, origin=None, **kwargs):
+    if owner_deleted(origin):
+        return
+    if kwargs['signal'] is post_delete:
+        change = (entry_state(instance), None)
+    else:
+        change = (getattr(instance, '_stored_state', None), entry_state(instance))
+    update_lifestyle_stats(instance.user_id, [change])
+    refresh_lifestyle_rollups(instance.user_id, {state['date'] for state in change if state})
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # Cached tokens and claims carry the user, deactivation and password changes included
+    invalidate_user_tokens(instance.pk)
+    revoke_claims(instance.pk)
+
+
+@receiver(user_logged_out)
+def user_logged_out_everywhere(sender, request, user, **kwargs):
+    if user is not None:
+        revoke_claims(user.pk)
+
+
+@receiver([post_save, post_delete], sender=Patient)
+@receiver([post_save, post_delete], sender=Caregiver)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_user_tokens(instance.user_id)
+    revoke_claims(instance.user_id)
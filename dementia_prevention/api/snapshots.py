@@ -0,0 +1,111 @@
+from django.db.models import Prefetch
+
+from .models import Patient, PatientSnapshot, Recommendation
+from .queries import load_patient_dashboards
+
+SNAPSHOT_FIELDS = [
+    'latest_test',
+    'latest_cognitive_score',
+    'latest_lifestyle',
+    'latest_assessment',
+    'open_recommendation_count',
+    'last_activity_at',
+    'updated_at',
+]
+
+
+def _snapshot_values(patient):
+    """Snapshot field values for a patient loaded by load_patient_dashboards"""
+    latest_test = patient.latest_test
+    latest_lifestyle = patient.latest_lifestyle
+    activity = [
+        moment for moment in (
+            latest_test.date_taken if latest_test else None,
+            latest_lifestyle.created_at if latest_lifestyle else None,
+        ) if moment
+    ]
+    return {
+        'latest_test': latest_test,
+        'latest_cognitive_score': latest_test.score if latest_test else None,
+        'latest_lifestyle': latest_lifestyle,
+        'latest_assessment': patient.latest_assessment,
+        'open_recommendation_count': len(patient.open_recommendations),
+        'last_activity_at': max(activity, default=None),
+    }
+
+
+def refresh_patient_snapshot(patient):
+    """
+    Recompute one patient's snapshot from the source tables. Call this from
+    inside the transaction that wrote the patient's data so the snapshot
+    never disagrees with it.
+    """
+    loaded = load_patient_dashboards(Patient.objects.filter(pk=patient.pk))[0]
+    snapshot, created = PatientSnapshot.objects.update_or_create(
+        patient=loaded,
+        defaults=_snapshot_values(loaded)
+    )
+    return snapshot
+
+
+def refresh_patient_snapshots(patients):
+    """
+    Rebuild the snapshots of every patient in `patients` in bulk. Upserts on
+    the patient, so concurrent rebuilds of the same patient (a dashboard
+    read building a missing snapshot while rebuild_patient_snapshots runs)
+    don't conflict; the last one wins.
+    """
+    loaded = load_patient_dashboards(patients)
+    snapshots = [
+        PatientSnapshot(patient=patient, **_snapshot_values(patient))
+        for patient in loaded
+    ]
+    PatientSnapshot.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['patient'],
+        update_fields=SNAPSHOT_FIELDS
+    )
+    return snapshots
+
+
+def load_snapshots(patients):
+    """
+    Load `patients` with their snapshots in one query and their open
+    recommendations in one prefetch. Patients without a snapshot yet get one
+    built on the spot.
+
+    Sets the same attributes as load_patient_dashboards, so callers can use
+    either interchangeably.
+    """
+    patients = list(
+        patients
+        .select_related(
+            'user',
+            'snapshot__latest_test',
+            'snapshot__latest_lifestyle',
+            'snapshot__latest_assessment'
+        )
+        .prefetch_related(Prefetch(
+            'recommendations',
+            queryset=Recommendation.objects.filter(completed=False),
+            to_attr='open_recommendations'
+        ))
+    )
+
+    cold = [patient.pk for patient in patients if not hasattr(patient, 'snapshot')]
+    if cold:
+        built = {
+            snapshot.patient_id: snapshot
+            for snapshot in refresh_patient_snapshots(Patient.objects.filter(pk__in=cold))
+        }
+        for patient in patients:
+            if patient.pk in built:
+                patient.snapshot = built[patient.pk]
+
+    for patient in patients:
+        patient.latest_test = patient.snapshot.latest_test
+        patient.latest_lifestyle = patient.snapshot.latest_lifestyle
+        patient.latest_assessment = patient.snapshot.latest_assessment
+
+    return patients
@@ -0,0 +1,185 @@
+import logging
+import random
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from . import metrics
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+TaskSpec = namedtuple('TaskSpec', ['func', 'max_attempts'])
+
+# task name -> TaskSpec
+TASKS = {}
+
+
+def task(name=None, max_attempts=None):
+    """Register a function as a task; its keyword arguments must be JSON-serializable"""
+    def register(func):
+        TASKS[name or func.__name__] = TaskSpec(func, max_attempts)
+        return func
+    return register
+
+
+def enqueue(name, **kwargs):
+    """
+    Queue task `name`. The row is written in the caller's transaction, so
+    workers see the task once the write that needs it commits, and never if
+    it rolls back.
+    """
+    return new_task(name, kwargs)
+
+
+def new_task(name, kwargs, **fields):
+    spec = TASKS.get(name)
+    if spec is None:
+        raise ValueError(f'Unknown task: {name}')
+    return Task.objects.create(
+        name=name,
+        kwargs=kwargs,
+        max_attempts=spec.max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 5),
+        **fields
+    )
+
+
+def schedule(name, key, delay, max_delay=None, **kwargs):
+    """
+    Queue task `name` to run `delay` seconds from now, coalesced under `key`.
+    A trigger arriving while a task with the same key is still queued
+    pushes that task back by `delay` instead (no later than `max_delay`
+    after it was first queued) and replaces its arguments, so a burst of
+    triggers runs the task once, with the latest ones. Like enqueue, it
+    writes in the caller's transaction.
+    """
+    run_at = timezone.now() + timedelta(seconds=delay)
+    # Joins the caller's transaction, if any, without a savepoint of its own
+    with transaction.atomic(savepoint=False):
+        pending = Task.objects.select_for_update().filter(dedupe_key=key, status=Task.QUEUED).first()
+        if pending is None:
+            try:
+                with transaction.atomic():
+                    return new_task(name, kwargs, dedupe_key=key, run_at=run_at)
+            except IntegrityError:
+                # A concurrent trigger queued it first
+                pending = Task.objects.select_for_update().get(dedupe_key=key, status=Task.QUEUED)
+
+        if max_delay is not None:
+            run_at = min(run_at, pending.created_at + timedelta(seconds=max_delay))
+        # Never earlier than planned, e.g. when it is backing off after a failure
+        pending.run_at = max(run_at, pending.run_at)
+        pending.kwargs = kwargs
+        pending.coalesced += 1
+        Task.objects.filter(pk=pending.pk).update(
+            run_at=pending.run_at, kwargs=kwargs, coalesced=F('coalesced') + 1
+        )
+    transaction.on_commit(lambda: metrics.increment('tasks_coalesced_total', task=name))
+    return pending
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, so failed tasks don't retry in lockstep"""
+    base = getattr(settings, 'TASK_RETRY_DELAY', 5)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'TASK_RETRY_MAX_DELAY', 3600))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def claim(worker, limit):
+    """Lock up to `limit` due tasks for `worker`"""
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status=Task.QUEUED, run_at__lte=now)
+            .order_by('run_at', 'id')[:limit]
+        )
+        if tasks:
+            Task.objects.filter(pk__in=[task.pk for task in tasks]).update(
+                status=Task.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1
+            )
+    for task in tasks:
+        task.status, task.locked_by, task.locked_at = Task.RUNNING, worker, now
+        task.attempts += 1
+    return tasks
+
+
+def supersede(running):
+    """
+    Close the running tasks whose key has been queued again since: the
+    queued one runs with newer arguments, and only one may be queued per key
+    """
+    queued = Task.objects.filter(dedupe_key=OuterRef('dedupe_key'), status=Task.QUEUED)
+    return running.filter(Exists(queued)).update(
+        status=Task.DONE, finished_at=timezone.now(), locked_by='', locked_at=None,
+        last_error='Superseded by a later trigger'
+    )
+
+
+def release(tasks):
+    """Hand claimed tasks that never ran back to the queue"""
+    if tasks:
+        claimed = Task.objects.filter(pk__in=[task.pk for task in tasks], status=Task.RUNNING)
+        supersede(claimed)
+        claimed.update(status=Task.QUEUED, locked_by='', locked_at=None, attempts=F('attempts') - 1)
+
+
+def release_stale():
+    """
+    Requeue tasks whose worker died mid-run, or give up on them once they
+    used all their attempts (e.g. a task that keeps killing its worker)
+    """
+    timeout = timedelta(seconds=getattr(settings, 'TASK_LOCK_TIMEOUT', 600))
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=timezone.now() - timeout)
+    dead = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.DEAD, finished_at=timezone.now(), last_error='Worker stopped while running the task'
+    )
+    supersede(stale)
+    requeued = stale.update(status=Task.QUEUED, locked_by='', locked_at=None)
+    return requeued, dead
+
+
+def run_task(task):
+    """
+    Run a claimed task in a transaction of its own; returns 'done', 'retry',
+    'dead' or, for a failed keyed task already queued again, 'superseded'
+    """
+    spec = TASKS.get(task.name)
+    try:
+        if spec is None:
+            raise LookupError(f'Unknown task: {task.name}')
+        with transaction.atomic():
+            spec.func(**task.kwargs)
+    except Exception as e:
+        now = timezone.now()
+        if task.attempts >= task.max_attempts:
+            outcome, changes = 'dead', {'status': Task.DEAD, 'finished_at': now}
+        else:
+            outcome, changes = 'retry', {'status': Task.QUEUED, 'run_at': now + retry_delay(task.attempts)}
+        logger.error(f"Task {task.name} #{task.pk} failed (attempt {task.attempts}, {outcome}): {str(e)}")
+        try:
+            with transaction.atomic():
+                Task.objects.filter(pk=task.pk).update(
+                    locked_by='', locked_at=None, last_error=traceback.format_exc(), **changes
+                )
+        except IntegrityError:
+            # Its key was queued again meanwhile; that run retries it
+            supersede(Task.objects.filter(pk=task.pk))
+            outcome = 'superseded'
+    else:
+        outcome = 'done'
+        Task.objects.filter(pk=task.pk).update(
+            status=Task.DONE, finished_at=timezone.now(), locked_by='', locked_at=None
+        )
+    metrics.increment('tasks_total', task=task.name, outcome=outcome)
+    return outcome
+
+
+def run_pending(worker='inline', limit=100):
+    """Run the tasks due now, once each, in this process. Returns their outcomes."""
+    return [run_task(task) for task in claim(worker, limit)]
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.mail import send_mail
+
+from . import assessments
+from .taskqueue import task
+
+
+@task()
+def send_email(subject, message, recipient_list):
+    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list, fail_silently=False)
+
+
+@task()
+def recompute_assessment(patient_id):
+    patient = assessments.lock_patient(patient_id)
+    if patient is not None:  # Deleted since
+        assessments.recompute_assessment(patient)
+
+
+@task()
+def refresh_recommendations(patient_id):
+    # Queued by submissions before recomputes were coalesced; a full
+    # recompute also brings the recommendations in line
+    recompute_assessment(patient_id)
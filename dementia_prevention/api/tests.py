@@ -1,3 +1,1855 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import tracemalloc
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models.functions import TruncDate
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import (
+    LIFESTYLE_FACTORS,
+    BrainHealthAssessment,
+    Caregiver,
+    ChangeLogEntry,
+    CognitiveTestQuestion,
+    CognitiveTestResult,
+    IdempotentRequest,
+    LifestyleData,
+    LifestyleRollup,
+    LifestyleStats,
+    Patient,
+    PatientSnapshot,
+    Recommendation,
+    ScoringRule,
+    Task
+)
+from . import metrics, profiling, rescoring, views
+from .admin import TaskAdmin
+from .assessments import recompute_assessment
+from .authentication import CachedTokenAuthentication, local_tokens
+from .benchmarks import POPULATION_PASSWORD, SCENARIOS, Population, Scenario, find_regressions, percentile, uncovered_endpoints
+from .changes import latest_token, read_changes, record_changes
+from .claims import claims_cookie, issue_claims, read_claims
+from .management.commands.generate_population import explicit_dates
+from .pagination import encode_cursor
+from .payloads import PrecomputedPayload
+from .reconcile import reconcile_recommendations
+from .rescoring import pending_ranges
+from .question_bank import QUESTION_BANK, get_question_bank
+from .roles import resolve_role
+from .rules import SCORING_RULES, CompiledRules, get_scoring_rules
+from .scoring import RUBRICS, CompiledAnswerKey, ScoreResult, as_number, compile_matcher, rubric
+from .rollups import aggregate_windows, get_lifestyle_stats, rebuild_lifestyle_rollups, refresh_lifestyle_stats
+from .snapshots import refresh_patient_snapshot, refresh_patient_snapshots
+from .taskqueue import TASKS, claim, enqueue, release_stale, run_pending, run_task, schedule, task
+from .urls import urlpatterns
+
+# Tables whose per-patient history grows without bound
+HOT_TABLES = {
+    'api_lifestyledata',
+    'api_cognitivetestresult',
+    'api_brainhealthassessment',
+    'api_recommendation',
+}
+
+# Table names in SQLite plans are either real names or Django's U0, U1... aliases
+SQLITE_SCAN = re.compile(r'^SCAN (\S+)')
+# Sorting every matched row instead of reading them in index order
+SQLITE_FULL_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+POSTGRES_SEQ_SCAN = re.compile(r'Seq Scan on (\S+)')
+
+
+def seed_population(patients=30, days=120, tests=20, assessments=10, recommendations=6, caregiven=10):
+    """
+    Bulk-create `patients` patients, each with a long history, and a
+    caregiver connected to the first `caregiven` of them
+    """
+    caregiver = Caregiver.objects.create(user=User.objects.create(username='caregiver'))
+    created = []
+    start = date(2020, 1, 1)
+    for i in range(patients):
+        patient = Patient.objects.create(user=User.objects.create(username=f'patient{i}'))
+        created.append(patient)
+        LifestyleData.objects.bulk_create(
+            LifestyleData(user=patient.user, date=start + timedelta(days=day), physical_activity=day % 7)
+            for day in range(days)
+        )
+        CognitiveTestResult.objects.bulk_create(
+            CognitiveTestResult(patient=patient, score=n % 50, total_questions=50, correct_answers=n, details=[])
+            for n in range(tests)
+        )
+        # One assessment per day
+        with explicit_dates(BrainHealthAssessment._meta.get_field('date')):
+            BrainHealthAssessment.objects.bulk_create(
+                BrainHealthAssessment(patient=patient, score=50, cognitive_score=5, date=start + timedelta(days=n))
+                for n in range(assessments)
+            )
+        Recommendation.objects.bulk_create(
+            Recommendation(
+                patient=patient, category='sleep', title=f'Recommendation {n}',
+                description='', priority='medium', completed=n % 2 == 0
+            )
+            for n in range(recommendations)
+        )
+    caregiver.patients.set(created[:caregiven])
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return caregiver, created
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def pages(self, path, key, page_size=3):
+        rows, params = [], {'page_size': page_size}
+        while True:
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.data[key])
+            if not response.data['next_cursor']:
+                return rows
+            params['cursor'] = response.data['next_cursor']
+
+    def test_rows_within_the_same_millisecond_are_not_skipped(self):
+        # bulk_create stamps every row within a millisecond or two
+        Recommendation.objects.bulk_create(
+            Recommendation(patient=self.patient, category='sleep', title=f'Rec {n}', description='', priority='low')
+            for n in range(10)
+        )
+        rows = self.pages('/api/recommendations/', 'results')
+        self.assertEqual(
+            [row['id'] for row in rows],
+            list(Recommendation.objects.order_by('-priority', '-date_created', '-id').values_list('id', flat=True))
+        )
+
+    def test_recommendations_keep_legacy_string_order(self):
+        # Priorities sort as strings, not by rank, as the list always has
+        for priority in ('high', 'low', 'medium'):
+            Recommendation.objects.create(
+                patient=self.patient, category='sleep', title=priority, description='', priority=priority
+            )
+        rows = self.pages('/api/recommendations/', 'results', page_size=2)
+        self.assertEqual([row['priority'] for row in rows], ['medium', 'low', 'high'])
+
+    def test_history_pages_cover_every_row_once(self):
+        CognitiveTestResult.objects.bulk_create(
+            CognitiveTestResult(patient=self.patient, score=n, total_questions=50, correct_answers=n, details=[])
+            for n in range(8)
+        )
+        rows = self.pages('/api/cognitive-tests/history/', 'tests')
+        self.assertEqual(sorted(row['score'] for row in rows), list(range(8)))
+        self.assertEqual(len({row['id'] for row in rows}), 8)
+
+    def test_invalid_cursor_rejected(self):
+        for cursor in ('not-a-cursor', encode_cursor(['2026-01-01'])):
+            response = self.client.get('/api/recommendations/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Sends the hot read requests to the views against a seeded dataset and
+    fails when a query they ran on one of the history tables is planned as a
+    full/sequential scan, or (on SQLite) sorts the rows it found instead of
+    reading an index in order.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caregiver, cls.patients = seed_population()
+        cls.patient = cls.patients[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return [row[3] for row in cursor.fetchall()]
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        scans = []
+        for line in plan:
+            if line == SQLITE_FULL_SORT:
+                scans.append(line)
+                continue
+            match = SQLITE_SCAN.match(line) or POSTGRES_SEQ_SCAN.search(line)
+            if match:
+                table = match.group(1).strip('"')
+                # Aliases (U0, U1, ...) only appear in subqueries on the related tables
+                if table in HOT_TABLES or not table.startswith(('api_', 'auth_', 'django_')):
+                    scans.append(line)
+        return scans
+
+    def assertIndexedPlans(self, *requests, user=None):
+        """
+        Send `requests` ((method, path, params) triples) as `user` (default:
+        the patient) and EXPLAIN every query they ran on a hot table
+        """
+        self.client.force_authenticate(user or self.patient.user)
+        with CaptureQueriesContext(connection) as queries:
+            for method, path, params in requests:
+                response = getattr(self.client, method)(path, params)
+                self.assertEqual(response.status_code, 200, f'{method.upper()} {path}')
+                if response.streaming:
+                    b''.join(response.streaming_content)
+        self.assertIndexedQueries(queries)
+
+    def assertIndexedQueries(self, queries):
+        checked = 0
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            if not any(table in sql for table in HOT_TABLES):
+                continue
+            checked += 1
+            plan = self.explain(sql)
+            self.assertEqual(
+                self.full_scans(plan), [],
+                f'Hot query is not using an index:\n{sql}\n' + '\n'.join(plan)
+            )
+        self.assertGreater(checked, 0, 'No query on a hot table was captured')
+
+    def next_page(self, path, params):
+        return {**params, 'cursor': self.client.get(path, params).data['next_cursor']}
+
+    def test_lifestyle_history_pages(self):
+        first = {'page_size': 20}
+        self.assertIndexedPlans(
+            ('get', '/api/lifestyle-data/', first),
+            ('get', '/api/lifestyle-data/', self.next_page('/api/lifestyle-data/', first))
+        )
+
+    def test_lifestyle_stats(self):
+        self.assertIndexedPlans(('get', '/api/lifestyle-stats/', {'period': '90d'}))
+
+    def test_lifestyle_trends_fallback(self):
+        self.assertIndexedPlans(('get', '/api/lifestyle-trends/', {'group_by': 'month'}))
+
+    def test_lifestyle_export(self):
+        self.assertIndexedPlans(('get', '/api/export/lifestyle/', {}))
+
+    def test_test_history_pages(self):
+        first = {'page_size': 5}
+        self.assertIndexedPlans(
+            ('get', '/api/cognitive-tests/history/', first),
+            ('get', '/api/cognitive-tests/history/', self.next_page('/api/cognitive-tests/history/', first))
+        )
+
+    def test_assessment_history_pages(self):
+        first = {'page_size': 5}
+        self.assertIndexedPlans(
+            ('get', '/api/brain-health/', first),
+            ('get', '/api/brain-health/', self.next_page('/api/brain-health/', first))
+        )
+
+    def test_recommendations(self):
+        first = {'page_size': 2}
+        self.assertIndexedPlans(
+            ('get', '/api/recommendations/', first),
+            ('get', '/api/recommendations/', self.next_page('/api/recommendations/', first))
+        )
+
+    def test_patient_dashboard(self):
+        self.assertIndexedPlans(('get', '/api/dashboard/', {}))
+
+    def test_caregiver_dashboard(self):
+        self.assertIndexedPlans(('post', '/api/caregiver-dashboard/', {}), user=self.caregiver.user)
+
+    def test_snapshot_refresh(self):
+        with CaptureQueriesContext(connection) as queries:
+            refresh_patient_snapshot(self.patient)
+        self.assertIndexedQueries(queries)
+
+
+class MetricsTests(TestCase):
+    """Per-endpoint metrics recorded by MetricsMiddleware and served on metrics/"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(METRICS_DIR=directory.name, METRICS_ALLOWED_IPS=['127.0.0.1'])
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        metrics.registry._reset()
+
+        self.user = User.objects.create_user(username='patient', password='secret')
+        Patient.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def scrape(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_records_request_metrics_per_url_name(self):
+        self.client.get('/api/lifestyle-stats/')
+        self.client.get('/api/lifestyle-stats/')
+        body = self.scrape()
+
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'http_requests_total\{method="GET",status="\d+",view="lifestyle_stats"\} 2\n')
+        self.assertIn('http_request_duration_seconds_bucket{view="lifestyle_stats",le="+Inf"} 2\n', body)
+        self.assertIn('http_request_duration_seconds_count{view="lifestyle_stats"} 2\n', body)
+        self.assertRegex(body, r'db_queries_total\{view="lifestyle_stats"\} [1-9]')
+        self.assertRegex(body, r'http_response_bytes_total\{view="lifestyle_stats"\} [1-9]')
+
+    def test_streaming_responses_recorded_when_sent(self):
+        LifestyleData.objects.create(user=self.user, date=date(2024, 1, 1), physical_activity=3)
+        response = self.client.get('/api/export/lifestyle/')
+        sent = len(b''.join(response.streaming_content))
+        body = self.scrape()
+
+        self.assertIn(f'http_response_bytes_total{{view="export_history"}} {sent}\n', body)
+        self.assertRegex(body, r'db_queries_total\{view="export_history"\} [1-9]')
+
+    def test_totals_merged_across_workers(self):
+        self.client.get('/api/lifestyle-stats/')
+        other_worker = metrics.MetricsRegistry()
+        other_worker.increment('http_requests_total', 3, view='lifestyle_stats', method='GET', status=200)
+        other_worker.flush(force=True)
+
+        self.assertIn('http_requests_total{method="GET",status="200",view="lifestyle_stats"} 4\n', self.scrape())
+
+    def test_concurrent_flushes(self):
+        worker = metrics.MetricsRegistry()
+        worker.increment('tasks_total', task='send_email', outcome='done')
+        errors = []
+
+        def flush():
+            try:
+                for _ in range(50):
+                    worker.flush(force=True)
+            except OSError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=flush) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertIn('tasks_total{outcome="done",task="send_email"} 1\n', self.scrape())
+
+    def test_forbidden_outside_allowed_ips_for_non_staff(self):
+        with self.settings(METRICS_ALLOWED_IPS=[]):
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+            self.user.is_staff = True
+            self.user.save()
+            self.client.force_login(self.user)
+            self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+
+class ProfilingTests(TestCase):
+    """On-demand profiles of single requests, for staff only"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(PROFILE_DIR=directory.name, PROFILE_REQUESTS=True)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.staff = User.objects.create_user(username='staff', is_staff=True)
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.staff).key}')
+
+    def test_staff_request_profiled_with_query_flag(self):
+        response = self.client.get('/api/check-auth/', {'profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        profile_id = response['X-Profile-Id']
+
+        cpu = self.client.get(f'/api/profiles/{profile_id}/')
+        self.assertEqual(cpu.status_code, 200)
+        self.assertIn('attachment', cpu['Content-Disposition'])
+        for line in b''.join(cpu.streaming_content).decode().splitlines():
+            self.assertRegex(line, r'^\S.* \d+$')
+
+        memory = self.client.get(f'/api/profiles/{profile_id}/', {'kind': 'memory'})
+        self.assertIn(b'KiB allocated', b''.join(memory.streaming_content))
+
+    def test_staff_request_profiled_with_header(self):
+        response = self.client.get('/api/check-auth/', HTTP_X_PROFILE='1')
+        self.assertIn('X-Profile-Id', response)
+
+    def test_not_profiled_without_flag_or_for_non_staff(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/check-auth/'))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.patient.user).key}')
+        response = self.client.get('/api/check-auth/', {'profile': '1'})
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get(f'/api/profiles/{"0" * 32}/').status_code, 403)
+
+    def test_unknown_profile(self):
+        self.assertEqual(self.client.get(f'/api/profiles/{"0" * 32}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/profiles/not-a-profile/').status_code, 400)
+
+    def test_off_unless_enabled_for_the_worker(self):
+        with self.settings(PROFILE_REQUESTS=False):
+            self.assertNotIn('X-Profile-Id', self.client.get('/api/check-auth/', {'profile': '1'}))
+
+    def test_process_state_restored(self):
+        switch_interval = sys.getswitchinterval()
+        was_tracing = tracemalloc.is_tracing()
+
+        def fail():
+            self.assertTrue(tracemalloc.is_tracing())
+            self.assertLessEqual(sys.getswitchinterval(), settings.PROFILE_SAMPLE_INTERVAL)
+            raise RuntimeError('view failed')
+
+        with self.assertRaises(RuntimeError):
+            profiling.profile_call(fail, 'GET /failing/')
+        self.assertEqual(sys.getswitchinterval(), switch_interval)
+        self.assertEqual(tracemalloc.is_tracing(), was_tracing)
+
+    def test_one_profile_at_a_time(self):
+        with profiling._profile_lock:
+            self.assertEqual(profiling.profile_call(lambda: 'done', 'GET /'), ('done', None))
+            response = self.client.get('/api/check-auth/', {'profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertIn('X-Profile-Id', self.client.get('/api/check-auth/', {'profile': '1'}))
+
+
+class PopulationBenchmarkTests(TransactionTestCase):
+    """generate_population and the benchmark harness, end to end on a tiny population"""
+
+    # Keep the question bank seeded by the migrations for the tests that follow
+    serialized_rollback = True
+
+    def test_every_endpoint_has_a_scenario(self):
+        self.assertEqual(uncovered_endpoints(), [])
+
+    def test_generate_and_benchmark(self):
+        call_command(
+            'generate_population', patients=4, caregivers=2, days=60, patients_per_caregiver=3,
+            chunk_size=3, stdout=StringIO()
+        )
+        patients = Patient.objects.filter(user__username__startswith='synthetic-patient-')
+        self.assertEqual(patients.count(), 4)
+        self.assertGreater(LifestyleData.objects.count(), 4 * 30)
+        self.assertGreater(CognitiveTestResult.objects.count(), 0)
+        self.assertEqual(PatientSnapshot.objects.count(), 4)
+        self.assertEqual(LifestyleStats.objects.count(), 4)
+        self.assertTrue(LifestyleRollup.objects.filter(period='week').exists())
+        self.assertEqual(Caregiver.patients.through.objects.count(), 6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'baseline.json')
+            call_command(
+                'benchmark', requests=6, concurrency=2, output=output,
+                endpoints=['lifestyle_stats', 'cognitive_test_questions'], stdout=StringIO()
+            )
+            with open(output) as f:
+                results = json.load(f)
+
+        stats = results['endpoints']['lifestyle_stats']
+        self.assertEqual(stats['requests'], 6)
+        self.assertEqual(stats['errors'], 0)
+        self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+        self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+        self.assertIsNotNone(stats['queries_per_request'])
+
+        # Deleting the population cascades without writing change-log rows for it
+        call_command('generate_population', patients=1, caregivers=1, days=5, clear=True, stdout=StringIO())
+        self.assertFalse(ChangeLogEntry.objects.filter(user__username__startswith='synthetic-patient-1').exists())
+        self.assertEqual(Patient.objects.count(), 1)
+
+    def test_short_test_interval(self):
+        # Tests a day or so apart land on the same day, which has room for one assessment
+        call_command(
+            'generate_population', patients=3, caregivers=1, days=60, test_interval=1,
+            patients_per_caregiver=1, stdout=StringIO()
+        )
+        days_tested = CognitiveTestResult.objects.annotate(day=TruncDate('date_taken')).values('patient', 'day')
+        self.assertGreater(CognitiveTestResult.objects.count(), days_tested.distinct().count())
+        self.assertEqual(BrainHealthAssessment.objects.count(), days_tested.distinct().count())
+
+
+class ExplicitDatesTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.field = BrainHealthAssessment._meta.get_field('date')
+
+    def test_back_dated_rows_kept(self):
+        with explicit_dates(self.field):
+            BrainHealthAssessment.objects.bulk_create([
+                BrainHealthAssessment(patient=self.patient, score=50, cognitive_score=5, date=date(2020, 1, 1))
+            ])
+        self.assertEqual(BrainHealthAssessment.objects.get().date, date(2020, 1, 1))
+        self.assertTrue(self.field.auto_now_add)
+
+        BrainHealthAssessment.objects.create(patient=self.patient, score=50, cognitive_score=5, date=date(2020, 1, 2))
+        self.assertTrue(BrainHealthAssessment.objects.filter(date=timezone.localdate()).exists())
+
+    def test_flags_restored_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with explicit_dates(self.field):
+                with explicit_dates(self.field):
+                    raise RuntimeError
+        self.assertTrue(self.field.auto_now_add)
+
+
+class BenchmarkReportTests(TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+    def test_regressions_flagged_against_baseline(self):
+        def run(p95, throughput, queries):
+            return {'endpoints': {'lifestyle_stats': {
+                'p95_ms': p95, 'throughput_rps': throughput, 'queries_per_request': queries, 'errors': 0
+            }}}
+
+        baseline = run(20.0, 100.0, 2.0)
+        self.assertEqual(find_regressions(run(22.0, 95.0, 2.0), baseline, tolerance=0.25), [])
+        # Within the tolerance in relative terms but too small to matter
+        self.assertEqual(find_regressions(run(0.9, 100.0, 2.0), run(0.5, 100.0, 2.0), tolerance=0.25), [])
+
+        regressions = find_regressions(run(40.0, 50.0, 12.0), baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(regression.startswith('lifestyle_stats:') for regression in regressions))
+
+
+# Related rows per user the query budgets are checked with
+BUDGET_SIZES = (1, 10, 100)
+
+
+@lru_cache(maxsize=None)
+def population_password():
+    # Hashed once: the budget population is seeded for every view and size
+    return make_password(POPULATION_PASSWORD)
+
+
+def seed_budget_population(rows):
+    """
+    A patient with `rows` rows of every kind of history and a caregiver
+    connected to `rows` patients, as a Population of the benchmark harness
+    """
+    today = date.today()
+    patient = Patient.objects.create(user=User.objects.create(
+        username='budget-patient-0', email='budget-patient-0@example.com', password=population_password()
+    ))
+    caregiver = Caregiver.objects.create(user=User.objects.create(
+        username='budget-caregiver-0', password=population_password()
+    ))
+    for user in (patient.user, caregiver.user):
+        Token.objects.create(user=user)
+
+    LifestyleData.objects.bulk_create(
+        LifestyleData(user=patient.user, date=today - timedelta(days=day), physical_activity=day % 7)
+        for day in range(rows)
+    )
+    CognitiveTestResult.objects.bulk_create(
+        CognitiveTestResult(patient=patient, score=30, total_questions=50, correct_answers=30, details=[])
+        for n in range(rows)
+    )
+    # One assessment per day, as the views write them
+    with explicit_dates(BrainHealthAssessment._meta.get_field('date')):
+        BrainHealthAssessment.objects.bulk_create(
+            BrainHealthAssessment(patient=patient, score=50, cognitive_score=5, date=today - timedelta(days=day))
+            for day in range(rows)
+        )
+    # Completed recommendations pile up, open ones are replaced on every recompute
+    Recommendation.objects.bulk_create(
+        Recommendation(
+            patient=patient, category='sleep', title=f'Recommendation {n}', description='', priority='low',
+            completed=n > 0
+        )
+        for n in range(rows)
+    )
+    others = [
+        Patient.objects.create(user=User.objects.create_user(username=f'budget-other-{n}'))
+        for n in range(rows)
+    ]
+    for other in others:
+        Recommendation.objects.create(patient=other, category='sleep', title='Open', description='', priority='low')
+        CognitiveTestResult.objects.create(patient=other, score=10, total_questions=50, correct_answers=10, details=[])
+    caregiver.patients.set(others)
+    # The feed a client syncing from scratch reads
+    record_changes(LifestyleData, patient.user_id, LifestyleData.objects.filter(user=patient.user).values_list('id', flat=True))
+    for model in (CognitiveTestResult, BrainHealthAssessment, Recommendation):
+        record_changes(model, patient.user_id, model.objects.filter(patient=patient).values_list('id', flat=True))
+
+    # Warm state, as after the first request of a running worker. Content
+    # versions are re-read from the database once their cache entry expires.
+    cache.delete_many([f'content-version:{name}' for name in (QUESTION_BANK, SCORING_RULES)])
+    refresh_lifestyle_stats(patient.user_id)
+    rebuild_lifestyle_rollups([patient.user_id])
+    refresh_patient_snapshots(Patient.objects.all())
+    get_question_bank()
+    get_scoring_rules()
+    return Population('budget', 1, random.Random(0))
+
+
+def stored_profile(user, population):
+    """Id of a profile stored in PROFILE_DIR"""
+    profile_id = uuid.uuid4().hex
+    path = profiling.profile_path(profile_id, 'cpu')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('view (api/views.py:1) 1\n')
+    return {'profile_id': profile_id}
+
+
+# Budgeted views the benchmark skips, replayed as a caregiver made staff
+STAFF_SCENARIOS = {
+    'download_profile': Scenario('GET', 'caregiver', kwargs=stored_profile),
+}
+
+
+# The metrics scenario is sent from the test client's address
+@override_settings(CONTENT_VERSION_TTL=3600, METRICS_ALLOWED_IPS=['127.0.0.1'])
+class QueryBudgetTests(TestCase):
+    """
+    Every view declares a query budget next to its definition with
+    @query_budget. Each request must stay within it and run the same number
+    of queries whatever the amount of related data.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(PROFILE_DIR=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def budgeted_views(self):
+        return [
+            (pattern.name, pattern.callback.query_budget)
+            for pattern in urlpatterns
+            if hasattr(pattern.callback, 'query_budget')
+        ]
+
+    def test_every_budgeted_view_has_a_request(self):
+        self.assertEqual(
+            [name for name, budget in self.budgeted_views() if name not in SCENARIOS and name not in STAFF_SCENARIOS],
+            []
+        )
+
+    def count_queries(self, name, rows):
+        scenario = SCENARIOS.get(name) or STAFF_SCENARIOS[name]
+        with transaction.atomic():
+            population = seed_budget_population(rows)
+            user = population.user(scenario.role)
+            if name in STAFF_SCENARIOS:
+                User.objects.filter(username=user.username).update(is_staff=True)
+            client = APIClient()
+            if user and scenario.authenticate:
+                client.credentials(HTTP_AUTHORIZATION=f'Token {user.token}')
+                # Steady state for API clients: their token is already cached
+                CachedTokenAuthentication().authenticate_credentials(user.token)
+            if user and scenario.session:
+                client.login(username=user.username, password=POPULATION_PASSWORD)
+            kwargs = scenario.kwargs(user, population) if scenario.kwargs else {}
+            data = scenario.data(user, population) if scenario.data else None
+            path = reverse(name, kwargs=kwargs)
+
+            with CaptureQueriesContext(connection) as queries:
+                if scenario.method == 'GET':
+                    response = client.get(path, data)
+                else:
+                    response = client.generic(
+                        scenario.method, path, json.dumps(data or {}), content_type='application/json'
+                    )
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        # A budget measured on a rejected request says nothing about the view
+        self.assertLess(response.status_code, 300, f'{name} with {rows} rows: {response.status_code}')
+        return len(queries), queries
+
+    def test_every_view_declares_a_budget(self):
+        missing = [
+            pattern.name for pattern in urlpatterns
+            if pattern.callback.__module__ == views.__name__ and not hasattr(pattern.callback, 'query_budget')
+        ]
+        self.assertEqual(missing, [])
+
+    def test_views_within_budget_at_any_size(self):
+        for name, budget in self.budgeted_views():
+            with self.subTest(view=name):
+                counts = {}
+                for rows in BUDGET_SIZES:
+                    counts[rows], queries = self.count_queries(name, rows)
+                    self.assertLessEqual(
+                        counts[rows], budget,
+                        f'{name} ran {counts[rows]} queries with {rows} rows, budget is {budget}:\n'
+                        + '\n'.join(query['sql'] for query in queries)
+                    )
+                self.assertEqual(
+                    len(set(counts.values())), 1,
+                    f'{name} query count grows with the data: {counts}'
+                )
+
+
+class PatientSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.patients = [
+            Patient.objects.create(user=User.objects.create_user(username=f'patient-{n}')) for n in range(3)
+        ]
+        for patient in self.patients:
+            CognitiveTestResult.objects.create(
+                patient=patient, score=30, total_questions=50, correct_answers=30, details=[]
+            )
+
+    def test_rebuild_replaces_snapshots_in_place(self):
+        refresh_patient_snapshots(Patient.objects.all())
+        ids = set(PatientSnapshot.objects.values_list('pk', flat=True))
+        PatientSnapshot.objects.update(latest_cognitive_score=None)
+
+        out = StringIO()
+        call_command('rebuild_patient_snapshots', chunk_size=2, stdout=out)
+        self.assertIn('Rebuilt 3 patient snapshots', out.getvalue())
+        self.assertEqual(set(PatientSnapshot.objects.values_list('pk', flat=True)), ids)
+        self.assertEqual(set(PatientSnapshot.objects.values_list('latest_cognitive_score', flat=True)), {30})
+
+    def test_concurrent_builds_upsert(self):
+        # A dashboard read that found no snapshot builds one after the rebuild wrote it
+        refresh_patient_snapshots(Patient.objects.all())
+        refresh_patient_snapshots(Patient.objects.filter(pk=self.patients[0].pk))
+        self.assertEqual(PatientSnapshot.objects.count(), 3)
+        self.assertEqual(PatientSnapshot.objects.get(patient=self.patients[0]).latest_cognitive_score, 30)
+
+
+class RoleResolutionTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.caregiver = Caregiver.objects.create(user=User.objects.create_user(username='caregiver'))
+
+    def test_role_loaded_in_one_query(self):
+        user = User.objects.get(pk=self.patient.user_id)
+        with self.assertNumQueries(1):
+            role = resolve_role(user)
+            self.assertTrue(role.is_patient)
+            self.assertFalse(role.is_caregiver)
+            self.assertEqual(role.patient.user_id, user.pk)
+
+    def test_no_query_when_profiles_already_loaded(self):
+        user = User.objects.select_related('patient_profile', 'caregiver_profile').get(pk=self.caregiver.user_id)
+        with self.assertNumQueries(0):
+            role = resolve_role(user)
+        self.assertEqual(role.caregiver, self.caregiver)
+        self.assertIsNone(role.patient)
+
+    def test_request_role_shared_by_view(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.caregiver.user).key}')
+        # The token lookup loads the profiles along with the user
+        with self.assertNumQueries(1):
+            response = client.get('/api/check-auth/')
+        self.assertTrue(response.data['is_caregiver'])
+        self.assertFalse(response.data['is_patient'])
+
+
+class CachedTokenAuthenticationTests(TestCase):
+
+    def setUp(self):
+        local_tokens.clear()
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient', password='secret'))
+        self.token = Token.objects.create(user=self.patient.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def check_auth(self):
+        return self.client.get('/api/check-auth/')
+
+    def test_cached_token_costs_no_queries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.check_auth().status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.check_auth()
+        self.assertTrue(response.data['is_patient'])
+
+    def test_shared_cache_refills_local_lru(self):
+        self.check_auth()
+        local_tokens.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.check_auth().status_code, 200)
+
+    def test_requests_get_their_own_user(self):
+        auth = CachedTokenAuthentication()
+        first, _ = auth.authenticate_credentials(self.token.key)
+        first.first_name = 'changed'
+        second, _ = auth.authenticate_credentials(self.token.key)
+        self.assertEqual(second.first_name, '')
+        self.assertIsNot(first, second)
+
+    def test_deleted_token_rejected(self):
+        self.check_auth()
+        self.token.delete()
+        self.assertEqual(self.check_auth().status_code, 403)
+
+    def test_deactivated_user_rejected(self):
+        self.check_auth()
+        self.patient.user.is_active = False
+        self.patient.user.save()
+        self.assertEqual(self.check_auth().status_code, 403)
+
+    def test_password_change_reloads_user(self):
+        self.check_auth()
+        self.patient.user.set_password('changed')
+        self.patient.user.save()
+        with self.assertNumQueries(1):
+            self.check_auth()
+        user, _ = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertTrue(user.check_password('changed'))
+
+    def test_new_profile_changes_cached_role(self):
+        self.check_auth()
+        Caregiver.objects.create(user=self.patient.user)
+        self.assertTrue(self.check_auth().data['is_caregiver'])
+
+    def test_per_process_cache_keeps_tokens_for_the_local_ttl(self):
+        for shared, ttl in ((False, 10), (True, 300)):
+            with self.subTest(shared=shared), override_settings(SHARED_CACHE=shared):
+                with mock.patch('api.authentication.cache.set_many') as set_many:
+                    CachedTokenAuthentication().authenticate_credentials(self.token.key)
+                    local_tokens.clear()
+                self.assertEqual(set_many.call_args.args[1], ttl)
+
+
+@override_settings(SHARED_CACHE=True)
+class ClaimsAuthenticationTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient', password='secret'))
+        self.client.force_login(self.patient.user)
+
+    def check_auth(self):
+        return self.client.get('/api/check-auth/')
+
+    def test_check_auth_answered_from_claims(self):
+        response = self.check_auth()
+        self.assertIn(claims_cookie(), response.cookies)
+        with self.assertNumQueries(0):
+            response = self.check_auth()
+        self.assertEqual(response.data['user'], {'id': self.patient.user_id, 'username': 'patient'})
+        self.assertTrue(response.data['is_patient'])
+        self.assertNotIn(claims_cookie(), response.cookies)
+
+    def test_claims_user_loads_other_fields_on_demand(self):
+        self.check_auth()
+        response = self.client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_role_change_revokes_claims(self):
+        self.check_auth()
+        Caregiver.objects.create(user=self.patient.user)
+        response = self.check_auth()
+        self.assertTrue(response.data['is_caregiver'])
+        # Reissued with the new role
+        self.assertIn(claims_cookie(), response.cookies)
+
+    def test_forged_claims_ignored(self):
+        self.check_auth()
+        self.client.cookies[claims_cookie()] = 'forged'
+        self.assertGreater(len(self.capture(self.check_auth)), 0)
+
+    @override_settings(AUTH_CLAIMS_TTL=-1)
+    def test_expired_claims_fall_back_to_session(self):
+        self.check_auth()
+        queries = self.capture(self.check_auth)
+        self.assertGreater(len(queries), 0)
+
+    def test_logout_drops_claims(self):
+        self.check_auth()
+        self.client.post('/api/accounts/logout/')
+        self.assertEqual(self.check_auth().status_code, 403)
+
+    def test_deactivation_drops_claims(self):
+        self.check_auth()
+        self.patient.user.is_active = False
+        self.patient.user.save()
+        self.assertEqual(self.check_auth().status_code, 403)
+
+    def test_claims_of_inactive_users_rejected(self):
+        self.patient.user.is_active = False
+        self.assertIsNone(read_claims(issue_claims(self.patient.user, resolve_role(self.patient.user))))
+
+    def test_no_claims_without_a_shared_cache(self):
+        with override_settings(SHARED_CACHE=False):
+            response = self.check_auth()
+            self.assertNotIn(claims_cookie(), response.cookies)
+            self.client.cookies[claims_cookie()] = issue_claims(self.patient.user, resolve_role(self.patient.user))
+            # Answered from the session instead
+            self.assertGreater(len(self.capture(self.check_auth)), 0)
+
+    def capture(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(request().status_code, 200)
+        return queries
+
+
+@override_settings(RECOMPUTE_DEBOUNCE=0)
+class SubmitCognitiveTestTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        LifestyleData.objects.create(user=self.patient.user, date=date.today(), physical_activity=2, stress=8)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.patient.user).key}')
+        self.answers = [
+            {'question_id': question_id, 'answer': answer}
+            for question_id, answer in get_question_bank().answer_key.items()
+        ]
+
+    def submit(self, key=None, answers=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post('/api/submit_cognitive_test', {'answers': answers or self.answers}, format='json', **headers)
+
+    def test_submission_stores_everything(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CognitiveTestResult.objects.filter(patient=self.patient).count(), 1)
+        self.assertEqual(BrainHealthAssessment.objects.filter(patient=self.patient).count(), 1)
+        # Recommendations are stored by the scheduled recompute
+        self.assertFalse(Recommendation.objects.filter(patient=self.patient).exists())
+        self.assertEqual(run_pending(), ['done'])
+        recommendations = Recommendation.objects.filter(patient=self.patient)
+        self.assertEqual(recommendations.count(), len(response.data['recommendations']))
+        self.assertEqual(
+            ChangeLogEntry.objects.filter(user=self.patient.user, model='recommendation').count(),
+            recommendations.count()
+        )
+
+    def test_result_stamped_with_bank_version(self):
+        self.assertEqual(self.submit().status_code, 200)
+        version = get_question_bank().version
+        self.assertEqual(CognitiveTestResult.objects.get().bank_version, version)
+
+        # The version rolls back with the test, the cached number doesn't
+        self.addCleanup(cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            CognitiveTestQuestion.objects.create(question='2 + 2?', options=['3', '4'], correct_answer='4')
+        self.assertEqual(self.submit().status_code, 200)
+        latest = CognitiveTestResult.objects.latest('pk')
+        self.assertGreater(latest.bank_version, version)
+        self.assertEqual(latest.bank_version, get_question_bank().version)
+
+    def test_retry_with_key_replays_response(self):
+        first = self.submit(key='retry-1')
+        second = self.submit(key='retry-1')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.data, json.loads(json.dumps(first.data)))
+        self.assertEqual(CognitiveTestResult.objects.filter(patient=self.patient).count(), 1)
+        self.assertEqual(IdempotentRequest.objects.count(), 1)
+
+    def test_key_reused_for_other_answers_rejected(self):
+        self.submit(key='retry-1')
+        response = self.submit(key='retry-1', answers=self.answers[:1])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CognitiveTestResult.objects.filter(patient=self.patient).count(), 1)
+
+    def test_failure_midway_leaves_nothing(self):
+        with mock.patch('api.views.refresh_patient_snapshot', side_effect=RuntimeError('boom')):
+            response = self.submit(key='retry-1')
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(CognitiveTestResult.objects.filter(patient=self.patient).exists())
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(IdempotentRequest.objects.exists())
+        # The retry does the work instead of replaying the failure
+        self.assertNotIn('Idempotent-Replayed', self.submit(key='retry-1'))
+
+
+class TaskQueueTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.failures = 0
+
+        @task(name='test_task', max_attempts=3)
+        def test_task(value):
+            self.calls.append(value)
+            if len(self.calls) <= self.failures:
+                raise RuntimeError('flaky')
+
+        self.addCleanup(TASKS.pop, 'test_task')
+
+    def test_task_runs_once(self):
+        enqueue('test_task', value=1)
+        self.assertEqual(run_pending(), ['done'])
+        self.assertEqual(run_pending(), [])
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+
+    def test_failures_back_off_then_go_dead(self):
+        self.failures = 3
+        queued = enqueue('test_task', value=1)
+        self.assertEqual(run_pending(), ['retry'])
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.QUEUED, 1))
+        self.assertIn('flaky', queued.last_error)
+        # Not due until the backoff has passed
+        self.assertEqual(run_pending(), [])
+
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(run_pending(), ['retry'])
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(run_pending(), ['dead'])
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.DEAD, 3))
+        self.assertEqual(run_pending(), [])
+
+    def test_rolled_back_writes_queue_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                enqueue('test_task', value=1)
+                raise RuntimeError('rolled back')
+        self.assertEqual(run_pending(), [])
+
+    def test_stale_tasks_requeued(self):
+        enqueue('test_task', value=1)
+        claim('crashed', 10)
+        self.assertEqual(run_pending(), [])
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(release_stale(), (1, 0))
+        self.assertEqual(run_pending(), ['done'])
+
+    def test_coalesced_triggers_run_once_with_latest_arguments(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for value in range(3):
+                schedule('test_task', key='test', delay=5, value=value)
+        queued = Task.objects.get()
+        self.assertEqual((queued.kwargs, queued.coalesced), ({'value': 2}, 2))
+        self.assertEqual(metrics.registry.snapshot()[('tasks_coalesced_total', (('task', 'test_task'),))], 2)
+        # Debounced until the triggers stop
+        self.assertEqual(run_pending(), [])
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(run_pending(), ['done'])
+        self.assertEqual(self.calls, [2])
+
+    def test_coalescing_delay_is_capped(self):
+        first = schedule('test_task', key='test', delay=5, max_delay=60, value=1)
+        # Pushed back by a minute of triggers already
+        Task.objects.update(created_at=timezone.now() - timedelta(seconds=58), run_at=timezone.now())
+        schedule('test_task', key='test', delay=5, max_delay=60, value=2)
+        first.refresh_from_db()
+        self.assertEqual(first.run_at, first.created_at + timedelta(seconds=60))
+
+    def test_trigger_while_running_queues_another_run(self):
+        schedule('test_task', key='test', delay=0, value=1)
+        claimed = claim('worker', 10)
+        schedule('test_task', key='test', delay=0, value=2)
+        self.assertEqual([run_task(task) for task in claimed], ['done'])
+        self.assertEqual(run_pending(), ['done'])
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_admin_retry_skips_keys_already_queued(self):
+        dead = [
+            Task.objects.create(name='test_task', kwargs={'value': n}, status=Task.DEAD, dedupe_key=key)
+            for n, key in enumerate(['queued', 'free', 'free', None])
+        ]
+        queued = schedule('test_task', key='queued', delay=0, value=4)
+        task_admin = TaskAdmin(Task, admin.site)
+        with mock.patch.object(task_admin, 'message_user') as message_user:
+            task_admin.retry(None, Task.objects.filter(pk__in=[task.pk for task in dead]))
+        message_user.assert_called_once_with(None, 'Queued 2 tasks to run again, skipped 2 whose key is already queued')
+        self.assertEqual(
+            set(Task.objects.filter(status=Task.QUEUED).values_list('pk', flat=True)),
+            {queued.pk, dead[2].pk, dead[3].pk}
+        )
+
+    def test_failed_run_superseded_by_newer_trigger(self):
+        self.failures = 1
+        schedule('test_task', key='test', delay=0, value=1)
+        claimed = claim('worker', 10)
+        schedule('test_task', key='test', delay=0, value=2)
+        self.assertEqual([run_task(task) for task in claimed], ['superseded'])
+        self.assertEqual(run_pending(), ['done'])
+        self.assertEqual(self.calls, [1, 2])
+
+
+@override_settings(RECOMPUTE_DEBOUNCE=5)
+class RecomputeSchedulerTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        CognitiveTestResult.objects.create(
+            patient=self.patient, score=25, total_questions=50, correct_answers=25, details=[]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def test_lifestyle_edits_coalesce_into_one_recompute(self):
+        for day in range(3):
+            response = self.client.post(
+                '/api/lifestyle-data/',
+                {'date': date.today() - timedelta(days=2 - day), 'physical_activity': 2 * day},
+                format='json'
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertFalse(BrainHealthAssessment.objects.exists())
+        self.assertEqual(Task.objects.get().coalesced, 2)
+        # Dashboards see the new entry before the recompute runs
+        self.assertEqual(
+            PatientSnapshot.objects.get(patient=self.patient).latest_lifestyle,
+            LifestyleData.objects.order_by('-date').first()
+        )
+
+        Task.objects.update(run_at=timezone.now())
+        with mock.patch('api.assessments.reconcile_recommendations', wraps=reconcile_recommendations) as reconcile:
+            self.assertEqual(run_pending(), ['done'])
+        self.assertEqual(reconcile.call_count, 1)
+        # Scored with the latest entry
+        self.assertEqual(
+            BrainHealthAssessment.objects.get().lifestyle_data, LifestyleData.objects.order_by('-date').first()
+        )
+
+    def test_bulk_upload_refreshes_the_snapshot_inline(self):
+        response = self.client.post('/api/lifestyle-data/bulk/', {'entries': [
+            {'date': date.today() - timedelta(days=day), 'good_sleep': day} for day in range(3)
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            PatientSnapshot.objects.get(patient=self.patient).latest_lifestyle.date, date.today()
+        )
+        self.assertEqual(Task.objects.filter(name='recompute_assessment').count(), 1)
+
+    def test_tasks_queued_under_the_old_name_still_run(self):
+        LifestyleData.objects.create(user=self.patient.user, date=date.today(), physical_activity=4)
+        enqueue('refresh_recommendations', patient_id=self.patient.pk)
+        self.assertEqual(run_pending(), ['done'])
+        self.assertTrue(BrainHealthAssessment.objects.filter(patient=self.patient).exists())
+
+    def test_recompute_locks_the_patient_first(self):
+        lock = mock.patch.object(Patient.objects, 'select_for_update', wraps=Patient.objects.select_for_update)
+        with lock as select_for_update:
+            # The lock is taken before anything is read or written
+            recompute = mock.patch(
+                'api.assessments.recompute_assessment', side_effect=lambda patient: select_for_update.assert_called_once()
+            )
+            with recompute:
+                TASKS['recompute_assessment'].func(patient_id=self.patient.pk)
+        select_for_update.assert_called_once()
+
+
+class AnswerScoringTests(TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(as_number(' 12.0 '), Decimal('12.0'))
+        self.assertEqual(as_number('$30'), Decimal('30'))
+        self.assertEqual(as_number('1,000'), Decimal('1000'))
+        self.assertEqual(as_number('$1,234,567.5'), Decimal('1234567.5'))
+        for misplaced in ('1,0', '10,00', '1,0000', ',100'):
+            self.assertIsNone(as_number(misplaced), misplaced)
+        self.assertFalse(compile_matcher('10')('1,0'))
+        self.assertIsNone(as_number('twelve'))
+        self.assertIsNone(as_number('12 apples'))
+
+    def test_text_and_number_matchers(self):
+        text = compile_matcher('Paris')
+        self.assertTrue(text('  paris '))
+        self.assertTrue(text('PARIS'))
+        self.assertFalse(text('Lyon'))
+        self.assertFalse(text(None))
+
+        number = compile_matcher('12')
+        self.assertTrue(number('12.0'))
+        self.assertTrue(number(12))
+        self.assertFalse(number('13'))
+
+    def test_rubrics(self):
+        open_ended = compile_matcher('(Open-ended)')
+        self.assertTrue(open_ended('A dog, a cat'))
+        self.assertFalse(open_ended('   '))
+        self.assertFalse(open_ended(None))
+
+        @rubric('(Even)')
+        def even(answer):
+            return as_number(answer) is not None and as_number(answer) % 2 == 0
+        self.addCleanup(RUBRICS.pop, '(Even)')
+        key = CompiledAnswerKey({1: '(Even)'})
+        self.assertTrue(key.is_correct(1, '4'))
+        self.assertFalse(key.is_correct(1, '5'))
+
+    def test_compiled_key(self):
+        key = CompiledAnswerKey({1: 'Paris', '2': '12', 3: ''}, version=7)
+        self.assertEqual(key.version, 7)
+        # Question ids match whether they come as numbers or strings
+        self.assertTrue(key.is_correct('1', 'paris'))
+        self.assertTrue(key.is_correct(2, '12.0'))
+        # Blank key entries and unknown questions are never correct
+        self.assertFalse(key.is_correct(3, ''))
+        self.assertFalse(key.is_correct(99, 'Paris'))
+
+        answers = [
+            {'question_id': 1, 'answer': 'Paris'},
+            {'question_id': 2, 'answer': '11'},
+            {'question_id': 3, 'answer': 'x'},
+            'not an item',
+        ]
+        self.assertEqual(key.score(answers), ScoreResult(12.5, 1, 4))
+        self.assertEqual(key.score({'question_id': 1}), ScoreResult(0.0, 0, 0))
+        self.assertEqual(key.score([]), ScoreResult(0.0, 0, 0))
+
+    def test_bank_key_follows_the_questions(self):
+        bank = get_question_bank()
+        self.assertEqual(bank.compiled_key.version, bank.version)
+        self.assertEqual(set(bank.compiled_key.matchers), {pk for pk, answer in bank.answer_key.items() if answer})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            question = CognitiveTestQuestion.objects.create(question='2 + 2?', options=['3', '4'], correct_answer='4')
+        bank = get_question_bank()
+        self.assertTrue(bank.compiled_key.is_correct(question.pk, ' 4.0'))
+        self.assertEqual(bank.compiled_key.version, bank.version)
+
+
+class RescoreCognitiveTestsTests(TestCase):
+
+    def setUp(self):
+        self.bank = get_question_bank()
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        answers = [{'question_id': question_id, 'answer': answer} for question_id, answer in self.bank.answer_key.items()]
+        self.expected = self.bank.compiled_key.score(answers)
+        # Scored 0 by an older bank, and 0 against the current one by mistake
+        self.stale, self.current = [
+            CognitiveTestResult.objects.create(
+                patient=self.patient, score=0, correct_answers=0, total_questions=1, details=answers,
+                bank_version=version
+            )
+            for version in (self.bank.version - 1, self.bank.version)
+        ]
+        refresh_patient_snapshots(Patient.objects.all())
+        ChangeLogEntry.objects.all().delete()
+
+    def rescore(self, *args):
+        out = StringIO()
+        call_command('rescore_cognitive_tests', *args, stdout=out)
+        return out.getvalue()
+
+    def scores(self):
+        return list(CognitiveTestResult.objects.order_by('pk').values_list('score', 'bank_version'))
+
+    def test_dry_run_writes_nothing(self):
+        output = self.rescore('--dry-run')
+        self.assertIn(f'Rescored 1 results against question bank v{self.bank.version}: 1 scores would change', output)
+        self.assertEqual(self.scores(), [(0, self.bank.version - 1), (0, self.bank.version)])
+        self.assertFalse(ChangeLogEntry.objects.exists())
+
+    def test_rescores_results_of_older_banks(self):
+        output = self.rescore()
+        self.assertIn('Rescored 1 results', output)
+        self.stale.refresh_from_db()
+        self.assertEqual(
+            (self.stale.score, self.stale.correct_answers, self.stale.total_questions, self.stale.bank_version),
+            (*self.expected, self.bank.version)
+        )
+        # Only older versions are rescored without --all
+        self.assertEqual(CognitiveTestResult.objects.get(pk=self.current.pk).score, 0)
+        self.assertEqual(
+            list(ChangeLogEntry.objects.values_list('model', 'object_id')), [('cognitive_test', self.stale.pk)]
+        )
+
+    def test_all_rescores_current_results(self):
+        self.assertIn('Rescored 2 results against question bank', self.rescore('--all', '--chunk-size=1'))
+        self.assertEqual(self.scores(), [(self.expected.score, self.bank.version)] * 2)
+        # The latest test's new score reaches the snapshot
+        self.assertEqual(PatientSnapshot.objects.get(patient=self.patient).latest_cognitive_score, self.expected.score)
+        self.assertEqual(ChangeLogEntry.objects.filter(model='cognitive_test').count(), 2)
+
+
+class QuestionPayloadTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('cognitive_test_questions')
+
+    def test_variants_share_one_body(self):
+        payload = PrecomputedPayload({'questions': [{'id': 1, 'question': 'Q?'}], 'version': 1})
+        self.assertEqual(json.loads(payload.body), {'questions': [{'id': 1, 'question': 'Q?'}], 'version': 1})
+        self.assertEqual(gzip.decompress(payload.encoded['gzip']), payload.body)
+        self.assertEqual(len(set(payload.etags.values())), len(payload.encoded))
+        same = PrecomputedPayload({'questions': [{'id': 1, 'question': 'Q?'}], 'version': 1})
+        self.assertEqual(payload.etags, same.etags)
+        self.assertNotEqual(payload.etags, PrecomputedPayload({'questions': [], 'version': 2}).etags)
+
+    def test_full_response_then_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['questions'], get_question_bank().questions)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], etag)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"stale", {etag}').status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='*').status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_compressed_variant(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].endswith('-gzip"'))
+        self.assertEqual(json.loads(gzip.decompress(response.content)), json.loads(get_question_bank().payload.body))
+
+        # A tag of another variant still validates the client's copy
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        identity = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', identity)
+
+    def test_new_question_changes_the_tag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            CognitiveTestQuestion.objects.create(question='2 + 2?', options=['3', '4'], correct_answer='4')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('2 + 2?', [question['question'] for question in response.json()['questions']])
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportHistoryTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.caregiver = Caregiver.objects.create(user=User.objects.create_user(username='caregiver'))
+        self.caregiver.patients.add(self.patient)
+        for day in (3, 1, 2):
+            LifestyleData.objects.create(user=self.patient.user, date=date(2026, 1, day), physical_activity=day)
+        CognitiveTestResult.objects.create(
+            patient=self.patient, score=30, total_questions=50, correct_answers=30, details=[{'question_id': 1}]
+        )
+        other = User.objects.create_user(username='other')
+        LifestyleData.objects.create(user=other, date=date(2026, 1, 1), physical_activity=9)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient.user)
+
+    def export(self, dataset, **params):
+        response = self.client.get(reverse('export_history', kwargs={'dataset': dataset}), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_oldest_first(self):
+        response, body = self.export('lifestyle')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            response['Content-Disposition'], f'attachment; filename="lifestyle-{self.patient.user.pk}.ndjson"'
+        )
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['date'] for row in rows], ['2026-01-01', '2026-01-02', '2026-01-03'])
+        self.assertEqual([row['physical_activity'] for row in rows], [1, 2, 3])
+
+    def test_csv(self):
+        response, body = self.export('cognitive', output='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        header, row = list(csv.reader(StringIO(body)))
+        self.assertEqual(header, ['id', 'date_taken', 'score', 'total_questions', 'correct_answers', 'details'])
+        self.assertEqual(row[2:5], ['30.0', '50', '30'])
+        self.assertEqual(json.loads(row[5]), [{'question_id': 1}])
+
+    def test_rows_read_while_streaming(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('export_history', kwargs={'dataset': 'lifestyle'}))
+        self.assertFalse([query for query in queries if 'api_lifestyledata' in query['sql']])
+
+        with CaptureQueriesContext(connection) as queries:
+            lines = list(response.streaming_content)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue([query for query in queries if 'api_lifestyledata' in query['sql']])
+
+    def test_caregiver_exports_their_patient(self):
+        self.client.force_authenticate(self.caregiver.user)
+        response, body = self.export('cognitive', patient_id=self.patient.pk)
+        self.assertEqual(len(body.splitlines()), 1)
+
+        stranger = Patient.objects.create(user=User.objects.create_user(username='stranger'))
+        url = reverse('export_history', kwargs={'dataset': 'cognitive'})
+        self.assertEqual(self.client.get(url, {'patient_id': stranger.pk}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'patient_id': 999999}).status_code, 404)
+        for malformed in ('abc', '1.5', '-1'):
+            self.assertEqual(self.client.get(url, {'patient_id': malformed}).status_code, 400, malformed)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_rejected_requests(self):
+        self.assertEqual(self.client.get(reverse('export_history', kwargs={'dataset': 'nope'})).status_code, 404)
+        url = reverse('export_history', kwargs={'dataset': 'lifestyle'})
+        self.assertEqual(self.client.get(url, {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'patient_id': self.patient.pk}).status_code, 403)
+
+
+class LifestyleBulkUpsertTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.user = self.patient.user
+        self.existing = LifestyleData.objects.create(user=self.user, date=date(2026, 1, 1), physical_activity=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('lifestyle_data_bulk')
+
+    def test_statuses_per_entry(self):
+        tokens = latest_token(self.user)
+        response = self.client.post(self.url, {'entries': [
+            {'date': '2026-01-01', 'physical_activity': 5, 'notes': 'Walked'},
+            {'date': '2026-01-02', 'physical_activity': 3},
+            {'date': '2026-01-02', 'physical_activity': 4},
+            {'date': 'not a date'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['failed']), (1, 1, 2))
+        self.assertEqual(
+            [(row['index'], row['status']) for row in response.data['results']],
+            [(0, 'updated'), (1, 'created'), (2, 'error'), (3, 'error')]
+        )
+        self.assertEqual(response.data['results'][2]['errors'], {'date': ['Duplicate date in batch']})
+        self.assertIn('date', response.data['results'][3]['errors'])
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.physical_activity, self.existing.notes), (5, 'Walked'))
+        created = LifestyleData.objects.get(user=self.user, date=date(2026, 1, 2))
+        self.assertEqual(created.physical_activity, 3)
+
+        # One change per written row, in the user's feed
+        changes = read_changes(self.user, tokens)[0]
+        self.assertEqual(
+            sorted((change['id'], change['op']) for change in changes),
+            sorted([(self.existing.pk, 'upsert'), (created.pk, 'upsert')])
+        )
+
+    def test_one_recompute_per_batch(self):
+        self.client.post(self.url, [
+            {'date': f'2026-02-{day:02d}', 'physical_activity': day} for day in range(1, 6)
+        ], format='json')
+        self.assertEqual(Task.objects.filter(name='recompute_assessment').count(), 1)
+
+    def test_rejected_batches(self):
+        self.assertEqual(self.client.post(self.url, {'entries': []}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'entries': 'x'}, format='json').status_code, 400)
+        with self.settings(LIFESTYLE_BULK_MAX_ENTRIES=2):
+            response = self.client.post(self.url, {'entries': [{}, {}, {}]}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(LifestyleData.objects.count(), 1)
+
+
+class LifestyleStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+
+    def log_entry(self, days_ago, **values):
+        return LifestyleData.objects.create(user=self.user, date=self.today - timedelta(days=days_ago), **values)
+
+    def assert_matches_history(self):
+        stats = LifestyleStats.objects.get(user=self.user)
+        self.assertEqual(stats.windows, aggregate_windows(self.user.pk, self.today))
+        self.assertEqual(
+            stats.latest_entry, LifestyleData.objects.filter(user=self.user).order_by('-date', '-id').first()
+        )
+
+    def test_writes_keep_windows_in_line(self):
+        recent = self.log_entry(1, physical_activity=4, stress=3)
+        older = self.log_entry(20, physical_activity=2)
+        self.log_entry(200, good_sleep=5)
+        self.assert_matches_history()
+
+        recent.physical_activity = 6
+        recent.save()
+        self.assert_matches_history()
+
+        # Moves out of the 7 and 30 day windows
+        recent.date = self.today - timedelta(days=60)
+        recent.save()
+        self.assert_matches_history()
+
+        older.delete()
+        self.assert_matches_history()
+        self.assertEqual(LifestyleStats.objects.get(user=self.user).windows['all']['count'], 2)
+
+    def test_writes_do_not_aggregate_history(self):
+        for days_ago in range(30):
+            self.log_entry(days_ago)
+        entry = LifestyleData.objects.filter(user=self.user).first()
+        entry.good_sleep = 3
+        with CaptureQueriesContext(connection) as queries:
+            entry.save()
+        # Only the touched week and month rollup buckets are grouped and summed
+        totals = [query['sql'] for query in queries if 'SUM(' in query['sql'] and 'GROUP BY' not in query['sql']]
+        self.assertEqual(totals, [])
+
+    def test_bulk_upsert_keeps_windows_in_line(self):
+        self.log_entry(1, physical_activity=4)
+        response = self.client.post(reverse('lifestyle_data_bulk'), {'entries': [
+            {'date': str(self.today - timedelta(days=1)), 'physical_activity': 7},
+            {'date': str(self.today - timedelta(days=10)), 'physical_activity': 1},
+        ]}, format='json')
+        self.assertEqual((response.data['created'], response.data['updated']), (1, 1))
+        self.assert_matches_history()
+
+    def test_stats_from_an_earlier_day_are_recomputed(self):
+        self.log_entry(3, physical_activity=4)
+        LifestyleStats.objects.filter(user=self.user).update(as_of=self.today - timedelta(days=5), windows={})
+        self.assertEqual(get_lifestyle_stats(self.user.pk).windows, aggregate_windows(self.user.pk, self.today))
+
+    def test_stats_endpoint(self):
+        self.log_entry(1, physical_activity=4, healthy_diet=2)
+        self.log_entry(3, physical_activity=2, healthy_diet=2)
+        self.log_entry(40, physical_activity=9)
+
+        response = self.client.get(reverse('lifestyle_stats'), {'period': '7d'})
+        self.assertEqual(response.data['entry_count'], 2)
+        self.assertEqual(response.data['averages']['avg_physical_activity'], 3)
+        self.assertEqual(response.data['totals'], {'total_physical_activity': 6, 'total_healthy_meals': 4})
+        self.assertEqual(response.data['latest_entry']['date'], str(self.today - timedelta(days=1)))
+        self.assertEqual(self.client.get(reverse('lifestyle_stats'), {'period': 'all'}).data['entry_count'], 3)
+
+    def test_trends_endpoint(self):
+        LifestyleData.objects.create(user=self.user, date=date(2026, 3, 2), physical_activity=4)  # Monday
+        LifestyleData.objects.create(user=self.user, date=date(2026, 3, 8), physical_activity=2)  # Sunday
+        LifestyleData.objects.create(user=self.user, date=date(2026, 3, 9), physical_activity=6)
+
+        weeks = self.client.get(reverse('lifestyle-trends'), {'group_by': 'week'}).json()
+        self.assertEqual(
+            [(week['period'], week['physical_activity']) for week in weeks],
+            [('2026-W10', 3), ('2026-W11', 6)]
+        )
+        months = self.client.get(reverse('lifestyle-trends'), {'group_by': 'month'}).json()
+        self.assertEqual([(month['period'], month['physical_activity']) for month in months], [('2026-03', 4)])
+
+    def test_no_data(self):
+        self.assertIn('message', self.client.get(reverse('lifestyle_stats')).data)
+        self.assertIn('message', self.client.get(reverse('lifestyle-trends')).data)
+
+
+class ChangeFeedTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient')
+        self.other = User.objects.create_user(username='other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def log_entry(self, user, day):
+        return LifestyleData.objects.create(user=user, date=date(2026, 1, day), physical_activity=day)
+
+    def sync(self, since=None):
+        response = self.client.get(reverse('sync_changes'), {} if since is None else {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_tokens_count_per_user_in_write_order(self):
+        first = self.log_entry(self.user, 1)
+        self.log_entry(self.other, 1)
+        second = self.log_entry(self.user, 2)
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(user=self.user).order_by('token').values_list('token', 'object_id')),
+            [(1, first.pk), (2, second.pk)]
+        )
+        self.assertEqual(latest_token(self.other), 1)
+
+    def test_rolled_back_writes_release_their_tokens(self):
+        self.log_entry(self.user, 1)
+        with transaction.atomic():
+            self.log_entry(self.user, 2)
+            transaction.set_rollback(True)
+        self.log_entry(self.user, 3)
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(user=self.user).order_by('token').values_list('token', flat=True)),
+            [1, 2]
+        )
+
+    def test_writers_lock_the_counter_until_commit(self):
+        self.log_entry(self.user, 1)
+        with CaptureQueriesContext(connection) as queries:
+            record_changes(LifestyleData, self.user.pk, [1, 2])
+        # The counter is bumped by an UPDATE, which holds the row lock, before any entry is written
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertEqual(statements, ['UPDATE', 'SELECT', 'INSERT'])
+        self.assertIn('api_synccounter', queries[0]['sql'])
+
+    def test_sync_from_scratch_then_incrementally(self):
+        start = self.sync()
+        self.assertEqual(start, {'changes': [], 'next_token': 0, 'has_more': False})
+
+        first = self.log_entry(self.user, 1)
+        second = self.log_entry(self.user, 2)
+        first.physical_activity = 7
+        first.save()
+        self.log_entry(self.other, 1)
+
+        feed = self.sync(start['next_token'])
+        # Both writes to the first entry collapse into its current state
+        self.assertEqual(
+            [(change['id'], change['op']) for change in feed['changes']],
+            [(second.pk, 'upsert'), (first.pk, 'upsert')]
+        )
+        self.assertEqual(feed['changes'][1]['data']['physical_activity'], 7)
+        self.assertEqual(feed['next_token'], 3)
+
+        deleted = second.pk
+        second.delete()
+        feed = self.sync(feed['next_token'])
+        self.assertEqual(feed['changes'], [{'token': 4, 'model': 'lifestyle_data', 'id': deleted, 'op': 'delete'}])
+        self.assertEqual(self.sync(feed['next_token'])['changes'], [])
+        self.assertEqual(self.sync()['next_token'], 4)
+
+    def test_pages(self):
+        for day in range(1, 6):
+            self.log_entry(self.user, day)
+        changes, token, has_more = read_changes(self.user, 0, limit=3)
+        self.assertEqual(([change['token'] for change in changes], token, has_more), ([1, 2, 3], 3, True))
+        changes, token, has_more = read_changes(self.user, token, limit=3)
+        self.assertEqual(([change['token'] for change in changes], token, has_more), ([4, 5], 5, False))
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('sync_changes'), {'since': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_deleting_the_owner_writes_no_entries(self):
+        patient = Patient.objects.create(user=self.user)
+        self.log_entry(self.user, 1)
+        Recommendation.objects.create(patient=patient, category='sleep', title='Sleep', description='', priority='low')
+        with CaptureQueriesContext(connection) as queries:
+            self.user.delete()
+        self.assertFalse([query['sql'] for query in queries if query['sql'].startswith('INSERT')])
+        self.assertFalse(ChangeLogEntry.objects.filter(user_id=self.user.pk).exists())
+
+    def test_deleting_a_row_writes_a_tombstone(self):
+        entry = self.log_entry(self.user, 1)
+        entry.delete()
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(user=self.user).order_by('token').values_list('operation', flat=True)),
+            ['upsert', 'delete']
+        )
+
+
+class ReconcileRecommendationsTests(TestCase):
+
+    def setUp(self):
+        self.patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        self.generated = [
+            {'category': 'physical', 'title': 'Walk', 'description': 'Walk daily', 'priority': 'high'},
+            {'category': 'sleep', 'title': 'Sleep', 'description': 'Sleep 8 hours', 'priority': 'medium'},
+        ]
+        reconcile_recommendations(self.patient, self.generated)
+        self.ids = set(self.open_ids())
+
+    def open_ids(self):
+        return Recommendation.objects.filter(patient=self.patient, completed=False).values_list('id', flat=True)
+
+    def test_unchanged_set_costs_one_read(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(reconcile_recommendations(self.patient, self.generated), (0, 0, 0))
+        self.assertEqual(set(self.open_ids()), self.ids)
+
+    def test_only_changes_written(self):
+        changed = [dict(self.generated[0], priority='low')]
+        changed.append({'category': 'social', 'title': 'Call', 'description': 'Call a friend', 'priority': 'low'})
+        entries = ChangeLogEntry.objects.count()
+        with self.assertNumQueries(12):
+            self.assertEqual(reconcile_recommendations(self.patient, changed), (1, 1, 1))
+
+        walk = Recommendation.objects.get(patient=self.patient, title='Walk')
+        self.assertIn(walk.pk, self.ids)
+        self.assertEqual(walk.priority, 'low')
+        self.assertFalse(Recommendation.objects.filter(patient=self.patient, title='Sleep').exists())
+        self.assertEqual(
+            list(ChangeLogEntry.objects.filter(id__gt=entries).values_list('operation', flat=True).order_by('id')),
+            ['upsert', 'upsert', 'delete']
+        )
+
+    def test_completed_and_duplicates(self):
+        Recommendation.objects.filter(title='Sleep').update(completed=True)
+        duplicate = Recommendation.objects.create(patient=self.patient, **self.generated[0])
+        reconcile_recommendations(self.patient, self.generated)
+        self.assertTrue(Recommendation.objects.filter(title='Sleep', completed=True).exists())
+        self.assertTrue(Recommendation.objects.filter(title='Sleep', completed=False).exists())
+        self.assertFalse(Recommendation.objects.filter(pk=duplicate.pk).exists())
+
+
+class ScoringRuleTests(TestCase):
+
+    lifestyle = {
+        'physical_activity': 4, 'healthy_diet': 1, 'social_engagement': 0, 'good_sleep': 6,
+        'smoking': 1, 'alcohol': 0, 'stress': 3,
+    }
+
+    def test_seeded_rules(self):
+        rules = get_scoring_rules()
+        # 25/50 -> 50, +15 activity, +10 sleep, -20 smoking
+        self.assertEqual(rules.score(25, self.lifestyle), 55)
+        self.assertEqual(
+            [rec['category'] for rec in rules.recommend(55, self.lifestyle)],
+            ['cognitive', 'nutrition', 'stress', 'social']
+        )
+        self.assertEqual(rules.score(50, {'physical_activity': 10, 'healthy_diet': 10}), 100)
+        self.assertEqual(rules.score(0, {'smoking': 5}), 0)
+
+    def test_score_rules_cannot_depend_on_the_score(self):
+        with self.assertRaises(ValueError):
+            CompiledRules([{
+                'factor': ScoringRule.BRAIN_HEALTH_SCORE, 'comparator': 'lt', 'threshold': 50, 'weight': 5,
+                'category': '', 'title': '', 'description': '', 'priority': '',
+            }])
+
+    def test_rule_changes_reload_without_restart(self):
+        before = get_scoring_rules()
+        # The version rolls back with the test, the cached number doesn't
+        self.addCleanup(cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            ScoringRule.objects.create(factor='alcohol', comparator='eq', threshold=0, weight=5)
+        after = get_scoring_rules()
+        self.assertGreater(after.version, before.version)
+        self.assertEqual(after.score(25, self.lifestyle), before.score(25, self.lifestyle) + 5)
+
+    def test_assessment_stamped_with_rule_version(self):
+        patient = Patient.objects.create(user=User.objects.create_user(username='patient'))
+        LifestyleData.objects.create(user=patient.user, date=date.today(), **self.lifestyle)
+        CognitiveTestResult.objects.create(patient=patient, score=25, total_questions=50, correct_answers=25, details=[])
+        assessment = recompute_assessment(patient)
+        self.assertEqual(assessment.score, 55)
+        self.assertEqual(assessment.rule_version, get_scoring_rules().version)
+
+
+class RescoreAssessmentsTests(TestCase):
+
+    def setUp(self):
+        self.patients = [
+            Patient.objects.create(user=User.objects.create_user(username=f'patient-{n}')) for n in range(3)
+        ]
+        for n, patient in enumerate(self.patients[:2]):
+            LifestyleData.objects.create(user=patient.user, date=date.today(), physical_activity=n * 5, smoking=1)
+            CognitiveTestResult.objects.create(
+                patient=patient, score=20 + n * 10, total_questions=50, correct_answers=20, details=[]
+            )
+        # Assessed yesterday with rules that predate versioning
+        with explicit_dates(BrainHealthAssessment._meta.get_field('date')):
+            BrainHealthAssessment.objects.create(
+                patient=self.patients[0], score=90, cognitive_score=20, date=date.today() - timedelta(days=1)
+            )
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+
+    def rescore(self, *args):
+        out = StringIO()
+        call_command('rescore_assessments', '--workers=1', f'--checkpoint={self.checkpoint}', *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_dry_run_reports_without_writing(self):
+        output = self.rescore('--dry-run')
+        self.assertIn('Would rescore 2 of 3 patients', output)
+        # Before and after are both over the one patient assessed before
+        lifestyle = LifestyleData.objects.filter(user=self.patients[0].user).values(*LIFESTYLE_FACTORS)[0]
+        self.assertIn(f'Mean score 90.0 -> {get_scoring_rules().score(20, lifestyle):.1f};', output)
+        self.assertEqual(BrainHealthAssessment.objects.count(), 1)
+        self.assertFalse(Recommendation.objects.exists())
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_rescore_writes_assessments_and_recommendations(self):
+        self.rescore('--chunk-size=1')
+        rules = get_scoring_rules()
+        for patient in self.patients[:2]:
+            lifestyle = LifestyleData.objects.filter(user=patient.user).values(*LIFESTYLE_FACTORS)[0]
+            test = CognitiveTestResult.objects.get(patient=patient)
+            assessment = BrainHealthAssessment.objects.get(patient=patient, date=date.today())
+            self.assertEqual(assessment.score, rules.score(test.score, lifestyle))
+            self.assertEqual(assessment.rule_version, rules.version)
+            self.assertEqual(
+                sorted(Recommendation.objects.filter(patient=patient).values_list('title', flat=True)),
+                sorted(rec['title'] for rec in rules.recommend(assessment.score, lifestyle))
+            )
+            self.assertEqual(PatientSnapshot.objects.get(patient=patient).latest_assessment, assessment)
+        self.assertTrue(ChangeLogEntry.objects.filter(model='assessment').exists())
+
+        # A finished run leaves no checkpoint behind
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # Everyone is on the current rules now
+        self.assertIn('Rescored 0 of 3 patients', self.rescore())
+
+    def test_resume_skips_finished_chunks(self):
+        rescore_chunk = rescoring.rescore_chunk
+
+        def interrupted(lo, hi, *args, **kwargs):
+            if hi == self.patients[1].pk:
+                raise rescoring.RulesChanged('interrupted')
+            return rescore_chunk(lo, hi, *args, **kwargs)
+
+        with mock.patch.object(rescoring, 'rescore_chunk', interrupted):
+            with self.assertRaises(CommandError):
+                self.rescore('--chunk-size=1')
+        self.assertTrue(os.path.exists(self.checkpoint))
+
+        output = self.rescore('--chunk-size=1', '--resume')
+        self.assertIn('Resuming: 1 chunks already done', output)
+        self.assertIn('Rescoring 2 chunks', output)
+        self.assertIn('Rescored 2 of 3 patients', output)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_numpy_scores_match_compiled_rules(self):
+        self.assertIsNotNone(rescoring.np, 'NumPy is a requirement')
+        rng = random.Random(0)
+        lifestyles = [
+            {factor: rng.randint(0, 10) for factor in LIFESTYLE_FACTORS} for _ in range(200)
+        ]
+        test_scores = [rng.randint(0, 50) for _ in lifestyles]
+        rules = get_scoring_rules()
+
+        scores, recommendations = rescoring.evaluate(rules, test_scores, lifestyles)
+        expected = [rules.score(score, lifestyle) for score, lifestyle in zip(test_scores, lifestyles)]
+        self.assertEqual(scores, expected)
+        self.assertEqual(
+            recommendations,
+            [rules.recommend(score, lifestyle) for score, lifestyle in zip(expected, lifestyles)]
+        )
+        with mock.patch.object(rescoring, 'np', None):
+            self.assertEqual(rescoring.evaluate(rules, test_scores, lifestyles), (scores, recommendations))
+
+    def test_pending_ranges(self):
+        first, second, third = [patient.pk for patient in self.patients]
+        self.assertEqual(pending_ranges([], 2), [(first - 1, second), (second, third)])
+        self.assertEqual(pending_ranges([[first - 1, first]], 5), [(second - 1, third)])
+        self.assertEqual(pending_ranges([[second - 1, second]], 5), [(first - 1, first), (third - 1, third)])
@@ -11,15 +11,20 @@ from .views import (
     submit_cognitive_test,
     cognitive_test_history,
     lifestyle_data,
+    lifestyle_data_bulk,
     lifestyle_stats,
     brain_health_history,
     recommendations,
+    sync_changes,
     send_verification,
     lifestyle_trends,
+    export_history,
     verify_patient,
     caregiver_patients,
     add_patient,
-    remove_patient
+    remove_patient,
+    prometheus_metrics,
+    download_profile
 )
 
 urlpatterns = [
@@ -40,8 +45,10 @@ urlpatterns = [
     
     # Lifestyle Tracking
     path('lifestyle-data/', lifestyle_data, name='lifestyle_data'),
+    path('lifestyle-data/bulk/', lifestyle_data_bulk, name='lifestyle_data_bulk'),
     path('lifestyle-stats/', lifestyle_stats, name='lifestyle_stats'),
     path('lifestyle-trends/', lifestyle_trends, name='lifestyle-trends'),
+    path('export/<str:dataset>/', export_history, name='export_history'),
     
     # Brain Health
     path('brain-health/', brain_health_history, name='brain_health_history'),
@@ -50,6 +57,9 @@ urlpatterns = [
     path('recommendations/', recommendations, name='recommendations_list'),
     path('recommendations/<int:pk>/', recommendations, name='recommendation_detail'),
     
+    # Mobile sync
+    path('changes/', sync_changes, name='sync_changes'),
+    
     # Caregiver-Patient Management
     path('send-verification/', send_verification, name='send_verification'),
     path('verify-patient/', verify_patient, name='verify_patient'),
@@ -60,4 +70,8 @@ urlpatterns = [
     # Auth token (optional)
     path('api-token-auth/', obtain_auth_token, name='api_token_auth'),
     path('check-auth/', check_auth, name='check-auth'),
+
+    # Monitoring (internal)
+    path('metrics/', prometheus_metrics, name='metrics'),
+    path('profiles/<str:profile_id>/', download_profile, name='download_profile'),
 ]
\ No newline at end of file
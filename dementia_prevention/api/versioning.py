@@ -0,0 +1,61 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import ContentVersion
+
+
+def _cache_key(name):
+    return f'content-version:{name}'
+
+
+def current_version(name):
+    """
+    Current version of the named content. Read from the shared cache, or
+    from the database at most once per CONTENT_VERSION_TTL seconds when the
+    cache is process-local, so the check is cheap enough to run per request.
+    """
+    version = cache.get(_cache_key(name))
+    if version is None:
+        version = (
+            ContentVersion.objects.filter(name=name)
+            .values_list('version', flat=True)
+            .first()
+        ) or 0
+        cache.set(_cache_key(name), version, getattr(settings, 'CONTENT_VERSION_TTL', 5))
+    return version
+
+
+def bump_version(name):
+    """Invalidate every worker's copy of the named content"""
+    ContentVersion.objects.get_or_create(name=name)
+    ContentVersion.objects.filter(name=name).update(version=F('version') + 1)
+    # Drop the cached number once the new one is visible to other connections
+    transaction.on_commit(lambda: cache.delete(_cache_key(name)))
+
+
+class VersionedCache:
+    """
+    In-process copy of a value built from the database, rebuilt by
+    `build(version)` the first time it is read after the named content
+    version changes.
+    """
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self):
+        version = current_version(self.name)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._value = self.build(version)
+                    self._version = version
+        return self._value
@@ -1,10 +1,10 @@
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 import logging
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.authentication import SessionAuthentication
@@ -16,13 +16,14 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_GET
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import send_mail
 from django.contrib.auth import authenticate, login
 from django.conf import settings
-from datetime import datetime, timedelta
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from datetime import datetime
 import json
+import os
 import random
-from django.db.models import Avg, Max, Min
 from .models import (
     Patient, 
     Caregiver, 
@@ -30,6 +31,7 @@ from .models import (
     CognitiveTestQuestion,
     CognitiveTestResult,
     LifestyleData,
+    LIFESTYLE_FACTORS,
     BrainHealthAssessment,
     Recommendation
 )
@@ -43,7 +45,25 @@ from .serializers import (
     BrainHealthAssessmentSerializer,
     RecommendationSerializer
 )
-from .utils import calculate_brain_health_score, generate_recommendations
+from .rules import get_scoring_rules
+from .snapshots import load_snapshots, refresh_patient_snapshot
+from .pagination import InvalidCursor, paginate_keyset
+from .exports import CONTENT_TYPES, DATASETS, RENDERERS, export_rows
+from .question_bank import get_question_bank
+from .budgets import query_budget
+from .changes import latest_token, read_changes, record_changes
+from .assessments import lifestyle_values, lock_patient, schedule_recompute
+from .taskqueue import enqueue
+from .idempotency import idempotency_key, request_hash, store_response, stored_response
+from . import metrics, profiling
+from .rollups import (
+    STATS_WINDOWS,
+    entry_state,
+    get_lifestyle_rollups,
+    get_lifestyle_stats,
+    refresh_lifestyle_rollups,
+    update_lifestyle_stats
+)
 
 logger = logging.getLogger(__name__)
 
@@ -60,103 +80,8 @@ def check_session(request):
             }
         })
     return JsonResponse({'authenticated': False})
-# Helper functions
-def calculate_brain_health_score(cognitive_score, lifestyle_data):
-    """
-    Calculate a comprehensive brain health score based on cognitive test results and lifestyle factors
-    """
-    # Base score from cognitive test (0-100 scale)
-    base_score = cognitive_score * 10  # Assuming cognitive_score is 0-10
-    
-    # Lifestyle adjustments
-    lifestyle_score = 0
-    
-    # Positive lifestyle factors
-    if lifestyle_data.get('physical_activity', 0) >= 3:  # 3+ times per week
-        lifestyle_score += 15
-    if lifestyle_data.get('healthy_diet', 0) >= 4:  # 4+ healthy meals per week
-        lifestyle_score += 15
-    if lifestyle_data.get('social_engagement', 0) >= 2:  # 2+ social activities per week
-        lifestyle_score += 10
-    if lifestyle_data.get('good_sleep', 0) >= 5:  # 5+ nights of good sleep per week
-        lifestyle_score += 10
-    
-    # Negative lifestyle factors
-    if lifestyle_data.get('smoking', 0) > 0:
-        lifestyle_score -= 20
-    if lifestyle_data.get('alcohol', 0) > 7:  # More than 7 drinks per week
-        lifestyle_score -= 15
-    if lifestyle_data.get('stress', 0) >= 4:  # High stress level (4 or 5 on 1-5 scale)
-        lifestyle_score -= 10
-    
-    # Calculate final score (0-100 scale)
-    final_score = min(max(base_score + lifestyle_score, 0), 100)
-    
-    return final_score
-
-def generate_recommendations(brain_health_score, lifestyle_data):
-    """
-    Generate personalized recommendations based on brain health score and lifestyle data
-    """
-    recommendations = []
-    
-    # Cognitive recommendations
-    if brain_health_score < 70:
-        recommendations.append({
-            'category': 'cognitive',
-            'title': 'Brain Training Exercises',
-            'description': 'Engage in daily brain training activities to improve cognitive function.',
-            'priority': 'high'
-        })
-    
-    # Physical activity recommendations
-    if lifestyle_data.get('physical_activity', 0) < 3:
-        recommendations.append({
-            'category': 'physical',
-            'title': 'Increase Physical Activity',
-            'description': 'Aim for at least 30 minutes of moderate exercise 3-5 times per week.',
-            'priority': 'medium'
-        })
-    
-    # Diet recommendations
-    if lifestyle_data.get('healthy_diet', 0) < 4:
-        recommendations.append({
-            'category': 'nutrition',
-            'title': 'Improve Your Diet',
-            'description': 'Incorporate more fruits, vegetables, and omega-3 rich foods into your meals.',
-            'priority': 'medium'
-        })
-    
-    # Sleep recommendations
-    if lifestyle_data.get('good_sleep', 0) < 5:
-        recommendations.append({
-            'category': 'sleep',
-            'title': 'Improve Sleep Quality',
-            'description': 'Aim for 7-9 hours of quality sleep each night. Establish a regular sleep schedule.',
-            'priority': 'high'
-        })
-    
-    # Stress management recommendations
-    if lifestyle_data.get('stress', 0) >= 3:
-        recommendations.append({
-            'category': 'stress',
-            'title': 'Reduce Stress',
-            'description': 'Practice mindfulness or meditation for 10-15 minutes daily to reduce stress.',
-            'priority': 'high'
-        })
-    
-    # Social engagement recommendations
-    if lifestyle_data.get('social_engagement', 0) < 2:
-        recommendations.append({
-            'category': 'social',
-            'title': 'Increase Social Engagement',
-            'description': 'Participate in social activities at least twice a week to maintain cognitive health.',
-            'priority': 'medium'
-        })
-    
-    return recommendations
-
 from rest_framework.permissions import AllowAny
+@query_budget(12)
 @api_view(['POST', 'GET'])
 @csrf_exempt
 @permission_classes([AllowAny])
@@ -219,7 +144,10 @@ def signup_view(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(9)
 @api_view(['POST', 'GET'])
+@csrf_exempt
+@permission_classes([AllowAny])
 def login_view(request):
     # Get username and password from request data
     username = request.data.get('username')
@@ -250,6 +178,7 @@ def login_view(request):
         'email': user.email,
     })
 
+@query_budget(0)
 @api_view(['GET'])
 def check_auth(request):
     if request.user.is_authenticated:
@@ -259,11 +188,12 @@ def check_auth(request):
                 'id': request.user.id,
                 'username': request.user.username
             },
-            'is_caregiver': hasattr(request.user, 'caregiver'),
-            'is_patient': hasattr(request.user, 'patient')
+            'is_caregiver': request.role.is_caregiver,
+            'is_patient': request.role.is_patient
         })
     return Response({'authenticated': False})
 
+@query_budget(2)
 @api_view(['POST', 'GET'])
 @permission_classes([IsAuthenticated])
 def user_dashboard(request):
@@ -272,41 +202,35 @@ def user_dashboard(request):
         user = request.user
         response_data = {
             'user': UserSerializer(user).data,
-            'is_caregiver': hasattr(user, 'caregiver'),
-            'is_patient': hasattr(user, 'patient')
+            'is_caregiver': request.role.is_caregiver,
+            'is_patient': request.role.is_patient
         }
         
-        if hasattr(user, 'patient'):
+        if request.role.is_patient:
             # Patient-specific data
-            patient = user.patient
+            patient = load_snapshots(Patient.objects.filter(pk=request.role.patient.pk))[0]
             response_data['patient_data'] = PatientDataSerializer(patient).data
             
-            # Get latest cognitive test result
-            latest_test = CognitiveTestResult.objects.filter(patient=patient).order_by('-date_taken').first()
-            if latest_test:
-                response_data['latest_cognitive_score'] = CognitiveTestResultSerializer(latest_test).data
+            # Latest results come from the patient's snapshot row
+            if patient.latest_test:
+                response_data['latest_cognitive_score'] = CognitiveTestResultSerializer(patient.latest_test).data
             
-            # Get latest lifestyle data
-            latest_lifestyle = LifestyleData.objects.filter(user=user).order_by('-date').first()
-            if latest_lifestyle:
-                response_data['latest_lifestyle_data'] = LifestyleDataSerializer(latest_lifestyle).data
+            if patient.latest_lifestyle:
+                response_data['latest_lifestyle_data'] = LifestyleDataSerializer(patient.latest_lifestyle).data
             
-            # Get latest brain health assessment
-            latest_assessment = BrainHealthAssessment.objects.filter(patient=patient).order_by('-date').first()
-            if latest_assessment:
-                response_data['latest_assessment'] = BrainHealthAssessmentSerializer(latest_assessment).data
+            if patient.latest_assessment:
+                response_data['latest_assessment'] = BrainHealthAssessmentSerializer(patient.latest_assessment).data
             
             # Get recommendations
-            recommendations = Recommendation.objects.filter(patient=patient, completed=False)
-            response_data['recommendations'] = RecommendationSerializer(recommendations, many=True).data
+            response_data['recommendations'] = RecommendationSerializer(patient.open_recommendations, many=True).data
             
-        elif hasattr(user, 'caregiver'):
+        elif request.role.is_caregiver:
             # Caregiver-specific data
-            caregiver = user.caregiver
+            caregiver = request.role.caregiver
             response_data['caregiver_data'] = CaregiverSerializer(caregiver).data
             
             # Get connected patients
-            patients = caregiver.patients.all()
+            patients = caregiver.patients.select_related('user')
             response_data['patients'] = PatientDataSerializer(patients, many=True).data
             
         return Response(response_data)
@@ -317,44 +241,33 @@ def user_dashboard(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def caregiver_dashboard(request):
     """Detailed dashboard for caregivers showing their patients' data"""
     try:
-        if not hasattr(request.user, 'caregiver'):
+        if not request.role.is_caregiver:
             return Response(
                 {'error': 'User is not a caregiver'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        caregiver = request.user.caregiver
-        patients = caregiver.patients.all()
+        caregiver = request.role.caregiver
+        patients = load_snapshots(caregiver.patients.all())
         
         patient_data = []
         for patient in patients:
-            # Get patient's latest cognitive test
-            latest_test = CognitiveTestResult.objects.filter(patient=patient).order_by('-date_taken').first()
-            cognitive_data = CognitiveTestResultSerializer(latest_test).data if latest_test else None
-            
-            # Get patient's latest lifestyle data
-            latest_lifestyle = LifestyleData.objects.filter(user=patient.user).order_by('-date').first()
-            lifestyle_data = LifestyleDataSerializer(latest_lifestyle).data if latest_lifestyle else None
-            
-            # Get patient's latest assessment
-            latest_assessment = BrainHealthAssessment.objects.filter(patient=patient).order_by('-date').first()
-            assessment_data = BrainHealthAssessmentSerializer(latest_assessment).data if latest_assessment else None
-            
-            # Get patient's active recommendations
-            recommendations = Recommendation.objects.filter(patient=patient, completed=False)
-            recommendation_data = RecommendationSerializer(recommendations, many=True).data
+            latest_test = patient.latest_test
+            latest_lifestyle = patient.latest_lifestyle
+            latest_assessment = patient.latest_assessment
             
             patient_data.append({
                 'patient': PatientDataSerializer(patient).data,
-                'cognitive_data': cognitive_data,
-                'lifestyle_data': lifestyle_data,
-                'assessment_data': assessment_data,
-                'recommendations': recommendation_data
+                'cognitive_data': CognitiveTestResultSerializer(latest_test).data if latest_test else None,
+                'lifestyle_data': LifestyleDataSerializer(latest_lifestyle).data if latest_lifestyle else None,
+                'assessment_data': BrainHealthAssessmentSerializer(latest_assessment).data if latest_assessment else None,
+                'recommendations': RecommendationSerializer(patient.open_recommendations, many=True).data
             })
         
         return Response({
@@ -377,323 +290,64 @@ def json_login_required(view_func):
         return view_func(request, *args, **kwargs)
     return wrapped_view
 
-ANSWER_KEY = {
-    1: '12',
-    2: 'July',
-    3: 'Paris',
-    4: '5',
-    5: 'Mars',
-    6: 'Blue Whale',
-    7: '7',
-    8: '8',
-    9: 'Carbon Dioxide',
-    10: 'William Shakespeare',
-    
-    # New 40 answers (questions 11-50)
-    11: 'Joe Biden',
-    12: '(Open-ended)',  # Personal memory
-    13: 'Apple, Apricot, Avocado',
-    14: '$30',
-    15: '36',
-    16: 'Thursday',
-    17: 'Cold',
-    18: 'Blue',
-    19: 'DLROW',
-    20: 'Carrot',
-    21: '10',
-    22: '6',
-    23: 'George Washington',
-    24: 'Atlantic',
-    25: 'Blue',
-    26: 'Square',
-    27: 'Triangle',
-    28: '(Assess response)',
-    29: '(Assess sequencing)',
-    30: '(Open-ended)',
-    31: '(Open-ended)',
-    32: '93',
-    33: 'They weigh the same',
-    34: '(Open-ended)',
-    35: 'Pen',
-    36: 'Yellow',
-    37: '7',
-    38: '9',
-    39: 'Pencil',
-    40: '(Assess recall)',
-    41: '3:00',
-    42: 'December',
-    43: '(Open-ended)',
-    44: '(Assess response)',
-    45: 'Scissors',
-    46: '4',
-    47: '(Open-ended)',
-    48: 'Night',
-    49: 'Octagon',
-    50: 'Shoes'
-}
-
-# Public-facing questions (answers stripped out)
-QUESTIONS = [
-    {
-        'id': 1,
-        'question': 'What is 5 + 7?',
-        'options': ['10', '11', '12', '13']
-    },
-    {
-        'id': 2,
-        'question': 'Which month comes after June?',
-        'options': ['May', 'July', 'August', 'September']
-    },
-    {
-        'id': 3,
-        'question': 'What is the capital of France?',
-        'options': ['Berlin', 'Madrid', 'Paris', 'Rome']
-    },
-    {
-        'id': 4,
-        'question': 'What is 15 ÷ 3?',
-        'options': ['3', '4', '5', '6']
-    },
-    {
-        'id': 5,
-        'question': 'Which planet is known as the Red Planet?',
-        'options': ['Earth', 'Mars', 'Jupiter', 'Venus']
-    },
-    {
-        'id': 6,
-        'question': 'What is the largest mammal?',
-        'options': ['Elephant', 'Blue Whale', 'Giraffe', 'Hippopotamus']
-    },
-    {
-        'id': 7,
-        'question': 'How many continents are there on Earth?',
-        'options': ['5', '6', '7', '8']
-    },
-    {
-        'id': 8,
-        'question': 'What is the square root of 64?',
-        'options': ['6', '7', '8', '9']
-    },
-    {
-        'id': 9,
-        'question': 'Which gas do plants use for photosynthesis?',
-        'options': ['Oxygen', 'Carbon Dioxide', 'Nitrogen', 'Hydrogen']
-    },
-    {
-        'id': 10,
-        'question': 'Who wrote "Romeo and Juliet"?',
-        'options': ['Charles Dickens', 'William Shakespeare', 'Mark Twain', 'Jane Austen']
-    },
-
-    # New 40 questions (id 11-50)
-    {
-        'id': 11,
-        'question': 'What is the name of the current U.S. president?',
-        'options': ['Joe Biden', 'Donald Trump', 'Barack Obama', 'George Bush']
-    },
-    {
-        'id': 12,
-        'question': 'What was the last holiday you celebrated?',
-        'options': ['Christmas', 'Thanksgiving', 'Easter', 'New Year\'s']
-    },
-    {
-        'id': 13,
-        'question': 'Name three fruits that start with "A".',
-        'options': ['Apple, Apricot, Avocado', 'Banana, Blueberry, Blackberry', 'Cherry, Coconut, Cantaloupe', 'Grape, Guava, Gooseberry']
-    },
-    {
-        'id': 14,
-        'question': 'If you buy an item for \$20 and pay with \$50, how much change do you get?',
-        'options': ['\$20', '\$25', '\$30', '\$35']
-    },
-    {
-        'id': 15,
-        'question': 'What is 12 × 3?',
-        'options': ['24', '36', '48', '60']
-    },
-    {
-        'id': 16,
-        'question': 'If today is Monday, what day is it in three days?',
-        'options': ['Tuesday', 'Wednesday', 'Thursday', 'Friday']
-    },
-    {
-        'id': 17,
-        'question': 'What is the opposite of "hot"?',
-        'options': ['Warm', 'Cold', 'Wet', 'Dry']
-    },
-    {
-        'id': 18,
-        'question': 'Complete this sentence: "The sky is ___."',
-        'options': ['Green', 'Blue', 'Red', 'Black']
-    },
-    {
-        'id': 19,
-        'question': 'Spell "WORLD" backward.',
-        'options': ['DLROW', 'DROWL', 'DLORW', 'DRLOW']
-    },
-    {
-        'id': 20,
-        'question': 'Which does not belong: Apple, Banana, Carrot, Orange?',
-        'options': ['Apple', 'Banana', 'Carrot', 'Orange']
-    },
-    {
-        'id': 21,
-        'question': 'What comes next: 2, 4, 6, 8, ___?',
-        'options': ['9', '10', '12', '14']
-    },
-    {
-        'id': 22,
-        'question': 'How many quarters make \$1.50?',
-        'options': ['3', '4', '5', '6']
-    },
-    {
-        'id': 23,
-        'question': 'Who was the first U.S. president?',
-        'options': ['Thomas Jefferson', 'George Washington', 'Abraham Lincoln', 'John Adams']
-    },
-    {
-        'id': 24,
-        'question': 'Which ocean is between the U.S. and Europe?',
-        'options': ['Pacific', 'Indian', 'Atlantic', 'Arctic']
-    },
-    {
-        'id': 25,
-        'question': 'What is the main color of the U.S. flag?',
-        'options': ['Red', 'Blue', 'Green', 'White']
-    },
-    {
-        'id': 26,
-        'question': 'Which shape has four equal sides?',
-        'options': ['Triangle', 'Circle', 'Square', 'Rectangle']
-    },
-    {
-        'id': 27,
-        'question': 'Which of these is a triangle? (○, △, □, ☆)',
-        'options': ['○', '△', '□', '☆']
-    },
-    {
-        'id': 28,
-        'question': 'Tap the table when I say "A": B, C, A, D, A, F.',
-        'options': ['(Assess response)']
-    },
-    {
-        'id': 29,
-        'question': 'Name the months of the year in order.',
-        'options': ['(Assess sequencing)']
-    },
-    {
-        'id': 30,
-        'question': 'What is your birth date?',
-        'options': ['(Open-ended)']
-    },
-    {
-        'id': 31,
-        'question': 'Where were you born?',
-        'options': ['(Open-ended)']
-    },
-    {
-        'id': 32,
-        'question': 'What is 100 minus 7?',
-        'options': ['93', '83', '73', '63']
-    },
-    {
-        'id': 33,
-        'question': 'Which is heavier: a pound of feathers or a pound of bricks?',
-        'options': ['Feathers', 'Bricks', 'They weigh the same', 'Depends']
-    },
-    {
-        'id': 34,
-        'question': 'What is the capital of your country?',
-        'options': ['(Open-ended)']
-    },
-    {
-        'id': 35,
-        'question': 'What do you use to write on paper?',
-        'options': ['Spoon', 'Pen', 'Hammer', 'Leaf']
-    },
-    {
-        'id': 36,
-        'question': 'What is the color of a ripe banana?',
-        'options': ['Red', 'Blue', 'Yellow', 'Green']
-    },
-    {
-        'id': 37,
-        'question': 'How many days are in a week?',
-        'options': ['5', '6', '7', '8']
-    },
-    {
-        'id': 38,
-        'question': 'What is the largest number: 5, 3, 9, 2?',
-        'options': ['5', '3', '9', '2']
-    },
-    {
-        'id': 39,
-        'question': 'What is the name of this object? (Show a pencil)',
-        'options': ['🖊️', '✏️', '📏', '🩹']
-    },
-    {
-        'id': 40,
-        'question': 'Repeat these words: "Cat, Ball, Shoe."',
-        'options': ['(Assess recall)']
-    },
-    {
-        'id': 41,
-        'question': 'What time is it when the big hand is on 12 and the small hand is on 3?',
-        'options': ['12:00', '3:00', '6:00', '9:00']
-    },
-    {
-        'id': 42,
-        'question': 'Which is not a season: Winter, Summer, December, Spring?',
-        'options': ['Winter', 'Summer', 'December', 'Spring']
-    },
-    {
-        'id': 43,
-        'question': 'What is the name of the current year?',
-        'options': ['(Open-ended)']
-    },
-    {
-        'id': 44,
-        'question': 'Point to the ceiling.',
-        'options': ['(Assess response)']
-    },
-    {
-        'id': 45,
-        'question': 'What do you call the thing you use to cut paper?',
-        'options': ['Spoon', 'Scissors', 'Plate', 'Sock']
-    },
-    {
-        'id': 46,
-        'question': 'How many legs does a chair usually have?',
-        'options': ['1', '2', '3', '4']
-    },
-    {
-        'id': 47,
-        'question': 'What is the name of your spouse/partner?',
-        'options': ['(Open-ended)']
-    },
-    {
-        'id': 48,
-        'question': 'What is the opposite of "day"?',
-        'options': ['Night', 'Morning', 'Evening', 'Noon']
-    },
-    {
-        'id': 49,
-        'question': 'What is the shape of a stop sign?',
-        'options': ['Circle', 'Square', 'Octagon', 'Triangle']
-    },
-    {
-        'id': 50,
-        'question': 'What do you wear on your feet?',
-        'options': ['Hat', 'Shoes', 'Gloves', 'Scarf']
-    }
-]
-
+@query_budget(0)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def cognitive_test_questions(request):
-    return JsonResponse({'questions': QUESTIONS})
+    # Encoded, compressed and hashed once per question bank version
+    return get_question_bank().payload.response(request)
+
+
+def record_cognitive_test(patient, answers, score, correct_answers, total_questions, bank):
+    """
+    Store a test result with the assessment it leads to, and schedule the
+    recompute that stores the recommendations. Run it in a transaction, so
+    the writes land all or nothing. Returns the submit_cognitive_test
+    response body.
+    """
+    # Waits for a recompute of this patient that is running
+    lock_patient(patient.pk)
+    test_result = CognitiveTestResult.objects.create(
+        patient=patient,
+        score=score,
+        total_questions=total_questions,
+        correct_answers=correct_answers,
+        details=answers,
+        bank_version=bank.version
+    )
+    body = {
+        'test_result': CognitiveTestResultSerializer(test_result).data,
+        'score': score
+    }
+
+    latest_lifestyle = LifestyleData.objects.filter(user_id=patient.user_id).order_by('-date').first()
+
+    if latest_lifestyle:
+        evaluation = get_scoring_rules().evaluate(score, lifestyle_values(latest_lifestyle))
+
+        # One assessment per patient per day; earlier days are the history
+        assessment, created = BrainHealthAssessment.objects.update_or_create(
+            patient=patient,
+            date=timezone.localdate(),
+            defaults={
+                'score': evaluation.score,
+                'cognitive_score': score,
+                'lifestyle_data': latest_lifestyle,
+                'rule_version': evaluation.version
+            }
+        )
+
+        # The stored recommendations are brought in line by a worker
+        recommendations = evaluation.recommendations
+        schedule_recompute(patient)
+
+        body['brain_health_assessment'] = BrainHealthAssessmentSerializer(assessment).data
+        body['recommendations'] = recommendations
 
+    refresh_patient_snapshot(patient)
+    return body
 
+@query_budget(29)
 @api_view(['POST', 'GET'])
 @permission_classes([IsAuthenticated])
 def submit_cognitive_test(request):
@@ -704,76 +358,36 @@ def submit_cognitive_test(request):
         if not answers:
             return Response({'error': 'No answers provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-        total_questions = len(answers)
-        correct_answers = 0
-
-        for item in answers:
-            q_id = item.get('question_id')
-            user_answer = item.get('answer')
-            correct_answer = ANSWER_KEY.get(q_id)
-            if correct_answer and user_answer == correct_answer:
-                correct_answers += 1
-
-        score = round((correct_answers / total_questions) * 50, 1)
-
-        if request.user.is_authenticated and hasattr(request.user, 'patient'):
-            patient = request.user.patient
-
-            test_result = CognitiveTestResult.objects.create(
-                patient=patient,
-                score=score,
-                total_questions=total_questions,
-                correct_answers=correct_answers,
-                details=answers
-            )
-
-            latest_lifestyle = LifestyleData.objects.filter(user=request.user).order_by('-date').first()
-
-            if latest_lifestyle:
-                lifestyle_data = {
-                    'physical_activity': latest_lifestyle.physical_activity,
-                    'healthy_diet': latest_lifestyle.healthy_diet,
-                    'social_engagement': latest_lifestyle.social_engagement,
-                    'good_sleep': latest_lifestyle.good_sleep,
-                    'smoking': latest_lifestyle.smoking,
-                    'alcohol': latest_lifestyle.alcohol,
-                    'stress': latest_lifestyle.stress
-                }
-
-                brain_health_score = calculate_brain_health_score(score, lifestyle_data)
-
-                assessment, created = BrainHealthAssessment.objects.update_or_create(
-                    patient=patient,
-                    defaults={
-                        'score': brain_health_score,
-                        'cognitive_score': score,
-                        'lifestyle_data': latest_lifestyle,
-                        'date': datetime.now().date()
-                    }
-                )
-
-                recommendations = generate_recommendations(brain_health_score, lifestyle_data)
-
-                for rec in recommendations:
-                    Recommendation.objects.create(
-                        patient=patient,
-                        category=rec['category'],
-                        title=rec['title'],
-                        description=rec['description'],
-                        priority=rec['priority']
+        bank = get_question_bank()
+        score, correct_answers, total_questions = bank.compiled_key.score(answers)
+
+        if request.role.is_patient:
+            try:
+                key = idempotency_key(request)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # A retried submission gets the original response back
+            digest = request_hash(data)
+            if key:
+                replayed = stored_response(request.user, 'submit_cognitive_test', key, digest)
+                if replayed is not None:
+                    return replayed
+
+            try:
+                with transaction.atomic():
+                    body = record_cognitive_test(
+                        request.role.patient, answers, score, correct_answers, total_questions, bank
                     )
-
-                return Response({
-                    'test_result': CognitiveTestResultSerializer(test_result).data,
-                    'brain_health_assessment': BrainHealthAssessmentSerializer(assessment).data,
-                    'recommendations': recommendations,
-                    'score': score
-                })
-
-            return Response({
-                'test_result': CognitiveTestResultSerializer(test_result).data,
-                'score': score
-            })
+                    if key:
+                        store_response(request.user, 'submit_cognitive_test', key, digest, body)
+            except IntegrityError:
+                # A concurrent retry with the same key got there first
+                replayed = stored_response(request.user, 'submit_cognitive_test', key, digest) if key else None
+                if replayed is None:
+                    raise
+                return replayed
+            return Response(body)
 
         return Response({
             'score': score,
@@ -783,59 +397,55 @@ def submit_cognitive_test(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def cognitive_test_history(request):
     """Get a patient's cognitive test history"""
     try:
-        if not hasattr(request.user, 'patient'):
+        if not request.role.is_patient:
             return Response(
                 {'error': 'Only patients have cognitive test history'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        patient = request.user.patient
-        tests = CognitiveTestResult.objects.filter(patient=patient).order_by('-date_taken')
-        serializer = CognitiveTestResultSerializer(tests, many=True)
-        
-        # Calculate stats
-        if tests.exists():
-            stats = {
-                'average_score': tests.aggregate(Avg('score'))['score__avg'],
-                'highest_score': tests.aggregate(Max('score'))['score__max'],
-                'lowest_score': tests.aggregate(Min('score'))['score__min'],
-                'total_tests': tests.count()
-            }
-        else:
-            stats = {}
+        patient = request.role.patient
+        tests = CognitiveTestResult.objects.filter(patient=patient)
+        page, next_cursor = paginate_keyset(tests, request, ('-date_taken', '-id'))
+        serializer = CognitiveTestResultSerializer(page, many=True)
         
         return Response({
             'tests': serializer.data,
-            'stats': stats
+            'next_cursor': next_cursor
         })
     
+    except InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response(
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(3)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 @authentication_classes([SessionAuthentication])
 def lifestyle_data(request):
     """
     Handle lifestyle data submission and retrieval
-    - GET: Returns all lifestyle entries for the authenticated user
+    - GET: Returns one page of lifestyle entries for the authenticated user,
+      newest first; pass `next_cursor` back as `?cursor=` for the next page
     - POST: Creates a new lifestyle entry for the authenticated user
     """
     try:
         if request.method == 'GET':
-            entries = LifestyleData.objects.filter(user=request.user).order_by('-date')
-            serializer = LifestyleDataSerializer(entries, many=True)
+            entries = LifestyleData.objects.filter(user=request.user)
+            page, next_cursor = paginate_keyset(entries, request, ('-date', '-id'))
+            serializer = LifestyleDataSerializer(page, many=True)
             return Response({
-                'count': entries.count(),
-                'results': serializer.data
+                'results': serializer.data,
+                'next_cursor': next_cursor
             })
         
         elif request.method == 'POST':
@@ -849,17 +459,22 @@ def lifestyle_data(request):
 
             serializer = LifestyleDataSerializer(data=request.data)
             if serializer.is_valid():
-                # Save with the authenticated user
-                serializer.save(user=request.user)
-                
-                # If user is a patient, update brain health assessment
-                if hasattr(request.user, 'patient'):
-                    update_brain_health_assessment(request.user)
+                with transaction.atomic():
+                    # Save with the authenticated user
+                    serializer.save(user=request.user)
+                    
+                    # If user is a patient, refresh the dashboard snapshot now and
+                    # queue the brain health assessment update
+                    if request.role.is_patient:
+                        refresh_patient_snapshot(request.role.patient)
+                        schedule_recompute(request.role.patient)
                 
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+    except InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Error in lifestyle_data: {str(e)}")
         return Response(
@@ -867,54 +482,173 @@ def lifestyle_data(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
-def update_brain_health_assessment(user):
-    """Helper function to update brain health assessment after lifestyle data changes"""
+@query_budget(28)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def lifestyle_data_bulk(request):
+    """
+    Upsert a batch of lifestyle entries, e.g. days queued by an offline client
+    - Body: {"entries": [{...}, ...]}, one object per day in the lifestyle_data format
+    - Existing entries for the same date are overwritten
+    - Returns a status per entry and recomputes the assessment once per batch
+    """
     try:
-        patient = user.patient
-        latest_test = CognitiveTestResult.objects.filter(patient=patient).order_by('-date_taken').first()
-        latest_lifestyle = LifestyleData.objects.filter(user=user).order_by('-date').first()
-
-        if latest_test and latest_lifestyle:
-            lifestyle_data = {
-                'physical_activity': latest_lifestyle.physical_activity,
-                'healthy_diet': latest_lifestyle.healthy_diet,
-                'social_engagement': latest_lifestyle.social_engagement,
-                'good_sleep': latest_lifestyle.good_sleep,
-                'smoking': latest_lifestyle.smoking,
-                'alcohol': latest_lifestyle.alcohol,
-                'stress': latest_lifestyle.stress
+        entries = request.data.get('entries') if isinstance(request.data, dict) else request.data
+        if not isinstance(entries, list) or not entries:
+            return Response(
+                {'error': 'entries must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_entries = getattr(settings, 'LIFESTYLE_BULK_MAX_ENTRIES', 366)
+        if len(entries) > max_entries:
+            return Response(
+                {'error': f'At most {max_entries} entries can be sent per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = []
+        valid = set()
+        for index, entry in enumerate(entries):
+            serializer = LifestyleDataSerializer(data=entry)
+            if not serializer.is_valid():
+                results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+                continue
+
+            data = serializer.validated_data
+            date = data.get('date') or timezone.localdate()
+            if date in valid:
+                results.append({
+                    'index': index,
+                    'date': date,
+                    'status': 'error',
+                    'errors': {'date': ['Duplicate date in batch']}
+                })
+                continue
+
+            valid.add(date)
+            results.append(LifestyleData(user=request.user, date=date, **{
+                field: value for field, value in data.items() if field != 'date'
+            }))
+
+        rows = [row for row in results if isinstance(row, LifestyleData)]
+
+        with transaction.atomic():
+            existing = {
+                entry.date: entry_state(entry)
+                for entry in LifestyleData.objects.filter(user=request.user, date__in=list(valid))
             }
-            
-            brain_health_score = calculate_brain_health_score(latest_test.score, lifestyle_data)
-            
-            assessment, created = BrainHealthAssessment.objects.update_or_create(
-                patient=patient,
-                defaults={
-                    'score': brain_health_score,
-                    'cognitive_score': latest_test.score,
-                    'lifestyle_data': latest_lifestyle,
-                    'date': datetime.now().date()
+            LifestyleData.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['user', 'date'],
+                update_fields=LIFESTYLE_FACTORS + ['notes']
+            )
+
+            # bulk_create sends no signals, so log the sync changes here
+            record_changes(LifestyleData, request.user.id, LifestyleData.objects.filter(
+                user=request.user, date__in=list(valid)
+            ).values_list('id', flat=True))
+            update_lifestyle_stats(request.user.id, [(existing.get(row.date), entry_state(row)) for row in rows])
+            refresh_lifestyle_rollups(request.user.id, valid)
+
+            # One snapshot refresh and one queued recompute for the whole batch
+            if valid and request.role.is_patient:
+                refresh_patient_snapshot(request.role.patient)
+                schedule_recompute(request.role.patient)
+
+        for index, row in enumerate(results):
+            if isinstance(row, LifestyleData):
+                results[index] = {
+                    'index': index,
+                    'date': row.date,
+                    'status': 'updated' if row.date in existing else 'created'
                 }
+
+        return Response({
+            'results': results,
+            'created': sum(1 for row in results if row['status'] == 'created'),
+            'updated': sum(1 for row in results if row['status'] == 'updated'),
+            'failed': sum(1 for row in results if row['status'] == 'error')
+        })
+
+    except Exception as e:
+        logger.error(f"Error in lifestyle_data_bulk: {str(e)}")
+        return Response(
+            {'error': 'An error occurred while processing your request'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_history(request, dataset):
+    """
+    Stream a full lifestyle or cognitive test history for offline review
+    - ?output=ndjson (default) or ?output=csv
+    - ?patient_id=<id> lets a caregiver export one of their patients
+    Rows are written to the response as they are read from the database.
+    """
+    try:
+        if dataset not in DATASETS:
+            return Response({'error': 'Unknown dataset'}, status=status.HTTP_404_NOT_FOUND)
+
+        output = request.query_params.get('output', 'ndjson')
+        if output not in RENDERERS:
+            return Response(
+                {'error': f"Unsupported output format, use one of: {', '.join(RENDERERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            # Generate new recommendations
-            Recommendation.objects.filter(patient=patient, completed=False).delete()
-            recommendations = generate_recommendations(brain_health_score, lifestyle_data)
-            
-            for rec in recommendations:
-                Recommendation.objects.create(
-                    patient=patient,
-                    category=rec['category'],
-                    title=rec['title'],
-                    description=rec['description'],
-                    priority=rec['priority']
+
+        patient_id = request.query_params.get('patient_id')
+        if patient_id:
+            if not request.role.is_caregiver:
+                return Response(
+                    {'error': 'Only caregivers can export patient data'},
+                    status=status.HTTP_403_FORBIDDEN
                 )
-            
-            return assessment
+            if not patient_id.isdigit():
+                return Response(
+                    {'error': 'patient_id must be a patient id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            patient = request.role.caregiver.patients.select_related('user').get(id=patient_id)
+        elif request.role.is_patient:
+            patient = request.role.patient
+        else:
+            patient = None
+
+        if dataset == 'lifestyle':
+            owner = patient.user if patient else request.user
+        elif patient:
+            owner = patient
+        else:
+            return Response(
+                {'error': 'Only patients have cognitive test history'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        response = StreamingHttpResponse(
+            RENDERERS[output](dataset, export_rows(dataset, owner)),
+            content_type=CONTENT_TYPES[output]
+        )
+        filename = f"{dataset}-{owner.pk}.{output}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    except Patient.DoesNotExist:
+        return Response(
+            {'error': 'Patient not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
     except Exception as e:
-        logger.error(f"Error updating brain health assessment: {str(e)}")
-        return None
+        logger.error(f"Error in export_history: {str(e)}")
+        return Response(
+            {'error': 'An error occurred while processing your request'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
+@query_budget(1)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def lifestyle_stats(request):
@@ -925,52 +659,33 @@ def lifestyle_stats(request):
     try:
         # Get time period filter (default: 30 days)
         time_period = request.GET.get('period', '30d')
-        
-        if time_period == '7d':
-            date_filter = datetime.now() - timedelta(days=7)
-        elif time_period == '30d':
-            date_filter = datetime.now() - timedelta(days=30)
-        elif time_period == '90d':
-            date_filter = datetime.now() - timedelta(days=90)
-        else:  # All time
-            date_filter = None
-
-        # Base queryset
-        queryset = LifestyleData.objects.filter(user=request.user)
-        if date_filter:
-            queryset = queryset.filter(date__gte=date_filter)
-
-        if not queryset.exists():
-            return Response({'message': 'No lifestyle data available for the selected period'})
+        window = time_period if time_period in STATS_WINDOWS else 'all'
 
-        # Calculate averages
-        averages = queryset.aggregate(
-            avg_physical_activity=Avg('physical_activity'),
-            avg_healthy_diet=Avg('healthy_diet'),
-            avg_social_engagement=Avg('social_engagement'),
-            avg_good_sleep=Avg('good_sleep'),
-            avg_stress=Avg('stress'),
-            avg_smoking=Avg('smoking'),
-            avg_alcohol=Avg('alcohol')
-        )
+        # Windows are maintained on every lifestyle write
+        stats = get_lifestyle_stats(request.user.id)
+        counts = stats.windows[window]
+        entry_count = counts['count']
 
-        # Calculate totals where applicable
-        totals = queryset.aggregate(
-            total_physical_activity=Sum('physical_activity'),
-            total_healthy_meals=Sum('healthy_diet')
-        )
+        if not entry_count:
+            return Response({'message': 'No lifestyle data available for the selected period'})
 
-        # Get latest entry
-        latest_entry = LifestyleDataSerializer(
-            queryset.order_by('-date').first()
-        ).data
+        sums = counts['sums']
+        averages = {
+            f'avg_{factor}': sums[factor] / entry_count
+            for factor in ('physical_activity', 'healthy_diet', 'social_engagement',
+                           'good_sleep', 'stress', 'smoking', 'alcohol')
+        }
+        totals = {
+            'total_physical_activity': sums['physical_activity'],
+            'total_healthy_meals': sums['healthy_diet']
+        }
 
         return Response({
             'period': time_period,
             'averages': averages,
             'totals': totals,
-            'latest_entry': latest_entry,
-            'entry_count': queryset.count()
+            'latest_entry': LifestyleDataSerializer(stats.latest_entry).data,
+            'entry_count': entry_count
         })
 
     except Exception as e:
@@ -980,6 +695,7 @@ def lifestyle_stats(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(1)
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def lifestyle_trends(request):
@@ -990,35 +706,36 @@ def lifestyle_trends(request):
     try:
         # Get grouping parameter (default: week)
         group_by = request.GET.get('group_by', 'week')
-        
-        queryset = LifestyleData.objects.filter(user=request.user)
-        
-        if not queryset.exists():
+        if group_by != 'month':
+            group_by = 'week'
+
+        # Read from the calendar rollups maintained on every lifestyle write
+        buckets = get_lifestyle_rollups(request.user.id, group_by)
+
+        if not buckets:
             return Response({'message': 'No lifestyle data available'})
 
-        # Annotate with time period
-        if group_by == 'month':
-            queryset = queryset.extra(
-                select={'period': "DATE_FORMAT(date, '%%Y-%%m')"}
-            ).values('period').annotate(
-                physical_activity=Avg('physical_activity'),
-                healthy_diet=Avg('healthy_diet'),
-                social_engagement=Avg('social_engagement'),
-                good_sleep=Avg('good_sleep'),
-                stress=Avg('stress')
-            ).order_by('period')
-        else:  # week
-            queryset = queryset.extra(
-                select={'period': "CONCAT(YEAR(date), '-', WEEK(date))"}
-            ).values('period').annotate(
-                physical_activity=Avg('physical_activity'),
-                healthy_diet=Avg('healthy_diet'),
-                social_engagement=Avg('social_engagement'),
-                good_sleep=Avg('good_sleep'),
-                stress=Avg('stress')
-            ).order_by('period')
-
-        return Response(list(queryset))
+        trends = []
+        for bucket in buckets:
+            start = bucket['period_start']
+            if group_by == 'month':
+                period = start.strftime('%Y-%m')
+            else:
+                year, week, _ = start.isocalendar()
+                period = f'{year}-W{week:02d}'
+
+            count = bucket['entry_count']
+            trends.append({
+                'period': period,
+                'period_start': start,
+                'physical_activity': bucket['physical_activity'] / count,
+                'healthy_diet': bucket['healthy_diet'] / count,
+                'social_engagement': bucket['social_engagement'] / count,
+                'good_sleep': bucket['good_sleep'] / count,
+                'stress': bucket['stress'] / count
+            })
+
+        return Response(trends)
 
     except Exception as e:
         logger.error(f"Error in lifestyle_trends: {str(e)}")
@@ -1028,37 +745,30 @@ def lifestyle_trends(request):
         )
 
 # Brain Health Assessment Views
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def brain_health_history(request):
     """Get brain health assessment history"""
     try:
-        if not hasattr(request.user, 'patient'):
+        if not request.role.is_patient:
             return Response(
                 {'error': 'Only patients have brain health assessments'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        patient = request.user.patient
-        assessments = BrainHealthAssessment.objects.filter(patient=patient).order_by('-date')
-        serializer = BrainHealthAssessmentSerializer(assessments, many=True)
-        
-        # Calculate stats
-        if assessments.exists():
-            stats = {
-                'average_score': assessments.aggregate(Avg('score'))['score__avg'],
-                'highest_score': assessments.aggregate(Max('score'))['score__max'],
-                'lowest_score': assessments.aggregate(Min('score'))['score__min'],
-                'total_assessments': assessments.count()
-            }
-        else:
-            stats = {}
+        patient = request.role.patient
+        assessments = BrainHealthAssessment.objects.filter(patient=patient)
+        page, next_cursor = paginate_keyset(assessments, request, ('-date', '-id'))
+        serializer = BrainHealthAssessmentSerializer(page, many=True)
         
         return Response({
             'assessments': serializer.data,
-            'stats': stats
+            'next_cursor': next_cursor
         })
     
+    except InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response(
             {'error': str(e)}, 
@@ -1066,18 +776,19 @@ def brain_health_history(request):
         )
 
 # Recommendation Views
+@query_budget(1)
 @api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def recommendations(request, pk=None):
     """Get or update recommendations"""
     try:
-        if not hasattr(request.user, 'patient'):
+        if not request.role.is_patient:
             return Response(
                 {'error': 'Only patients have recommendations'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        patient = request.user.patient
+        patient = request.role.patient
         
         if request.method == 'GET':
             if pk:
@@ -1085,17 +796,27 @@ def recommendations(request, pk=None):
                 recommendation = Recommendation.objects.get(id=pk, patient=patient)
                 serializer = RecommendationSerializer(recommendation)
             else:
-                # Get all recommendations
-                recommendations = Recommendation.objects.filter(patient=patient).order_by('-priority', '-date_created')
-                serializer = RecommendationSerializer(recommendations, many=True)
+                # Get one page of recommendations, newest first within each
+                # priority. Priorities sort as strings, descending (medium,
+                # low, high), the order this endpoint has always returned.
+                recommendations = Recommendation.objects.filter(patient=patient)
+                page, next_cursor = paginate_keyset(
+                    recommendations, request, ('-priority', '-date_created', '-id')
+                )
+                return Response({
+                    'results': RecommendationSerializer(page, many=True).data,
+                    'next_cursor': next_cursor
+                })
             
             return Response(serializer.data)
         
         elif request.method == 'PATCH':
             # Mark recommendation as completed
-            recommendation = Recommendation.objects.get(id=pk, patient=patient)
-            recommendation.completed = request.data.get('completed', recommendation.completed)
-            recommendation.save()
+            with transaction.atomic():
+                recommendation = Recommendation.objects.get(id=pk, patient=patient)
+                recommendation.completed = request.data.get('completed', recommendation.completed)
+                recommendation.save()
+                refresh_patient_snapshot(patient)
             
             return Response(RecommendationSerializer(recommendation).data)
     
@@ -1104,25 +825,64 @@ def recommendations(request, pk=None):
             {'error': 'Recommendation not found'}, 
             status=status.HTTP_404_NOT_FOUND
         )
+    except InvalidCursor:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response(
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+# Sync Views
+@query_budget(5)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    """
+    Delta feed for mobile clients
+    - ?since=<token>: changes to lifestyle data, cognitive tests, assessments
+      and recommendations after the token, with tombstones for deleted rows
+    - without `since`: no changes, just the current token to sync from
+    Keep calling with `next_token` while `has_more` is true.
+    """
+    try:
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'changes': [], 'next_token': latest_token(request.user), 'has_more': False})
+
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'error': 'Invalid sync token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        changes, next_token, has_more = read_changes(request.user, since)
+        return Response({
+            'changes': changes,
+            'next_token': next_token,
+            'has_more': has_more
+        })
+
+    except Exception as e:
+        logger.error(f"Error in sync_changes: {str(e)}")
+        return Response(
+            {'error': 'An error occurred while processing your request'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 # Caregiver-Patient Management Views
+@query_budget(11)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def send_verification(request):
     """Send verification code to patient for caregiver connection"""
     try:
-        if not hasattr(request.user, 'caregiver'):
+        if not request.role.is_caregiver:
             return Response(
                 {'message': 'Only caregivers can send verification'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        caregiver = request.user.caregiver
+        caregiver = request.role.caregiver
         patient_email = request.data.get('patient_email')
         
         if not patient_email:
@@ -1146,22 +906,20 @@ def send_verification(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Generate and store verification code
+        # Generate and store verification code, and queue the email with it
         code = str(random.randint(100000, 999999))
-        PendingVerification.objects.update_or_create(
-            caregiver=caregiver,
-            patient=patient,
-            defaults={'verification_code': code}
-        )
-        
-        # Send email
-        send_mail(
-            'Caregiver Connection Request',
-            f'Your verification code is: {code}\n\nShare this code with your caregiver to connect.',
-            settings.DEFAULT_FROM_EMAIL,
-            [patient_email],
-            fail_silently=False,
-        )
+        with transaction.atomic():
+            PendingVerification.objects.update_or_create(
+                caregiver=caregiver,
+                patient=patient,
+                defaults={'verification_code': code}
+            )
+            enqueue(
+                'send_email',
+                subject='Caregiver Connection Request',
+                message=f'Your verification code is: {code}\n\nShare this code with your caregiver to connect.',
+                recipient_list=[patient_email]
+            )
         
         return Response({'message': 'Verification code sent'})
     
@@ -1171,18 +929,19 @@ def send_verification(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def verify_patient(request):
     """Verify patient connection with verification code"""
     try:
-        if not hasattr(request.user, 'caregiver'):
+        if not request.role.is_caregiver:
             return Response(
                 {'message': 'Only caregivers can verify patients'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        caregiver = request.user.caregiver
+        caregiver = request.role.caregiver
         patient_email = request.data.get('patient_email')
         verification_code = request.data.get('verification_code')
         
@@ -1200,7 +959,7 @@ def verify_patient(request):
             )
             
             # Add relationship
-            caregiver.patients.add(verification.patient)
+            caregiver.patients.add(verification.patient_id)
             verification.delete()
             
             return Response({'message': 'Patient successfully added'})
@@ -1217,19 +976,20 @@ def verify_patient(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def caregiver_patients(request):
     """Get list of patients connected to a caregiver"""
     try:
-        if not hasattr(request.user, 'caregiver'):
+        if not request.role.is_caregiver:
             return Response(
                 {'error': 'User is not a caregiver'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        caregiver = request.user.caregiver
-        patients = caregiver.patients.all()
+        caregiver = request.role.caregiver
+        patients = caregiver.patients.select_related('user')
         serializer = PatientDataSerializer(patients, many=True)
         
         return Response(serializer.data)
@@ -1240,18 +1000,19 @@ def caregiver_patients(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_patient(request):
     """Add a patient to caregiver's list (admin function)"""
     try:
-        if not hasattr(request.user, 'caregiver'):
+        if not request.role.is_caregiver:
             return Response(
                 {'error': 'User is not a caregiver'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        caregiver = request.user.caregiver
+        caregiver = request.role.caregiver
         patient_id = request.data.get('patient_id')
         
         if not patient_id:
@@ -1284,18 +1045,19 @@ def add_patient(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@query_budget(2)
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def remove_patient(request, patient_id):
     """Remove a patient from caregiver's list"""
     try:
-        if not hasattr(request.user, 'caregiver'):
+        if not request.role.is_caregiver:
             return Response(
                 {'error': 'User is not a caregiver'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        caregiver = request.user.caregiver
+        caregiver = request.role.caregiver
         
         try:
             patient = Patient.objects.get(id=patient_id)
@@ -1312,3 +1074,40 @@ def remove_patient(request, patient_id):
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+@query_budget(0)
+@require_GET
+def prometheus_metrics(request):
+    """Per-endpoint request metrics of all workers, in Prometheus text format"""
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', [])
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+
+    return HttpResponse(
+        metrics.render(metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@query_budget(0)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def download_profile(request, profile_id):
+    """
+    Download a stored request profile: ?kind=cpu (default) is a collapsed
+    stack file for flame graph tools, ?kind=memory the allocation report
+    """
+    kind = request.query_params.get('kind', 'cpu')
+    path = profiling.profile_path(profile_id, kind)
+    if path is None:
+        return Response({'error': 'Invalid profile id or kind'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        response = FileResponse(
+            open(path, 'rb'),
+            as_attachment=True,
+            filename=os.path.basename(path),
+            content_type=profiling.PROFILE_FILES[kind][1]
+        )
+    except FileNotFoundError:
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    return response
@@ -38,10 +38,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.ProfilingMiddleware',
+    'api.middleware.RoleMiddleware',
+    'api.middleware.ClaimsMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -131,14 +135,78 @@ CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'api.authentication.ClaimsAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
+
+# Keyset pagination of the history endpoints (?page_size= is capped at the max)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Largest batch accepted by lifestyle-data/bulk/
+LIFESTYLE_BULK_MAX_ENTRIES = 366
+
+# Most change-log entries returned per changes/ call
+CHANGE_FEED_PAGE_SIZE = 500
+
+# Per-worker metric files summed by the metrics/ endpoint; clear it on deploy
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/prodim-metrics')
+METRICS_FLUSH_INTERVAL = 1.0  # seconds
+# Scrapers allowed without a staff session, comma-separated; none unless
+# configured. Behind a reverse proxy every request comes from the proxy's
+# address, so only list addresses that reach the workers directly.
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+
+# Staff request profiles (?profile=1 / X-Profile: 1), downloadable from profiles/<id>/.
+# Profiling a request changes process-wide state (tracemalloc, the thread
+# switch interval) for every thread of the worker while it runs, so it is
+# off unless PROFILE_REQUESTS=1: turn it on for a dedicated worker only.
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS') == '1'
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/prodim-profiles')
+PROFILE_SAMPLE_INTERVAL = 0.001  # seconds between stack samples
+
+# Cache of every worker process. Set REDIS_URL to share it between them;
+# without it each process has a memory cache of its own, and whatever one
+# worker invalidates there stays cached in the others.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Whether CACHES['default'] is seen by every worker (not a per-process cache)
+SHARED_CACHE = bool(REDIS_URL)
+
+# Authenticated API tokens, kept in the cache and a per-worker LRU. The
+# local TTL bounds how long a worker accepts a token revoked elsewhere.
+# Without a shared cache, tokens are cached for the local TTL only.
+AUTH_TOKEN_CACHE_TTL = 300  # seconds, with a shared cache
+AUTH_TOKEN_LOCAL_TTL = 10  # seconds
+AUTH_TOKEN_LOCAL_CACHE_SIZE = 10000
+
+# Signed claims cookie (user id, roles) that lets session requests such as
+# check-auth/ skip the session and user reads until it expires or is revoked.
+# Only used with a shared cache (SHARED_CACHE), where revocations live.
+AUTH_CLAIMS_COOKIE = 'prodim_claims'
+AUTH_CLAIMS_TTL = 300  # seconds
+
+# Follow-up work (e-mail, recomputes) run by `manage.py run_tasks` workers.
+# Failed tasks retry with exponential backoff, then are kept as dead.
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 5  # seconds before the first retry, doubled for each one
+TASK_RETRY_MAX_DELAY = 3600  # seconds
+# Running tasks whose worker went quiet for this long are handed to another
+TASK_LOCK_TIMEOUT = 600  # seconds
+
+# Lifestyle entries and test results saved within the debounce window of
+# each other lead to one assessment recompute, at most MAX_DELAY later
+RECOMPUTE_DEBOUNCE = 5  # seconds
+RECOMPUTE_MAX_DELAY = 60  # seconds
 ALLOWED_HOSTS = ['*']
 
 LOGIN_URL = '/api/login/'